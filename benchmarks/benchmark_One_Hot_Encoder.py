@@ -0,0 +1,55 @@
+# compares the encoding throughput (sequences/second) of the lookup table based
+# One_Hot_Encoder with the former per-character dictionary lookup
+#
+# usage (from the repository root): python -m benchmarks.benchmark_One_Hot_Encoder [number of sequences] [sequence length]
+
+
+import sys
+from time import perf_counter
+import numpy as np
+
+
+from pysster.One_Hot_Encoder import One_Hot_Encoder
+
+
+def encode_per_character(encoder, sequence):
+    one_hot = np.zeros((len(sequence), len(encoder.table)), np.uint8)
+    one_hot[np.arange(len(sequence)), [encoder.table[x] for x in sequence]] = 1
+    return one_hot
+
+
+def decode_per_character(encoder, one_hot):
+    return ''.join(encoder.table_rev[x] for x in np.argmax(one_hot, axis=1))
+
+
+def measure(label, function, n):
+    start = perf_counter()
+    result = function()
+    seconds = perf_counter() - start
+    print("{:<36}{:>10.3f} s{:>14.0f} seqs/s".format(label, seconds, n / seconds))
+    return result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = np.random.RandomState(42)
+    alphabet = "ACGT"
+    raw = np.frombuffer(alphabet.encode(), dtype=np.uint8)[rng.randint(0, 4, (n, length))]
+    sequences = [raw[i].tobytes().decode() for i in range(n)]
+    encoder = One_Hot_Encoder(alphabet)
+    print("{} sequences of length {}\n".format(n, length))
+    ref = measure("encode, per character (old)",
+                  lambda: np.array([encode_per_character(encoder, seq) for seq in sequences]), n)
+    measure("encode, lookup table per sequence",
+            lambda: np.array([encoder.encode(seq) for seq in sequences]), n)
+    batch = measure("encode_batch, lookup table", lambda: encoder.encode_batch(sequences), n)
+    assert np.array_equal(ref, batch)
+    ref = measure("decode, per character (old)",
+                  lambda: [decode_per_character(encoder, x) for x in batch], n)
+    decoded = measure("decode_batch, lookup table", lambda: encoder.decode_batch(batch), n)
+    assert ref == decoded == sequences
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# compares the decompression throughput of get_handle for plain gzip files (gzip module) and
+# BGZF files (blocks decompressed by a thread pool) as well as the time to create a Data object
+#
+# usage (from the repository root): python -m benchmarks.benchmark_bgzf [size of the fasta file in MB]
+
+
+import sys
+import os
+import gzip
+import struct
+import zlib
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+import numpy as np
+
+
+from pysster.Data import Data
+from pysster import utils
+
+
+def measure(function):
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+
+def write_fasta(file_name, size, length, rng):
+    raw = np.frombuffer(b"ACGT", dtype=np.uint8)
+    with open(file_name, "wb") as handle:
+        for i in range(size // (length + 10)):
+            handle.write(b">" + str(i).encode() + b"\n" + raw[rng.randint(0, 4, length)].tobytes() + b"\n")
+
+
+def write_bgzf(file_name, data, block_size=65280):
+    # the block layout of bgzip, followed by the empty end-of-file block
+    with open(file_name, "wb") as handle:
+        for x in list(range(0, len(data), block_size)) + [len(data)]:
+            block = data[x:(x+block_size)]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated = compressor.compress(block) + compressor.flush()
+            handle.write(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00")
+            handle.write(struct.pack("<H", len(deflated) + 25) + deflated)
+            handle.write(struct.pack("<II", zlib.crc32(block), len(block)))
+
+
+def read_all(file_name, n_threads=None):
+    with utils.get_handle(file_name, "rb", n_threads) as handle:
+        while handle.read(1 << 22):
+            pass
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else int(200e6)
+    rng = np.random.RandomState(42)
+    folder = mkdtemp()
+    fasta = os.path.join(folder, "sequences.fasta")
+    write_fasta(fasta, size, 200, rng)
+    with open(fasta, "rb") as handle:
+        text = handle.read()
+    with gzip.open(fasta + ".gz", "wb", compresslevel=6) as handle:
+        handle.write(text)
+    write_bgzf(os.path.join(folder, "bgzf.fasta.gz"), text)
+    del text
+    runs = [("gzip", fasta + ".gz", None)]
+    threads = sorted(set([1, 2, 4, os.cpu_count()]))
+    runs += [("bgzf, {} threads".format(n), os.path.join(folder, "bgzf.fasta.gz"), n) for n in threads]
+    print("\n{:.0f} MB of fasta ({} cpus)".format(size / 1e6, os.cpu_count()))
+    print("{:<20}{:>12}{:>12}{:>12}".format("format", "read (s)", "MB/s", "Data (s)"))
+    for label, file_name, n_threads in runs:
+        _, read_time = measure(lambda: read_all(file_name, n_threads))
+        _, data_time = measure(lambda: Data([file_name], "ACGT", storage="index"))
+        print("{:<20}{:>12.3f}{:>12.1f}{:>12.3f}".format(label, read_time, size / 1e6 / read_time, data_time))
+    rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
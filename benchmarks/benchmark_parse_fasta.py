@@ -0,0 +1,98 @@
+# compares the parsing throughput (MB/second) of the block-wise bytes level fasta parser
+# with the former groupby based parser on plain and gzipped files, using two layouts:
+# RNAfold-like entries (one sequence line and one structure line) and long DNA entries
+# wrapped at 60 characters per line
+#
+# usage (from the repository root): python -m benchmarks.benchmark_parse_fasta [number of entries] [entry length] [repeats]
+
+
+import sys
+import os
+import gzip
+from itertools import groupby
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+import numpy as np
+
+
+from pysster import utils
+
+
+def parse_fasta_groupby(handle, joiner = ""):
+    delimiter = lambda line: line.startswith('>')
+    for is_header, block in groupby(handle, delimiter):
+        if is_header:
+            header = next(block)[1:].rstrip()
+        else:
+            yield(header, joiner.join(line.rstrip() for line in block))
+
+
+def measure(label, function, size, repeats):
+    # the best of several runs, single runs are too noisy to compare the parsers
+    seconds = float("inf")
+    for _ in range(repeats):
+        start = perf_counter()
+        result = function()
+        seconds = min(seconds, perf_counter() - start)
+    print("{:<48}{:>10.3f} s{:>10.1f} MB/s".format(label, seconds, size / seconds / 1e6))
+    return result
+
+
+def write_rnafold(file_name, n, length, rng):
+    raw = np.frombuffer(b"ACGU().", dtype=np.uint8)
+    with open(file_name, "wb") as handle:
+        for i in range(n):
+            sequence = raw[rng.randint(0, 4, length)].tobytes()
+            structure = raw[rng.randint(4, 7, length)].tobytes()
+            handle.write(b">" + str(i).encode() + b"\n" + sequence + b"\n" + structure + b" (-1.0)\n")
+
+
+def write_wrapped(file_name, n, length, rng):
+    raw = np.frombuffer(b"ACGT", dtype=np.uint8)
+    with open(file_name, "wb") as handle:
+        for i in range(n):
+            sequence = raw[rng.randint(0, 4, length)].tobytes()
+            lines = [sequence[x:(x+60)] for x in range(0, length, 60)]
+            handle.write(b">" + str(i).encode() + b"\n" + b"\n".join(lines) + b"\n")
+
+
+def parse(file_name, mode, parser, *args, **kwargs):
+    with utils.get_handle(file_name, mode) as handle:
+        return list(parser(handle, *args, **kwargs))
+
+
+def run(file_name, joiner, repeats):
+    size = os.path.getsize(file_name)
+    for kind, name in [("plain", file_name), ("gzip", file_name + ".gz")]:
+        ref = measure("{}, groupby (old)".format(kind),
+                      lambda: parse(name, "rt", parse_fasta_groupby, joiner), size, repeats)
+        parsed = measure("{}, parse_fasta".format(kind),
+                         lambda: parse(name, "rb", utils.parse_fasta, joiner), size, repeats)
+        assert parsed == ref
+        parsed = measure("{}, parse_fasta_bytes".format(kind),
+                         lambda: parse(name, "rb", utils.parse_fasta_bytes, joiner.encode()), size, repeats)
+        assert [(x.decode(), y.decode()) for x, y in parsed] == ref
+        measure("{}, parse_fasta_bytes (as_array)".format(kind),
+                lambda: parse(name, "rb", utils.parse_fasta_bytes, joiner.encode(), as_array = True), size, repeats)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    rng = np.random.RandomState(42)
+    folder = mkdtemp()
+    layouts = [("sequence/structure entries", os.path.join(folder, "rnafold.fasta"), write_rnafold, "_", n),
+               ("entries wrapped at 60 characters", os.path.join(folder, "wrapped.fasta"), write_wrapped, "", n//10)]
+    for title, file_name, writer, joiner, entries in layouts:
+        writer(file_name, entries, length * (1 if entries == n else 10), rng)
+        with open(file_name, "rb") as handle_in, gzip.open(file_name + ".gz", "wb") as handle_out:
+            handle_out.write(handle_in.read())
+        print("\n{} ({:.1f} MB)".format(title, os.path.getsize(file_name) / 1e6))
+        run(file_name, joiner, repeats)
+    rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
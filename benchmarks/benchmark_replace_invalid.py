@@ -0,0 +1,77 @@
+# compares the time to create a Data object from clean fasta files and from files with
+# invalid characters (N) that are replaced by random alphabet characters, together with the
+# time of the former replacement (one random generator per entry) on the same entries
+#
+# usage (from the repository root): python -m benchmarks.benchmark_replace_invalid [number of entries] [entry length] [fraction of N]
+
+
+import sys
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+import numpy as np
+
+
+from pysster.Data import Data
+from pysster import utils
+
+
+def measure(function):
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+
+def write_fasta(file_name, n, length, fraction, rng):
+    raw = np.frombuffer(b"ACGTN", dtype=np.uint8)
+    with open(file_name, "wb") as handle:
+        for i in range(n):
+            sequence = raw[rng.randint(0, 4, length)]
+            sequence[rng.random_sample(length) < fraction] = ord("N")
+            handle.write(b">" + str(i).encode() + b"\n" + sequence.tobytes() + b"\n")
+
+
+def replace_per_entry(values, bounds, offsets, seed, alphabet):
+    # the former implementation: one generator per entry with invalid characters
+    symbols = np.frombuffer(alphabet.encode(), dtype=np.uint8)
+    valid = np.zeros(256, dtype=bool)
+    valid[symbols] = True
+    mask = ~valid[values]
+    for row in np.unique(np.searchsorted(bounds, np.flatnonzero(mask), side="right") - 1):
+        rng = np.random.default_rng([seed, 0, offsets[row]])
+        entry = slice(bounds[row], bounds[row+1])
+        values[entry][mask[entry]] = symbols[rng.integers(0, len(symbols), mask[entry].sum(), dtype=np.uint8)]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.04
+    rng = np.random.RandomState(42)
+    folder = mkdtemp()
+    files = {"clean": os.path.join(folder, "clean.fasta"), "N-rich": os.path.join(folder, "n_rich.fasta")}
+    write_fasta(files["clean"], n, length, 0.0, rng)
+    write_fasta(files["N-rich"], n, length, fraction, rng)
+    print("\n{} entries of length {}, {:.0%} N in the N-rich file".format(n, length, fraction))
+    print("{:<32}{:>12}".format("step", "time (s)"))
+    times = {}
+    for label, file_name in files.items():
+        data, times[label] = measure(lambda: Data([file_name], "ACGT", storage="index", seed=1))
+        assert data.tokens.max() < 4
+        print("{:<32}{:>12.3f}".format("Data, " + label, times[label]))
+    with open(files["N-rich"], "rb") as handle:
+        entries = [x[1] for x in utils.parse_fasta_bytes(handle)]
+    values = np.frombuffer(b"".join(entries), dtype=np.uint8).copy()
+    bounds = np.arange(0, len(values) + 1, length)
+    _, seconds = measure(lambda: replace_per_entry(values, bounds, bounds[:-1], 1, "ACGT"))
+    print("{:<32}{:>12.3f}".format("replacement, per entry (old)", seconds))
+    # the replacement of the invalid characters must not dominate the loading time
+    ratio = times["N-rich"] / times["clean"]
+    print("N-rich / clean: {:.2f}".format(ratio))
+    assert ratio < 2, "the replacement of invalid characters is too slow"
+    rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# compares wall time and file size of save_data/load_data (binary format with raw or
+# zlib compressed blocks) with the former gzip-pickle format, for one-hot and index storage
+#
+# usage (from the repository root): python -m benchmarks.benchmark_save_data [number of entries] [entry length]
+
+
+import sys
+import os
+import gzip
+import pickle
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+import numpy as np
+
+
+from pysster.Data import Data
+from pysster import utils
+
+
+def save_data_gzip(data, file_path):
+    with gzip.open(file_path, "wb") as handle:
+        pickle.dump(data, handle, pickle.HIGHEST_PROTOCOL)
+
+
+def load_data_gzip(file_path):
+    with gzip.open(file_path, "rb") as handle:
+        return pickle.load(handle)
+
+
+def measure(function):
+    start = perf_counter()
+    result = function()
+    return result, perf_counter() - start
+
+
+def write_fasta(file_name, n, length, rng):
+    raw = np.frombuffer(b"ACGT", dtype=np.uint8)
+    with open(file_name, "wb") as handle:
+        for i in range(n):
+            handle.write(b">" + str(i).encode() + b"\n" + raw[rng.randint(0, 4, length)].tobytes() + b"\n")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = np.random.RandomState(42)
+    folder = mkdtemp()
+    fasta = [os.path.join(folder, "class_{}.fasta".format(x)) for x in range(2)]
+    for file_name in fasta:
+        write_fasta(file_name, n // 2, length, rng)
+    path = os.path.join(folder, "data")
+    formats = [("gzip pickle (old)", save_data_gzip, load_data_gzip),
+               ("binary, compressed", lambda d, f: utils.save_data(d, f), utils.load_data),
+               ("binary, raw", lambda d, f: utils.save_data(d, f, compress=False), utils.load_data)]
+    for storage in ["one_hot", "index"]:
+        data = Data(fasta, "ACGT", storage=storage)
+        print("\nstorage '{}' ({} entries of length {})".format(storage, n, length))
+        print("{:<24}{:>12}{:>12}{:>12}".format("format", "save (s)", "load (s)", "size (MB)"))
+        for label, save, load in formats:
+            _, save_time = measure(lambda: save(data, path))
+            loaded, load_time = measure(lambda: load(path))
+            assert np.array_equal(loaded.data[:100], data.data[:100])
+            print("{:<24}{:>12.3f}{:>12.3f}{:>12.1f}".format(label, save_time, load_time, os.path.getsize(path) / 1e6))
+    rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,12 @@ class Alphabet_Encoder:
         self.alphabet = "".join(sorted(self._decodeTable.keys()))
         self.alph0 = alph0
         self.alph1 = alph1
+        # byte value -> index in alph0/alph1 (255 for bytes that are not part of the alphabet),
+        # the index of a pair in the joined alphabet is index0 * len(alph1) + index1
+        self.lookup0 = self._lookup(alph0)
+        self.lookup1 = self._lookup(alph1)
+        self.lookup_rev0 = np.frombuffer(alph0.encode(), dtype=np.uint8)
+        self.lookup_rev1 = np.frombuffer(alph1.encode(), dtype=np.uint8)
 
 
     def encode(self, record):
@@ -25,4 +31,42 @@ class Alphabet_Encoder:
         for x in encoded:
             alph0Encoded.append(self._decodeTable[x][0])
             alph1Encoded.append(self._decodeTable[x][1])
-        return "".join(alph0Encoded), "".join(alph1Encoded)
\ No newline at end of file
+        return "".join(alph0Encoded), "".join(alph1Encoded)
+
+
+    def encode_indices(self, record):
+        # (sequence, structure) as str, bytes or uint8 arrays of byte values (of any shape)
+        # -> uint8 array (uint16 for joined alphabets with 255 or more pairs) of indices into
+        # self.alphabet
+        idx0 = self.lookup0[self._as_array(record[0])]
+        idx1 = self.lookup1[self._as_array(record[1])]
+        if idx0.shape != idx1.shape:
+            raise RuntimeError('Sequence and structure must have the same length.')
+        if (idx0 == 255).any() or (idx1 == 255).any():
+            raise ValueError("Record contains characters that are not part of the alphabets '{}' and '{}'.".format(
+                self.alph0, self.alph1
+            ))
+        dtype = np.uint8 if len(self.alphabet) < 255 else np.uint16
+        return (idx0.astype(np.intp) * len(self.alph1) + idx1).astype(dtype)
+
+
+    def decode_indices(self, indices):
+        # array of indices into self.alphabet -> (sequence, structure) strings, e.g. for a
+        # one-dimensional array of a single record
+        indices = np.asarray(indices)
+        return (self.lookup_rev0[indices // len(self.alph1)].tobytes().decode(),
+                self.lookup_rev1[indices % len(self.alph1)].tobytes().decode())
+
+
+    def _lookup(self, alphabet):
+        lookup = np.full(256, 255, dtype=np.uint8)
+        lookup[np.frombuffer(alphabet.encode(), dtype=np.uint8)] = np.arange(len(alphabet))
+        return lookup
+
+
+    def _as_array(self, string):
+        if isinstance(string, np.ndarray):
+            return string
+        if isinstance(string, str):
+            string = string.encode()
+        return np.frombuffer(string, dtype=np.uint8)
\ No newline at end of file
@@ -1,14 +1,38 @@
-import re
+import os
+import json
+import struct
+import zlib
+import shutil
+import hashlib
 import numpy as np
-from random import choice
-from collections import defaultdict
-from itertools import chain
+from io import BytesIO
+from copy import copy
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
 from scipy import stats
 
 
 import pysster.utils as io
 from pysster.One_Hot_Encoder import One_Hot_Encoder
 from pysster.Alphabet_Encoder import Alphabet_Encoder
+from pysster.Genome import Genome, _parse_intervals
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError: # python < 3.8, results are pickled instead
+    shared_memory = None
+
+
+# approximate number of bytes of a fasta file that is parsed by one worker process
+_SHARD_SIZE = 1 << 23
+
+# shuffled sequences of variable length are sorted by length in windows of this number of batches
+_SORT_WINDOW = 10
+
+# version of the folder layout written by save_mmap(): one file per array (encoded sequences,
+# labels, splits, additional data, embedding codes and optional view arrays) and header.json
+# (which also holds the seed and the number of files read, see append())
+_MMAP_VERSION = 1
 
 
 class Data:
@@ -22,9 +46,14 @@ class Data:
     data or optionally position-weight matrices for structure data (see __init__ function). Strings
     can contain all uppercase alphanumeric characters and the following special characters: "()[]{}<>,.|*".
     Additional handcrafted features may be added using the load_additional_data function.
+
+    Storage: the encoded data are kept in a single contiguous array of shape (number of sequences,
+    sequence length, alphabet size) and the labels in an array of shape (number of sequences,
+    number of classes). Batches are gathered from these arrays by index, and the arrays can still be
+    indexed like the lists of per-sequence matrices used by earlier versions (e.g. data.data[0]).
     """
 
-    def __init__(self, class_files, alphabet, structure_pwm=False):
+    def __init__(self, class_files, alphabet, structure_pwm=False, storage="one_hot", folder=None, chunk_size=10000, n_jobs=1, seed=None, cache=None, cache_size=10*2**30, variable_length=False):
         """ Load the sequences and split the data into 70%/15%/15% training/validation/test.
 
         If the goal is to do single-label classification a list of fasta files must be provided
@@ -41,12 +70,14 @@ class Data:
         '((((...))))
 
         in which the second line contains the sequence and the third line the structure.
-        **Important: All sequences in all files must have the same length.**
+        **Important: All sequences in all files must have the same length (unless variable_length is True).**
 
         The provided alphabet must match the content of the fasta files. For sequence-only files
         a single string (e.g. 'ACGT' or 'ACGU') should be provided and for sequence-structure files a 
         tuple should be provided (e.g. ('ACGU', '().')). Characters that are not part of the 
-        provided alphabets will be randomly replaced with an alphabet character.
+        provided alphabets will be randomly replaced with an alphabet character. The replacement
+        characters of every entry are drawn from a generator seeded by the seed argument and the
+        position of the entry in its file, i.e. they don't depend on chunk_size or n_jobs.
 
         We support all uppercase alphanumeric characters and the following additional characters
         for alphabets: "()[]{}<>,.|*". Thus, it is possible to use and combine (in the sequence-structure
@@ -72,6 +103,45 @@ class Data:
         we don't restrict the usage of the package to RNA, therefore the matrix given above can represent
         whatever you want it to represent, as long as you provide a valid alphabet.
 
+        By default every sequence is stored as a one-hot encoded matrix, i.e. each position costs
+        as many bytes as the alphabet has characters (e.g. 16 bytes for ('ACGU', 'HIMS')). For large
+        data sets the storage argument can be set to 'index' to store a single byte per position
+        or to 'packed' to store 2 bits per position (only possible for alphabets with at most 4
+        characters, e.g. 'ACGT'). 'index' is limited to alphabets with at most 254 characters
+        (sequence-structure pairs for sequence-structure data). In both cases sequences are only
+        expanded to one-hot matrices batch-wise when they are used. The 'data' attribute then
+        provides the same list-like (read-only) access to the one-hot matrices as in the default
+        case. For structure PWMs the compact modes store the sequence (1 byte or 2 bits per position)
+        and the structure profile (float32 for 'index' and float16 for 'packed') separately, instead
+        of the mostly empty joined matrices, e.g. 17 or 8.25 bytes instead of 64 bytes per position
+        for ('ACGU', 'HIMS').
+
+        Files are read and encoded in chunks of chunk_size entries. If a folder is provided the
+        encoded chunks are written straight to disk instead of being kept in memory and every chunk
+        is directly split into 70%/15%/15% training/validation/test entries. The memory usage
+        is then bounded by the chunk size and not by the size of the input files. The resulting
+        Data object is memory-mapped, i.e. it behaves exactly like an object returned by
+        open_mmap() (and the folder can be opened again later using open_mmap()).
+
+        Setting n_jobs > 1 reads and encodes the files in multiple processes. Files are split into
+        parts (large plain text files by byte ranges at entry boundaries, gzipped files into chunks
+        of entries) and the encoded parts are collected through shared memory in the original order.
+
+        If a cache folder is provided the encoded data are stored in a subfolder of the cache (in the
+        format of save_mmap()) named after a hash of the paths, sizes and modification times of the
+        input files, the alphabet, structure_pwm, storage and seed. Creating the same Data object again
+        then memory-maps the cached arrays instead of parsing and encoding the files. The least recently
+        used entries are removed as soon as the cache grows larger than cache_size bytes. Note: if no
+        seed is given, a cached object reuses the randomly replaced characters of the first one.
+
+        Setting variable_length to True allows sequences of different lengths (requires storage='index').
+        The sequences are then stored one after another in a single flat array ('tokens', with 'offsets'
+        pointing to the start of every sequence) and batches are only padded (with all-zero positions)
+        to the longest sequence of the batch. During training the shuffled sequences are sorted by
+        length in windows of 10 batches before they are split into batches, i.e. every batch only
+        contains sequences of similar length, but different ones in every epoch. Models trained on such data use a global max pooling layer instead of flattening the
+        output of the convolutional block (see Model). Kernel visualization is not supported.
+
         Parameters
         ----------
         class_files: str or [str]
@@ -82,32 +152,227 @@ class Data:
         
         structure_pwm: bool
             Are structures provided as single strings (False) or as PWMs (True)?
+
+        storage: str
+            How encoded sequences are kept in memory: 'one_hot' (default), 'index' or 'packed' (see above).
+
+        folder: str
+            If provided, the data are streamed to a memory-mapped data set in this folder (see above).
+
+        chunk_size: int
+            Number of fasta entries that are encoded at once.
+
+        n_jobs: int
+            Number of processes used to read and encode the files (default: 1).
+
+        seed: int
+            Seed for the replacement of characters that are not part of the alphabet.
+
+        cache: str
+            If provided, encoded data are cached in this folder (see above).
+
+        cache_size: int
+            Maximum size of the cache folder in bytes (default: 10 GiB).
+
+        variable_length: bool
+            Allow sequences of different lengths (see above)?
         """
-        self.meta = {}
-        self.is_rna_pwm = False
-        if isinstance(alphabet, tuple):
-            self.is_rna = True
-            self.is_rna_pwm = structure_pwm
-            self.alpha_coder = Alphabet_Encoder(alphabet[0], alphabet[1])
-            alphabet = self.alpha_coder.alphabet
-            data_loader = self._load_encode_rna
-        else:
-            self.is_rna = False
-            data_loader = self._load_encode_dna
+        self._init_attributes(alphabet, structure_pwm, storage, chunk_size, seed, variable_length)
+        if cache is not None and folder is not None:
+            raise ValueError("The cache can't be used together with a folder.")
+        entry = None
+        if cache is not None:
+            entry = os.path.join(cache, _cache_key(class_files, alphabet, structure_pwm, storage, seed, variable_length))
         if not isinstance(class_files, list):
             class_files = [class_files]
             self.multilabel = True
         else:
             self.multilabel = False
-        self.one_hot_encoder = One_Hot_Encoder(alphabet)
-        data_loader(class_files)
-        # check if all sequences have the same length
-        length = self.data[0].shape[0]
-        for x in range(1, len(self.data)):
-            if length != self.data[x].shape[0]:
-                raise RuntimeError('All sequences must have the same length.')
-        self._process_labels()
-        self.train_val_test_split(0.7, 0.15)
+        if not self._load_cache(entry):
+            self._open_buffers(folder)
+            self._load(class_files, n_jobs)
+            self._close_buffers(folder)
+            if cache is not None:
+                self._save_cache(entry, cache_size)
+        self.additional = np.zeros((len(self.labels), 0), dtype=np.float32)
+        self.codes = np.zeros((len(self.labels), 0), dtype=np.int32)
+        if folder is None:
+            self.train_val_test_split(0.7, 0.15)
+
+
+    @classmethod
+    def from_records(cls, records, labels, alphabet, structure_pwm=False, storage="one_hot", variable_length=False, seed=None, chunk_size=10000):
+        """ Create a Data object from sequences in memory instead of fasta files.
+
+        Records are sequence strings for sequence-only data, tuples of sequence and structure strings
+        for sequence-structure data or tuples of a sequence string and a structure PWM (array-like
+        of shape (len(alphabet[1]), length of the sequence), i.e. the layout used in fasta files, see
+        __init__) if structure_pwm is True. Labels are either given as class indices (an array of shape
+        (number of records,), single-label classification) or as a matrix of 0s and 1s (an array of
+        shape (number of records, number of classes), multi-label classification). The records are
+        encoded exactly like fasta entries (see __init__ for the alphabet, storage, variable_length and
+        seed arguments) and split into 70%/15%/15% training/validation/test entries.
+
+        Parameters
+        ----------
+        records : [str] or [(str, str)] or [(str, numpy.ndarray)]
+            The sequences (and structures).
+
+        labels : numpy.ndarray
+            Class indices (single-label) or a label matrix (multi-label).
+
+        alphabet : str or tuple(str,str)
+            A string for sequence-only records and a tuple for sequence-structure records.
+
+        structure_pwm : bool
+            Are structures provided as strings (False) or as PWMs (True)?
+
+        storage : str
+            How encoded sequences are kept in memory: 'one_hot' (default), 'index' or 'packed'.
+
+        variable_length : bool
+            Allow sequences of different lengths?
+
+        seed : int
+            Seed for the replacement of characters that are not part of the alphabet.
+
+        chunk_size : int
+            Number of records that are encoded at once.
+
+        Returns
+        -------
+        data : pysster.Data
+            The Data object.
+        """
+        data = cls.__new__(cls)
+        data._init_attributes(alphabet, structure_pwm, storage, chunk_size, seed, variable_length)
+        data._open_buffers(None)
+        for chunk in _chunks(enumerate(records), chunk_size):
+            offsets = [i for i, _ in chunk]
+            if data.is_rna_pwm:
+                encoded = data._encode_pwm_records(offsets, [x[0] for i, x in chunk], [x[1] for i, x in chunk], 0)
+            else:
+                to_bytes = lambda x: x if isinstance(x, bytes) else x.encode() if isinstance(x, str) else b"_".join(y.encode() for y in x)
+                encoded, length, _ = data._encode_chunk([(i, b"", to_bytes(x)) for i, x in chunk], 0)
+                encoded = (encoded, length)
+            data._add_encoded(*encoded)
+        buffers = data._buffers
+        del data._buffers
+        data._set_storage([buffer.finalize() for buffer in buffers["inputs"]])
+        data._set_labels(labels)
+        data._n_files = 1  # the records are read as file 0
+        return data
+
+
+    @classmethod
+    def from_intervals(cls, genome, intervals, labels, alphabet="ACGT", storage="one_hot", variable_length=False, seed=None, chunk_size=10000):
+        """ Create a Data object from intervals of a reference genome.
+
+        The sequences of the intervals are sliced out of the memory-mapped genome (see Genome) and
+        encoded chunk-wise, i.e. without writing them to a fasta file first. Intervals are given as
+        a BED file (the name, score and strand columns are optional; the file may be gzipped) or
+        as tuples (name, start, end) or (name, start, end, strand) with 0-based half-open coordinates.
+        Sequences of the minus strand are reverse complemented. Unless variable_length is True
+        all intervals must have the same length. Labels are given as class indices or as a label
+        matrix (one row per interval, see from_records()).
+
+        Parameters
+        ----------
+        genome : pysster.Genome or str
+            A Genome object or the file name of a plain fasta file.
+
+        intervals : str or [tuple]
+            A BED file or a list of intervals.
+
+        labels : numpy.ndarray
+            Class indices (single-label) or a label matrix (multi-label).
+
+        alphabet : str
+            The alphabet of the sequences.
+
+        storage : str
+            How encoded sequences are kept in memory: 'one_hot' (default), 'index' or 'packed'.
+
+        variable_length : bool
+            Allow intervals of different lengths?
+
+        seed : int
+            Seed for the replacement of characters that are not part of the alphabet (e.g. N).
+
+        chunk_size : int
+            Number of intervals that are encoded at once.
+
+        Returns
+        -------
+        data : pysster.Data
+            The Data object.
+        """
+        if not isinstance(genome, Genome):
+            genome = Genome(genome)
+        records = (genome._fetch(*interval) for interval in _parse_intervals(intervals))
+        return cls.from_records(records, labels, alphabet, storage=storage, variable_length=variable_length,
+                                seed=seed, chunk_size=chunk_size)
+
+
+    @classmethod
+    def from_arrays(cls, inputs, labels, alphabet, structure_pwm=False):
+        """ Create a Data object from encoded sequences.
+
+        The encoded sequences are used as they are, i.e. without copying them. Inputs can either be
+        one-hot encoded matrices (an array of shape (number of sequences, length, len(alphabet)), stored
+        as storage 'one_hot'), alphabet indices (an integer array of shape (number of sequences, length),
+        stored as storage 'index', copied if the dtype is not uint8) or, if structure_pwm is True, a
+        tuple of alphabet indices of the sequences (indices of alphabet[0]) and the structure profiles
+        (an array of shape (number of sequences, length, len(alphabet[1]))). For sequence-structure data
+        the one-hot columns (and the indices) refer to all combinations of a sequence and a
+        structure character, i.e. the alphabet of Alphabet_Encoder. Labels are given as class indices
+        or as a label matrix (see from_records()). The data are split into 70%/15%/15%
+        training/validation/test entries.
+
+        Parameters
+        ----------
+        inputs : numpy.ndarray or tuple(numpy.ndarray, numpy.ndarray)
+            One-hot matrices or alphabet indices (and structure profiles).
+
+        labels : numpy.ndarray
+            Class indices (single-label) or a label matrix (multi-label).
+
+        alphabet : str or tuple(str,str)
+            A string for sequence-only data and a tuple for sequence-structure data.
+
+        structure_pwm : bool
+            Are structures provided as PWMs?
+
+        Returns
+        -------
+        data : pysster.Data
+            The Data object.
+        """
+        if isinstance(inputs, tuple):
+            stored = [np.asarray(inputs[0]), np.asarray(inputs[1])]
+        else:
+            stored = [np.asarray(inputs)]
+        storage = "one_hot" if stored[0].ndim == 3 else "index"
+        data = cls.__new__(cls)
+        data._init_attributes(alphabet, structure_pwm, storage, 10000, None, False)
+        n_columns = len(data.one_hot_encoder.alphabet)
+        if storage == "one_hot" and (len(stored) > 1 or stored[0].shape[2] != n_columns):
+            raise ValueError("One-hot matrices must have {} columns.".format(n_columns))
+        if storage == "index":
+            if len(stored) != 1 + data.is_rna_pwm or stored[0].ndim != 2:
+                raise ValueError("Indices must have the shape (number of sequences, length).")
+            if data.is_rna_pwm:
+                n_columns = len(data.alpha_coder.alph0)
+                if stored[1].shape != stored[0].shape + (len(data.alpha_coder.alph1),):
+                    raise ValueError("Structure profiles must have the shape (number of sequences, length, {}).".format(
+                        len(data.alpha_coder.alph1)))
+            if stored[0].size > 0 and not 0 <= stored[0].min() <= stored[0].max() < n_columns:
+                raise ValueError("Indices must be in the range [0, {}).".format(n_columns))
+            stored[0] = stored[0].astype(np.uint8, copy=False)
+        data.length = stored[0].shape[1]
+        data._set_storage(stored)
+        data._set_labels(labels)
+        return data
 
 
     def train_val_test_split(self, portion_train, portion_val, seed = None):
@@ -130,15 +395,216 @@ class Data:
         """
         if seed:
             np.random.seed(seed)
-        num_sequences = len(self.data)
+        idx = self._get_idx("all")
+        num_sequences = len(idx)
         break_train = int(num_sequences * portion_train)
         break_val = int(num_sequences * (portion_train + portion_val))
-        splits = np.random.permutation(np.arange(num_sequences))
+        splits = idx[np.random.permutation(num_sequences)]
         splits = np.split(splits, [break_train, break_val])
         self.splits = {"train": splits[0], "val": splits[1], "test": splits[2]}
 
 
-    def load_additional_data(self, class_files, is_categorical=False, standardize=False):
+    def append(self, class_files, classes=None, n_jobs=1):
+        """ Add the entries of further fasta files without encoding the existing entries again.
+
+        The files must be of the same kind as the files used to create the object (same alphabet,
+        same sequence length unless variable_length is True). For single-label data a list of files
+        must be provided and by default every file becomes a new class (e.g. appending two files to
+        a data set with 3 classes adds 'class_3' and 'class_4'); use the classes argument to add the
+        entries of the files to existing classes instead. For multi-label data a single file must be
+        provided and the headers determine the classes (new classes are added if needed).
+
+        The new entries are split into training/validation/test entries in the current
+        proportions of the split, the assignment of the existing entries doesn't change.
+        Note: entries can't be appended once additional data were loaded (see load_additional_data)
+        or to subsets (see subset()). Memory-mapped arrays are loaded into memory.
+
+        Parameters
+        ----------
+        class_files: str or [str]
+            A fasta file (multi-label) or a list of fasta files (single-label).
+
+        classes: [int]
+            The class of every file (single-label only, default: new classes).
+
+        n_jobs: int
+            Number of processes used to read and encode the files (default: 1).
+        """
+        if self.indices is not None:
+            raise RuntimeError("Entries can't be appended to a subset of a Data object.")
+        if len(self.meta) > 0:
+            raise RuntimeError("Entries can't be appended after additional data were loaded.")
+        if isinstance(class_files, list) == self.multilabel:
+            raise ValueError("A {} must be provided for {} data.".format(
+                "single file" if self.multilabel else "list of files",
+                "multi-label" if self.multilabel else "single-label"))
+        n_old, n_classes = len(self.labels), len(self.labels[0])
+        if self.multilabel:
+            class_files, classes = [class_files], [0]
+        elif classes is None:
+            classes = list(range(n_classes, n_classes + len(class_files)))
+        if len(classes) != len(class_files):
+            raise ValueError("One class per file must be provided.")
+        stored, length = [getattr(self, name) for name in self._storage_names()], self.length
+        self._open_buffers(None)
+        self.length = length
+        self._load(class_files, n_jobs, classes)
+        buffers = self._buffers
+        del self._buffers
+        self._set_storage([np.concatenate([x, buffer.finalize()]) for x, buffer in zip(stored, buffers["inputs"])])
+        pairs = buffers["label_pairs"].finalize() + np.array([n_old, 0])
+        self._process_labels(np.concatenate([np.argwhere(self.labels), pairs]), n_classes=n_classes)
+        self.additional = np.zeros((len(self.labels), 0), dtype=np.float32)
+        self.codes = np.zeros((len(self.labels), 0), dtype=np.int32)
+        # the new entries are split such that the proportions of the groups stay the same
+        n_new = len(self.labels) - n_old
+        n_group = lambda group: int(round(len(self.labels) * len(self.splits[group]) / n_old)) - len(self.splits[group])
+        n_train = min(max(n_group("train"), 0), n_new)
+        n_val = min(max(n_group("val"), 0), n_new - n_train)
+        idx = n_old + np.random.permutation(n_new)
+        for group, part in zip(["train", "val", "test"], np.split(idx, [n_train, n_train+n_val])):
+            self.splits[group] = np.concatenate([self.splits[group], part]).astype(np.int64)
+
+
+    def subset(self, indices, keep_splits=False):
+        """ Get a view of a subset of the data, e.g. for cross-validation or bootstrapping.
+
+        The returned Data object shares the encoded sequences, labels and additional data with
+        this object (nothing is copied), but has its own training/validation/test split. By default
+        the entries of the subset are randomly split into 70%/15%/15% training/validation/test
+        entries (use train_val_test_split() to change that). If keep_splits is True the entries
+        keep their assignment of this object instead. Indices refer to the entries of this object
+        ('all' group), may contain duplicates (e.g. for bootstrap samples) or may be given as a
+        boolean mask. As the arrays are shared, the entries of a view keep their row indices, e.g.
+        view.data[i] is the i-th entry of the original object and not of the subset.
+
+        Parameters
+        ----------
+        indices : [int] or numpy.ndarray
+            Indices or boolean mask of the entries that should be part of the subset.
+
+        keep_splits : bool
+            Keep the training/validation/test assignment of the entries (True) or split the subset anew (False)?
+
+        Returns
+        -------
+        data : pysster.Data
+            A Data object of the subset.
+        """
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            if len(indices) != len(self._get_idx("all")):
+                raise ValueError("The mask must have one value per entry.")
+            indices = np.flatnonzero(indices)
+        view = copy(self)
+        view.meta = {x: dict(entry) for x, entry in self.meta.items()}
+        view.indices = self._get_idx("all")[indices.astype(np.intp)]
+        view.inverse = None
+        if keep_splits:
+            view.splits = {group: view.indices[np.isin(view.indices, self.splits[group])]
+                           for group in ["train", "val", "test"]}
+        else:
+            view.train_val_test_split(0.7, 0.15)
+        return view
+
+
+    def select_classes(self, classes, keep_splits=False):
+        """ Get a view of the entries belonging to some of the classes (see subset()).
+
+        The labels of the view only consist of the selected classes (in the given order, e.g.
+        selecting classes [2, 0] of a data set turns 'class_2' into 'class_0' and 'class_0' into
+        'class_1'). Entries that don't belong to any of the classes are not part of the view.
+        The labels are copied, everything else is shared with this object.
+
+        Parameters
+        ----------
+        classes : int or [int]
+            The selected classes.
+
+        keep_splits : bool
+            Keep the training/validation/test assignment of the entries (True) or split the subset anew (False)?
+
+        Returns
+        -------
+        data : pysster.Data
+            A Data object of the selected classes.
+        """
+        classes = [classes] if isinstance(classes, (int, np.integer)) else list(classes)
+        view = self.subset(self.labels[self._get_idx("all")][:, classes].any(axis=1), keep_splits)
+        view.labels = self.labels[:, classes]
+        return view
+
+
+    def deduplicate(self):
+        """ Get a view of the distinct entries, each one weighted by its number of copies.
+
+        Entries are identical if their encoded sequences (and structures), labels and additional
+        data are identical. They are found by hashing the encoded entries chunk-wise (hash
+        collisions are resolved by comparing the entries). The returned view (see subset()) holds
+        the first occurrence of every distinct entry, i.e. networks encode and score every sequence
+        only once, and the entries are randomly split into 70%/15%/15% training/validation/test
+        entries (copies of an entry can therefore not end up in different groups). The
+        multiplicities are stored in the counts attribute (counts[i] is the number of copies of
+        row i, like labels[i]) and are used as sample weights during training (Data_Sequence,
+        to_dataset() and Model; the class weights are computed from the multiplicities, too). The inverse attribute holds the position of
+        every entry of this object ('all' group) in the 'all' group of the view, use scatter()
+        to map predictions of the view back to the entries of this object.
+
+        Returns
+        -------
+        data : pysster.Data
+            A Data object of the distinct entries.
+        """
+        idx = self._get_idx("all")
+        weights = np.ones(len(idx)) if self.counts is None else self.counts[idx]
+        for seed in range(3):
+            hashes = np.concatenate([np.zeros(0, dtype=np.uint64)] +
+                                    [_hash_rows(self._entry_bytes(idx[x:(x+self.chunk_size)]), seed)
+                                     for x in range(0, len(idx), self.chunk_size)])
+            _, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+            # distinct entries in the order of their first occurrence
+            order = np.argsort(first)
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            first, inverse = first[order], rank[inverse.reshape(-1)]
+            if all(self._equal_entries(idx[x:(x+self.chunk_size)], idx[first[inverse[x:(x+self.chunk_size)]]])
+                   for x in range(0, len(idx), self.chunk_size)):
+                break
+        else:
+            raise RuntimeError("Entries could not be deduplicated (hash collisions).")
+        view = self.subset(first)
+        view.counts = np.zeros(len(self.labels), dtype=np.uint32)
+        view.counts[view.indices] = np.rint(np.bincount(inverse, weights, len(first)))
+        view.inverse = inverse
+        return view
+
+
+    def scatter(self, values):
+        """ Map values of the entries of a deduplicated view back to the entries of the original object.
+
+        Values (e.g. predictions for the 'all' group of the view) are given in the order of the
+        'all' group of the view (see deduplicate()), the result contains the value of the corresponding
+        distinct entry for every entry of the original Data object ('all' group) in the original order.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            One value (or row of values) per entry of the view.
+
+        Returns
+        -------
+        values : numpy.ndarray
+            One value (or row of values) per entry of the original object.
+        """
+        if self.inverse is None:
+            raise RuntimeError("Only Data objects returned by deduplicate() can scatter values.")
+        values = np.asarray(values)
+        if len(values) != len(self.indices):
+            raise ValueError("{} values were provided for {} entries.".format(len(values), len(self.indices)))
+        return values[self.inverse]
+
+
+    def load_additional_data(self, class_files, is_categorical=False, standardize=False, embedding=False, buckets=None):
         """ Add additional handcrafted numerical or categorical features to the network.
 
         For every input sequence additional data can be added to the network (e.g. location,
@@ -159,6 +625,18 @@ class Data:
         entries in the corresponding fasta file. If you want to add multiple features simply
         call this function multiple times.
 
+        All additional data are kept in a single float32 matrix of shape (number of sequences,
+        number of features) (the 'additional' attribute) from which batches are sliced by index.
+        Numerical features take one column and categorical features one column per category
+        (one-hot encoded). The 'data' entries of the 'meta' attribute are views of these columns.
+
+        One-hot encoding is limited to 256 categories. Categorical features with many categories
+        (e.g. gene IDs) can instead be stored as a single integer code per sequence (embedding=True),
+        the codes are kept in an int32 matrix (the 'codes' attribute) and the network learns an
+        embedding for every category (see 'embedding_dim' in the Model documentation). If buckets
+        is provided the categories are hashed into this fixed number of codes (feature hashing),
+        e.g. to bound the size of the embedding for features with a huge number of categories.
+
         Interpreting the influence of arbitrary additional data for a neural network is hard and at
         the moment we don't provide any means to do so. You should run your model with and without the
         additional data and check if the predictive performance improves. In general, if you have
@@ -175,39 +653,64 @@ class Data:
         
         standardize: bool
             Should the z-score be computed for numerical data?
+
+        embedding: bool
+            Store categorical data as integer codes for an embedding layer instead of one-hot vectors.
+
+        buckets: int
+            If provided, categories are hashed into this number of codes (implies embedding=True).
         """
+        if buckets is not None:
+            embedding = True
+        if embedding and not is_categorical:
+            raise ValueError("Only categorical data can be embedded.")
+        if not isinstance(class_files, list):
+            class_files = [class_files]
         # load raw data
-        idx = len(self.meta)
-        self.meta[idx] = {"data":[], "is_categorical": is_categorical}
-        for class_id, file_name in enumerate(class_files):
+        values = []
+        for file_name in class_files:
             handle = io.get_handle(file_name, "rt")
             if True == is_categorical:
-                for line in handle:
-                    self.meta[idx]['data'].append(line.strip())
+                values.extend(line.strip() for line in handle)
             else:
-                for line in handle:
-                    self.meta[idx]['data'].append(float(line))
+                values.append(np.array(handle.read().split(), dtype=np.float64))
             handle.close()
-        if len(self.labels) != len(self.meta[idx]['data']):
+        if False == is_categorical:
+            values = np.concatenate(values)
+        if len(self.labels) != len(values):
             raise RuntimeError("Number of additional data ({}) doesn't match number of main data ({}).".format(
-                len(self.meta[idx]['data']), len(self.labels)
+                len(values), len(self.labels)
             ))
+        # integer codes for embedded categorical data
+        if True == embedding:
+            categories, codes = np.unique(np.array(values), return_inverse=True)
+            if buckets is not None:
+                hashed = np.array([zlib.crc32(x.encode()) % buckets for x in categories], dtype=np.int32)
+                codes, n_codes = hashed[codes], buckets
+            else:
+                n_codes = len(categories)
+            self.meta[len(self.meta)] = {"data": None, "is_categorical": True, "embedding": True,
+                                         "n_codes": n_codes}
+            self._set_codes(np.concatenate([np.asarray(self.codes), codes.astype(np.int32)[:, np.newaxis]],
+                                           axis=1))
+            return
         # one hot encode categorical data
         if True == is_categorical:
-            categories = set(self.meta[idx]['data'])
+            categories, codes = np.unique(np.array(values), return_inverse=True)
             if len(categories) > 256:
                 raise RuntimeError("Too many categories ({}). A maximum of 256 are supported.".format(
                     len(categories)
                 ))
-            mapping = {val: i for i, val in enumerate(categories)}
-            for i, val in enumerate(self.meta[idx]['data']):
-                one_hot = np.zeros(len(categories), dtype=np.uint8)
-                one_hot[mapping[self.meta[idx]['data'][i]]] = 1
-                self.meta[idx]['data'][i] = one_hot
+            features = np.zeros((len(codes), len(categories)), dtype=np.float32)
+            features[np.arange(len(codes)), codes] = 1
         # standardize numerical data if desired
         else:
             if True == standardize:
-                self.meta[idx]['data'] = stats.zscore(self.meta[idx]['data'])
+                values = stats.zscore(values)
+            features = values.astype(np.float32)[:, np.newaxis]
+        widths = self._additional_widths() + [features.shape[1]]
+        self.meta[len(self.meta)] = {"data": None, "is_categorical": is_categorical, "embedding": False}
+        self._set_additional(np.concatenate([np.asarray(self.additional), features], axis=1), widths)
 
 
     def get_labels(self, group):
@@ -226,8 +729,7 @@ class Data:
         labels : numpy.ndarray
             An array filled with 0s and 1s indicating class membership.
         """
-        idx = self._get_idx(group)
-        return np.array([self.labels[x] for x in idx])
+        return self.labels[self._get_idx(group)]
 
 
     def get_summary(self):
@@ -242,9 +744,7 @@ class Data:
         class_ids = list(range(len(self.labels[0])))
         output = {}
         for group in ["train", "val", "test"]:
-            idx = self._get_idx(group)
-            labels = np.array([self.labels[x] for x in idx])
-            output[group] = labels.sum(axis=0)
+            output[group] = self.labels[self._get_idx(group)].sum(axis=0)
         output["all"] = output["train"] + output["val"] + output["test"]
         formatter = lambda xs: "  ".join("{:>9}".format(str(x)) for x in xs)
         summary += "            {}\n".format(formatter(["class_{}".format(x) for x in class_ids]))
@@ -255,143 +755,1206 @@ class Data:
         return summary
 
 
-    def _load_encode_dna(self, class_files):
-        self.data, self.labels = [], []
-        replacer = lambda x: choice(self.one_hot_encoder.alphabet)
-        for class_id, file_name in enumerate(class_files):
-            handle = io.get_handle(file_name, "rt")
-            for header, sequence in io.parse_fasta(handle):
-                sequence = re.sub(r"[^{}]".format(self.one_hot_encoder.alphabet),
-                                  replacer, sequence.upper())
-                self.data.append(self.one_hot_encoder.encode(sequence))
-                if self.multilabel:
-                    self.labels.append(list(map(int, header.split(','))))
-                else:
-                    self.labels.append([class_id])
-            handle.close()
+    def to_dataset(self, group, batch_size, shuffle=True, buffer_size=None, seed=None, labels=True, reverse_complement=False, max_shift=0, sample_weights=None):
+        """ Get a subset of the data as a batched tf.data.Dataset.
 
+        The 'group' argument can have the value 'train', 'val', 'test' or 'all'. The dataset yields
+        the same batches as the generators used by Model (inputs and additional data, labels),
+        but everything after the shuffling of the indices runs inside the tensorflow graph: the
+        entries of a batch are gathered from the stored arrays, compact storage (see __init__) is
+        expanded to one-hot matrices using tf.one_hot and the batches are prefetched, i.e. the
+        input preparation runs in parallel to the training without holding the python GIL.
+        For sequences of variable length the entries are grouped by length into buckets before they
+        are batched if shuffle is True. Note: the stored arrays are copied into tensors, i.e.
+        memory-mapped arrays are loaded into memory. Requires tensorflow 2.6 or newer.
 
-    def _load_encode_rna(self, class_files):
-        self.data, self.labels = [], []
-        replacer_seq = lambda x: choice(self.alpha_coder.alph0)
-        replacer_struct = lambda x: choice(self.alpha_coder.alph1)
-        pattern_seq = r"[^{}]".format(re.escape(self.alpha_coder.alph0))
-        pattern_struct = r"[^{}]".format(re.escape(self.alpha_coder.alph1))
-        for class_id, file_name in enumerate(class_files):
-            handle = io.get_handle(file_name, "rt")
-            for header, block in io.parse_fasta(handle, "_"):
-                lines = block.split("_")
-                sequence = re.sub(pattern_seq, replacer_seq, lines[0].upper())
-                if True == self.is_rna_pwm:
-                    pwm = np.zeros((len(sequence), len(self.alpha_coder.alph1)), dtype=np.float32)
-                    for x in range(1, pwm.shape[1]+1):
-                        pwm[:, x-1] = list(map(float, lines[x].split()))
-                    self.data.append(self._join_seq_pwm(sequence, pwm))
-                else:
-                    structure = re.sub(pattern_struct, replacer_struct, lines[1].split(" ")[0].upper())
-                    joined = self.alpha_coder.encode((sequence, structure))
-                    self.data.append(self.one_hot_encoder.encode(joined))
-                if self.multilabel:
-                    self.labels.append(list(map(int, header.split(','))))
-                else:
-                    self.labels.append([class_id])
+        The batches can be augmented (usually only for training): reverse_complement reverses
+        and complements every entry with a probability of 0.5 (see Data_Sequence) and max_shift > 0
+        shifts every entry by a random number of positions in [-max_shift, max_shift].
+
+        Parameters
+        ----------
+        group : str
+            The subset of the data that should be used.
+
+        batch_size : int
+            Number of entries per batch.
+
+        shuffle : bool
+            Shuffle the entries (in every iteration over the dataset)?
+
+        buffer_size : int
+            Size of the shuffle buffer (default: number of entries of the group, i.e. a full shuffle).
+
+        seed : int
+            Seed for the shuffling.
+
+        labels : bool
+            Should the dataset yield (inputs, labels) tuples (True) or (inputs,) tuples (False)?
+
+        reverse_complement : bool
+            Randomly reverse complement entries?
+
+        max_shift : int
+            Maximum number of positions entries are randomly shifted by.
+
+        sample_weights : numpy.ndarray
+            One weight per row (like labels), yielded together with the labels (default: the counts of deduplicated data).
+
+        Returns
+        -------
+        dataset : tf.data.Dataset
+            The batched and prefetched dataset.
+        """
+        import tensorflow as tf
+        if tuple(map(int, tf.__version__.split(".")[:2])) < (2, 6):
+            raise RuntimeError("tf.data input pipelines require tensorflow 2.6 or newer (found {}).".format(
+                tf.__version__
+            ))
+        idx = np.asarray(self._get_idx(group), dtype=np.int64)
+        tensors = self._get_tensors(tf)
+        sample_weights = self.counts if sample_weights is None else sample_weights
+        if sample_weights is not None:
+            tensors["weights"] = tf.convert_to_tensor(np.asarray(sample_weights, dtype=np.float32))
+        dataset = tf.data.Dataset.from_tensor_slices(idx)
+        if shuffle:
+            dataset = dataset.shuffle(buffer_size or max(len(idx), 1), seed=seed, reshuffle_each_iteration=True)
+        if shuffle and self.variable_length:
+            boundaries = np.unique(np.quantile(self.lengths[idx], np.linspace(0, 1, 11)[1:-1]).astype(int) + 1)
+            length = lambda i: tf.cast(tf.gather(tensors["lengths"], i), tf.int32)
+            dataset = dataset.bucket_by_sequence_length(length, boundaries.tolist(), [batch_size] * (len(boundaries)+1))
+        else:
+            dataset = dataset.batch(batch_size)
+        augment = (reverse_complement, max_shift) if reverse_complement or max_shift > 0 else None
+        batches = dataset.map(lambda i: self._get_tf_batch(tf, tensors, i, labels, augment),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+        return batches.prefetch(tf.data.AUTOTUNE)
+
+
+    def save_mmap(self, folder):
+        """ Save the data as a folder of raw numpy arrays that can be memory-mapped.
+
+        The folder will contain one .npy file for the encoded sequences, the labels, the 
+        training/validation/test indices (and the entries of a subset()) and every set of additional data, as well as a small
+        JSON header ('header.json') describing the alphabet and the kind of data. Use open_mmap()
+        to get a Data object back. Existing files of a previously saved Data object in the same
+        folder will be replaced.
+
+        Parameters
+        ----------
+        folder : str
+            A folder path. The folder will be created if it doesn't exist.
+        """
+        os.makedirs(folder, exist_ok=True)
+        arrays = {"labels": self.labels}
+        for name in self._storage_names():
+            arrays[name] = getattr(self, name)
+        for group in ["train", "val", "test"]:
+            arrays["split_{}".format(group)] = self.splits[group]
+        arrays["additional"] = self.additional
+        arrays["codes"] = self.codes
+        if self.indices is not None:
+            arrays["indices"] = self.indices
+        for name in ["counts", "inverse"]:
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        for name, values in arrays.items():
+            # write to a temporary file first, the old file might be memory-mapped by this object
+            with open(os.path.join(folder, name + ".npy.tmp"), "wb") as handle:
+                np.save(handle, values)
+            os.replace(os.path.join(folder, name + ".npy.tmp"), os.path.join(folder, name + ".npy"))
+        self._write_mmap_header(folder)
+
+
+    @classmethod
+    def open_mmap(cls, folder, mmap_mode='r'):
+        """ Open a Data object saved by save_mmap().
+
+        The arrays are memory-mapped, i.e. opening is instant independent of the size of the
+        data set, only the parts that are accessed are read from disk and multiple processes
+        opening the same folder share the same memory pages. Data sets can therefore be larger
+        than the available memory.
+
+        Parameters
+        ----------
+        folder : str
+            A folder created by save_mmap().
+
+        mmap_mode : str
+            Memory-map mode passed to numpy.load ('r': read-only, 'r+': read/write, 'c': copy-on-write, None: load into memory).
+
+        Returns
+        -------
+        data : pysster.Data
+            The Data object backed by the arrays in the folder.
+        """
+        path = lambda name: os.path.join(folder, name)
+        if not os.path.exists(path("header.json")):
+            raise RuntimeError("No memory-mapped Data object found in '{}'.".format(folder))
+        with open(path("header.json"), "rt") as handle:
+            header = json.load(handle)
+        if header.get("format") != "pysster-mmap" or header.get("version") != _MMAP_VERSION:
+            raise RuntimeError("Unsupported file format in '{}'.".format(folder))
+        data = cls.__new__(cls)
+        data.is_rna, data.is_rna_pwm = header["is_rna"], header["is_rna_pwm"]
+        data.multilabel = header["multilabel"]
+        if data.is_rna:
+            data.alpha_coder = Alphabet_Encoder(header["alph0"], header["alph1"])
+        data.one_hot_encoder = One_Hot_Encoder(header["alphabet"])
+        data.chunk_size = 10000
+        data._seed, data._n_files = header["seed"], header["n_files"]
+        data.storage = header["storage"]
+        data.variable_length = header["variable_length"]
+        data.indices = np.load(path("indices.npy"), mmap_mode=mmap_mode) if header["view"] else None
+        for name in ["counts", "inverse"]:
+            setattr(data, name, np.load(path(name + ".npy"), mmap_mode=mmap_mode) if header[name] else None)
+        data.length = header["length"]
+        data._set_storage([np.load(path(name + ".npy"), mmap_mode=mmap_mode) for name in data._storage_names()])
+        data.labels = np.load(path("labels.npy"), mmap_mode=mmap_mode)
+        data.splits = {group: np.load(path("split_{}.npy".format(group)), mmap_mode=mmap_mode)
+                       for group in ["train", "val", "test"]}
+        data.meta = {x: {"data": None, "is_categorical": entry["is_categorical"],
+                         "embedding": entry["embedding"]}
+                     for x, entry in enumerate(header["meta"])}
+        for x, entry in enumerate(header["meta"]):
+            if data.meta[x]["embedding"]:
+                data.meta[x]["n_codes"] = entry["n_codes"]
+        data._set_codes(np.load(path("codes.npy"), mmap_mode=mmap_mode))
+        widths = [entry["width"] for entry in header["meta"] if not entry["embedding"]]
+        data._set_additional(np.load(path("additional.npy"), mmap_mode=mmap_mode), widths)
+        return data
+
+
+    def _write_mmap_header(self, folder):
+        header = {"format": "pysster-mmap", "version": _MMAP_VERSION,
+                  "alphabet": self.one_hot_encoder.alphabet,
+                  "alph0": self.alpha_coder.alph0 if self.is_rna else None,
+                  "alph1": self.alpha_coder.alph1 if self.is_rna else None,
+                  "is_rna": self.is_rna, "is_rna_pwm": self.is_rna_pwm,
+                  "multilabel": self.multilabel, "storage": self.storage,
+                  "variable_length": self.variable_length, "length": self._shape()[0],
+                  "view": self.indices is not None, "seed": int(self._seed), "n_files": self._n_files,
+                  "counts": self.counts is not None, "inverse": self.inverse is not None,
+                  "meta": [self._meta_header(x) for x in range(len(self.meta))]}
+        with open(os.path.join(folder, "header.json"), "wt") as handle:
+            json.dump(header, handle, indent=2)
+
+
+    def __setstate__(self, state):
+        if "storage" in state:
+            self.__dict__.update(state)
+            return
+        # objects pickled by earlier versions (the gzipped pickles of save_data()) keep the
+        # encoded data, the labels and the additional data in lists of arrays
+        if state["is_rna"]:
+            alphabet = (state["alpha_coder"].alph0, state["alpha_coder"].alph1)
+        else:
+            alphabet = state["one_hot_encoder"].alphabet
+        self._init_attributes(alphabet, state["is_rna_pwm"], "one_hot", 10000, None, False)
+        data = np.array(state["data"], dtype=np.float32 if self.is_rna_pwm else np.uint8)
+        self.length = data.shape[1]
+        self._set_storage([data])
+        self.multilabel = state["multilabel"]
+        self.labels = np.array(state["labels"], dtype=np.uint32)
+        self._n_files = 1 if self.multilabel else self.labels.shape[1]
+        self.splits = state["splits"]
+        self.codes = np.zeros((len(self.labels), 0), dtype=np.int32)
+        features = [np.zeros((len(self.labels), 0), dtype=np.float32)]
+        for x in range(len(state["meta"])):
+            values = np.array(state["meta"][x]["data"], dtype=np.float32)
+            features.append(values if values.ndim == 2 else values[:, np.newaxis])
+            self.meta[x] = {"data": None, "is_categorical": state["meta"][x]["is_categorical"],
+                            "embedding": False}
+        self._set_additional(np.concatenate(features, axis=1), [x.shape[1] for x in features[1:]])
+
+
+    def _init_attributes(self, alphabet, structure_pwm, storage, chunk_size, seed, variable_length):
+        if storage not in ["one_hot", "index", "packed"]:
+            raise ValueError("storage '{}' not supported.".format(storage))
+        if variable_length and storage != "index":
+            raise ValueError("Sequences of variable length require storage 'index'.")
+        self.meta = {}
+        self.storage = storage
+        self.variable_length = variable_length
+        self.indices = None
+        self.counts = None
+        self.inverse = None
+        self.chunk_size = chunk_size
+        self._seed = seed if seed is not None else np.random.SeedSequence().entropy
+        # number of files read so far, the next file gets this number as file id
+        self._n_files = 0
+        self.is_rna_pwm = False
+        if isinstance(alphabet, tuple):
+            self.is_rna = True
+            self.is_rna_pwm = structure_pwm
+            self.alpha_coder = Alphabet_Encoder(alphabet[0], alphabet[1])
+            alphabet = self.alpha_coder.alphabet
+        else:
+            self.is_rna = False
+        if storage == "packed" and len(self.alpha_coder.alph0 if self.is_rna_pwm else alphabet) > 4:
+            raise ValueError("Packed storage requires an alphabet with at most 4 characters.")
+        if storage == "index" and len(self.alpha_coder.alph0 if self.is_rna_pwm else alphabet) > 254:
+            raise ValueError("Index storage requires an alphabet with at most 254 characters.")
+        self.one_hot_encoder = One_Hot_Encoder(alphabet)
+
+
+    def _set_labels(self, labels):
+        # labels of in-memory data: class indices (single-label) or a label matrix (multi-label)
+        labels = np.asarray(labels)
+        if len(labels) != len(self.data):
+            raise ValueError("{} labels were provided for {} sequences.".format(len(labels), len(self.data)))
+        self.multilabel = labels.ndim == 2
+        if self.multilabel:
+            self.labels = labels.astype(np.uint32, copy=False)
+        else:
+            self.labels = np.zeros((len(labels), int(labels.max()) + 1), dtype=np.uint32)
+            self.labels[np.arange(len(labels)), labels] = 1
+        self.additional = np.zeros((len(self.labels), 0), dtype=np.float32)
+        self.codes = np.zeros((len(self.labels), 0), dtype=np.int32)
+        self.train_val_test_split(0.7, 0.15)
+
+
+    def _load_cache(self, entry):
+        # memory-map the arrays of a cache entry, returns False on a cache miss
+        if entry is None or not os.path.exists(os.path.join(entry, "header.json")):
+            return False
+        cached = Data.open_mmap(entry)
+        self._set_storage([getattr(cached, name) for name in self._storage_names()])
+        self.labels, self.length = cached.labels, cached.length
+        self._seed, self._n_files = cached._seed, cached._n_files
+        try:
+            # the modification time of the header marks the last use of the entry
+            os.utime(os.path.join(entry, "header.json"))
+        except OSError:
+            pass
+        return True
+
+
+    def _save_cache(self, entry, cache_size):
+        # write to a temporary folder first, other processes might create the same entry
+        self.splits = {group: np.zeros(0, dtype=np.int64) for group in ["train", "val", "test"]}
+        self.additional = np.zeros((len(self.labels), 0), dtype=np.float32)
+        self.codes = np.zeros((len(self.labels), 0), dtype=np.int32)
+        tmp = "{}.tmp{}".format(entry, os.getpid())
+        self.save_mmap(tmp)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        _evict_cache(os.path.dirname(entry), cache_size)
+
+
+    def _load(self, class_files, n_jobs, class_ids=None):
+        # class_ids: the class of every file; the files are numbered across all calls (file ids)
+        # such that appended files get different replacements of invalid characters
+        joiner = b"_" if self.is_rna else b""
+        class_ids = range(len(class_files)) if class_ids is None else class_ids
+        file_ids = range(self._n_files, self._n_files + len(class_files))
+        self._n_files += len(class_files)
+        if n_jobs > 1:
+            return self._load_parallel(class_files, n_jobs, class_ids, file_ids)
+        for class_id, file_id, file_name in zip(class_ids, file_ids, class_files):
+            handle = io.get_handle(file_name, "rb")
+            for chunk in _chunks(io.parse_fasta_bytes(handle, joiner, offsets=True), self.chunk_size):
+                self._add_chunk(*self._encode_chunk(chunk, file_id), class_id)
             handle.close()
 
 
-    def _join_seq_pwm(self, sequence, pwm):
-        joined = np.zeros((len(sequence), len(self.alpha_coder.alphabet)), np.float32)
-        for i, symbol in enumerate(sequence):
-            pos = self.alpha_coder.alph0.find(symbol) * len(self.alpha_coder.alph1)
-            joined[i, pos:(pos+len(self.alpha_coder.alph1))] = pwm[i,:]
+    def _load_parallel(self, class_files, n_jobs, class_ids, file_ids):
+        # plain files are split into byte ranges at record boundaries, these are parsed and
+        # encoded by the worker processes; gzipped files can't be split, they are parsed here
+        # and only the encoding is done by the workers. Results are added in submission order,
+        # i.e. the result is identical to a serial run.
+        template = self._encoder_template()
+        pending = deque()
+        if shared_memory is not None and os.name == "posix":
+            # the workers must share the resource tracker of this process, otherwise
+            # their trackers would report the (already released) shared memory as leaked
+            resource_tracker.ensure_running()
+        with ProcessPoolExecutor(n_jobs) as pool:
+            try:
+                for class_id, file_id, file_name in zip(class_ids, file_ids, class_files):
+                    if file_name[-2:] == "gz":
+                        handle = io.get_handle(file_name, "rb")
+                        joiner = b"_" if self.is_rna else b""
+                        jobs = ((_encode_records, template, chunk, file_id)
+                                for chunk in _chunks(io.parse_fasta_bytes(handle, joiner, offsets=True),
+                                                     self.chunk_size))
+                    else:
+                        handle = None
+                        jobs = ((_encode_range, template, file_name, start, end, file_id)
+                                for start, end in _record_ranges(file_name, _SHARD_SIZE))
+                    for job in jobs:
+                        pending.append((class_id, pool.submit(*job)))
+                        if len(pending) >= 2 * n_jobs:
+                            self._add_shared(*pending.popleft())
+                    if handle is not None:
+                        handle.close()
+                while pending:
+                    self._add_shared(*pending.popleft())
+            finally:
+                # after an error: release the shared memory of the results that are still queued
+                for _, future in pending:
+                    future.cancel()
+                for _, future in pending:
+                    try:
+                        result = future.result()
+                    except Exception:
+                        continue
+                    if result is not None:
+                        _release_shared(_attach_shared(*result)[3])
+
+
+    def _encoder_template(self):
+        # the attributes needed to encode entries (but not the stored entries, labels or splits)
+        # in an otherwise empty Data object, which is passed to the worker processes
+        template = self.__class__.__new__(self.__class__)
+        names = ["storage", "variable_length", "chunk_size", "_seed", "is_rna", "is_rna_pwm", "one_hot_encoder"]
+        for name in names + (["alpha_coder"] if self.is_rna else []):
+            setattr(template, name, getattr(self, name))
+        return template
+
+
+    def _add_shared(self, class_id, future):
+        result = future.result()
+        if result is None:
+            return
+        encoded, length, headers, shm = _attach_shared(*result)
+        self._add_chunk(encoded, length, headers, class_id)
+        del encoded
+        _release_shared(shm)
+
+
+    def _encode_chunk(self, chunk, file_id):
+        # encode a list of (offset, header, block) fasta entries, returns the encoded
+        # entries in the storage format, the length of the entries and the headers
+        if self.is_rna:
+            return self._encode_chunk_rna(chunk, file_id)
+        offsets, headers, sequences = zip(*chunk)
+        sequences, bounds = self._to_upper(sequences)
+        self._replace_invalid(file_id, offsets, [(sequences, self.one_hot_encoder.alphabet)], bounds)
+        indices = self.one_hot_encoder.lookup[sequences]
+        return self._to_storage(indices, bounds=bounds), self._chunk_length(indices), headers
+
+
+    def _encode_chunk_rna(self, chunk, file_id):
+        offsets, headers, blocks = zip(*chunk)
+        lines = [block.split(b"_") for block in blocks]
+        sequences, bounds = self._to_upper([x[0] for x in lines])
+        if True == self.is_rna_pwm:
+            return self._encode_pwm(file_id, offsets, sequences, bounds, self._parse_pwms(lines, bounds)) + (headers,)
+        structures, structure_bounds = self._to_upper([x[1].split(b" ")[0] for x in lines])
+        if structures.shape != sequences.shape or not np.array_equal(structure_bounds, bounds):
+            raise RuntimeError('Sequences and structures must have the same length.')
+        self._replace_invalid(file_id, offsets, [(sequences, self.alpha_coder.alph0),
+                                                 (structures, self.alpha_coder.alph1)], bounds)
+        indices = self.alpha_coder.encode_indices((sequences, structures))
+        return self._to_storage(indices, bounds=bounds), self._chunk_length(indices), headers
+
+
+    def _encode_pwm(self, file_id, offsets, sequences, bounds, profiles):
+        # profiles: the structure PWMs of all positions, shape (number of positions, len(alph1))
+        self._replace_invalid(file_id, offsets, [(sequences, self.alpha_coder.alph0)], bounds)
+        indices = self.alpha_coder.lookup0[sequences]
+        profiles = profiles.reshape(sequences.shape + (-1,))
+        return self._to_storage(indices, profiles, bounds), self._chunk_length(indices)
+
+
+    def _encode_pwm_records(self, offsets, sequences, pwms, file_id):
+        # in-memory version of the structure PWM case of _encode_chunk_rna
+        sequences, bounds = self._to_upper([x.encode() for x in sequences])
+        profiles = np.concatenate([np.asarray(x, dtype=np.float32).T for x in pwms])
+        if profiles.shape != (bounds[-1], len(self.alpha_coder.alph1)):
+            raise RuntimeError("Structure PWMs must have {} rows with one value per sequence position.".format(
+                len(self.alpha_coder.alph1)))
+        return self._encode_pwm(file_id, offsets, sequences, bounds, profiles)
+
+
+    def _to_upper(self, sequences):
+        # uppercase byte values of a list of byte strings and the bounds of the entries, i.e.
+        # entry i is values[bounds[i]:bounds[i+1]] for sequences of variable length and
+        # values[i] of the (entries, length) array otherwise
+        if self.variable_length:
+            return _to_upper_flat(sequences)
+        values = _to_upper_array(sequences)
+        return values, np.arange(len(sequences)+1, dtype=np.int64) * values.shape[1]
+
+
+    def _chunk_length(self, indices):
+        # the common length of the entries of a chunk (None for sequences of variable length)
+        return None if self.variable_length else indices.shape[1]
+
+
+    def _replace_invalid(self, file_id, offsets, arrays, bounds):
+        # replace characters that are not part of the alphabet with random alphabet characters;
+        # all replacements of a chunk are drawn at once from a counter-based generator (a hash of
+        # seed, file, offset of the entry, position in the entry and array) such that the
+        # replacement doesn't depend on the chunking or the number of processes.
+        # arrays: list of (byte values, alphabet) tuples sharing the same entry bounds (see _to_upper)
+        arrays = [(values.reshape(-1), alphabet) for values, alphabet in arrays]
+        key = np.random.SeedSequence([self._seed, file_id]).generate_state(1, dtype=np.uint64)[0]
+        for stream, (values, alphabet) in enumerate(arrays):
+            symbols = np.frombuffer(alphabet.encode(), dtype=np.uint8)
+            valid = np.zeros(256, dtype=bool)
+            valid[symbols] = True
+            invalid = np.flatnonzero(~valid[values])
+            if len(invalid) == 0:
+                continue
+            rows = np.searchsorted(bounds, invalid, side="right") - 1
+            entries = np.asarray(offsets, dtype=np.uint64)[rows]
+            positions = (invalid - np.asarray(bounds)[rows]).astype(np.uint64)
+            with np.errstate(over="ignore"):
+                state = _mix64(_mix64(key ^ _mix64(entries + np.uint64(stream << 56))) + positions)
+            # the upper 32 bits scaled to the size of the alphabet
+            choice = ((state >> np.uint64(32)) * np.uint64(len(symbols))) >> np.uint64(32)
+            values[invalid] = symbols[choice.astype(np.intp)]
+
+
+    def _open_buffers(self, folder):
+        # encoded chunks, label pairs (row, class) and, when streaming to a folder,
+        # the split indices are collected in growable buffers while the files are read
+        path = lambda name: None if folder is None else os.path.join(folder, name + ".npy")
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+        self.length = None
+        dtypes = {"data": np.float32 if self.is_rna_pwm else np.uint8, "tokens": np.uint8,
+                  "profiles": np.float16 if self.storage == "packed" else np.float32, "lengths": np.int64}
+        inputs = [_Array_Buffer(dtypes[name], path(name)) for name in self._storage_names()]
+        self._buffers = {"inputs": inputs, "label_pairs": _Array_Buffer(np.int64, path("label_pairs"))}
+        if folder is not None:
+            for group in ["train", "val", "test"]:
+                self._buffers[group] = _Array_Buffer(np.int64, path("split_{}".format(group)))
+
+
+    def _add_chunk(self, encoded, length, headers, class_id):
+        start = self._add_encoded(encoded, length)
+        if self.multilabel:
+            pairs = [(start+i, int(x)) for i, header in enumerate(headers) for x in header.split(b',')]
+            pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        else:
+            pairs = np.empty((len(headers), 2), dtype=np.int64)
+            pairs[:, 0] = np.arange(start, start+len(headers))
+            pairs[:, 1] = class_id
+        self._buffers["label_pairs"].append(pairs)
+        # split every chunk into training/validation/test entries on the fly, the numbers
+        # are chosen such that the totals are always 70%/15%/15% of the entries read so far
+        if "train" in self._buffers:
+            end = start + len(headers)
+            n_train = int(end*0.7) - len(self._buffers["train"])
+            n_val = min(max(int(end*0.85) - int(end*0.7) - len(self._buffers["val"]), 0), len(headers) - n_train)
+            idx = start + np.random.permutation(len(headers))
+            for group, part in zip(["train", "val", "test"], np.split(idx, [n_train, n_train+n_val])):
+                self._buffers[group].append(part)
+
+
+    def _add_encoded(self, encoded, length):
+        # append encoded entries to the buffers, returns the index of the first entry
+        if self.variable_length:
+            pass
+        elif self.length is None:
+            self.length = length
+        elif length != self.length:
+            raise RuntimeError('All sequences must have the same length.')
+        # the last storage array has one row per entry (the lengths for variable lengths)
+        start = len(self._buffers["inputs"][-1])
+        for buffer, block in zip(self._buffers["inputs"], encoded):
+            buffer.append(block)
+        return start
+
+
+    def _close_buffers(self, folder):
+        buffers = self._buffers
+        del self._buffers
+        self._set_storage([buffer.finalize() for buffer in buffers["inputs"]])
+        self._process_labels(buffers["label_pairs"].finalize(), folder)
+        if folder is not None:
+            self.splits = {group: buffers[group].finalize(allow_empty=True)
+                           for group in ["train", "val", "test"]}
+            os.remove(os.path.join(folder, "label_pairs.npy"))
+            # no additional data yet (see load_additional_data() and save_mmap())
+            np.save(os.path.join(folder, "additional.npy"), np.zeros((len(self.labels), 0), dtype=np.float32))
+            np.save(os.path.join(folder, "codes.npy"), np.zeros((len(self.labels), 0), dtype=np.int32))
+            self._write_mmap_header(folder)
+
+
+    def _storage_names(self):
+        # names of the attributes holding the encoded sequences
+        if self.storage == "one_hot":
+            return ["data"]
+        names = ["tokens", "profiles"] if self.is_rna_pwm else ["tokens"]
+        return names + ["lengths"] if self.variable_length else names
+
+
+    def _to_storage(self, indices, profiles=None, bounds=None):
+        # convert a block of alphabet indices of shape (n, length) into the storage format, i.e. into
+        # a list with one array per storage attribute; for structure PWMs the indices refer to alph0
+        # and the profiles of shape (n, length, len(alph1)) are required. Sequences of variable
+        # length are given as flat arrays together with the bounds of the entries.
+        if self.variable_length:
+            profiles = [] if profiles is None else [profiles.astype(np.float32)]
+            return [indices] + profiles + [np.diff(bounds)]
+        if self.storage == "one_hot":
+            if profiles is not None:
+                return [self._join_seq_pwm(indices, profiles)]
+            return [np.take(self.one_hot_encoder.lookup_one_hot, indices, axis=0)]
+        tokens = _pack_2bit(indices) if self.storage == "packed" else indices
+        if profiles is not None:
+            return [tokens, profiles.astype(np.float16 if self.storage == "packed" else np.float32)]
+        return [tokens]
+
+
+    def _set_storage(self, stored):
+        for name, values in zip(self._storage_names(), stored):
+            setattr(self, name, values)
+        if self.variable_length:
+            self.offsets = np.concatenate([[0], np.cumsum(self.lengths)]).astype(np.int64)
+        if self.storage != "one_hot":
+            self.data = _One_Hot_View(self)
+
+
+    def _parse_pwms(self, lines, bounds):
+        # parse the structure PWMs of a chunk of entries in a single call, returns an array of shape
+        # (number of positions, len(alph1)) holding the profiles of all entries one after another
+        n_rows = len(self.alpha_coder.alph1)
+        rows = [row for entry in lines for row in entry[1:(n_rows+1)]]
+        values = np.fromstring(b" ".join(rows), dtype=np.float64, sep=" ")
+        if len(rows) != (len(bounds)-1) * n_rows or values.size != bounds[-1] * n_rows:
+            raise RuntimeError("Structure PWMs must have {} rows with one value per sequence position.".format(n_rows))
+        # the rows of an entry are stored one after another, i.e. the value of row r at position
+        # p of the entry starting at position s with length l is values[s*n_rows + r*l + p]
+        lengths = np.diff(bounds)
+        entries = np.repeat(np.arange(len(lengths)), lengths)
+        starts = bounds[entries]
+        idx = (starts * (n_rows-1) + np.arange(bounds[-1]))[:, np.newaxis] + \
+              np.arange(n_rows) * lengths[entries][:, np.newaxis]
+        return values[idx].astype(np.float32)
+
+
+    def _join_seq_pwm(self, sequences, pwms):
+        # sequences: alph0 indices of shape (number of entries, length), the PWM values of
+        # every position are scattered to the columns of the respective sequence character
+        n_cols = len(self.alpha_coder.alph1)
+        joined = np.zeros(sequences.shape + (len(self.alpha_coder.alphabet),), np.float32)
+        columns = sequences[:, :, np.newaxis].astype(np.intp) * n_cols + np.arange(n_cols)
+        np.put_along_axis(joined, columns, pwms, axis=2)
         return joined
 
 
-    def _process_labels(self):
-        n_classes = max(max(entry) for entry in self.labels) + 1
-        for x in range(len(self.labels)):
-            label = np.zeros(n_classes, dtype=np.uint32)
-            label[self.labels[x]] = 1
-            self.labels[x] = label
+    def _process_labels(self, label_pairs, folder=None, n_classes=0):
+        n_classes = max(int(label_pairs[:, 1].max()) + 1, n_classes)
+        shape = (len(self.data), n_classes)
+        if folder is None:
+            self.labels = np.zeros(shape, dtype=np.uint32)
+        else:
+            path = os.path.join(folder, "labels.npy")
+            self.labels = np.lib.format.open_memmap(path, "w+", np.uint32, shape)
+        for i in range(0, len(label_pairs), self.chunk_size):
+            pairs = label_pairs[i:(i+self.chunk_size)]
+            self.labels[pairs[:, 0], pairs[:, 1]] = 1
+        if folder is not None:
+            self.labels.flush()
+            self.labels = np.load(path, mmap_mode='r')
 
 
     def _data_generator(self, group, batch_size, shuffle, labels=True, select=None, seed=None, meta=True):
-        idx = self._get_idx(group)
+        # work on a copy, the split indices must not be reordered (and may be read-only)
+        idx = np.array(self._get_idx(group))
         if select is not None:
             idx = idx[select]
         while 1:
             if shuffle:
                 np.random.seed(seed)
                 np.random.shuffle(idx)
-            # also yield labels
-            if labels:
-                for i in range(0, len(idx), batch_size):
-                    # yield additional data
-                    if meta==True and len(self.meta) > 0:
-                        yield ([np.array([self.data[x] for x in idx[i:(i+batch_size)]]),
-                                self._get_additional_data(idx, i, batch_size)],
-                                np.array([self.labels[x] for x in idx[i:(i+batch_size)]]))
-                    # don't yield additional data
-                    else:
-                        yield (np.array([self.data[x] for x in idx[i:(i+batch_size)]]),
-                               np.array([self.labels[x] for x in idx[i:(i+batch_size)]]))
-            # don't yield labels
+            for batch in self._get_batches(idx, batch_size, np.random if shuffle else None):
+                batch = self._get_batch(batch, labels, meta)
+                if labels:
+                    yield batch
+                else:
+                    # the bare inputs for predict_on_batch and K.function callers, i.e. a list
+                    # of inputs with additional data
+                    yield list(batch[0]) if isinstance(batch[0], tuple) else batch[0]
+
+
+    def _get_batches(self, idx, batch_size, random=None):
+        # split the (shuffled) indices into batches; if a random state is given sequences of
+        # variable length are sorted by length within windows of _SORT_WINDOW batches, such that
+        # batches of sequences of similar length are padded as little as possible but still
+        # consist of different entries in every epoch, and the batch order is shuffled
+        if random is None or not self.variable_length:
+            return [idx[i:(i+batch_size)] for i in range(0, len(idx), batch_size)]
+        batches, window = [], _SORT_WINDOW * batch_size
+        for start in range(0, len(idx), window):
+            part = idx[start:(start+window)]
+            part = part[np.argsort(self.lengths[part], kind="stable")]
+            batches.extend(part[i:(i+batch_size)] for i in range(0, len(part), batch_size))
+        random.shuffle(batches)
+        return batches
+
+
+    def _get_batch(self, idx, labels=True, meta=True, augment=None, weights=None):
+        # one batch is gathered from the contiguous arrays by fancy indexing,
+        # augment: None or (random generator, reverse_complement, max_shift),
+        # weights: None or the sample weights of all rows; without labels the inputs are
+        # wrapped in a tuple, too (the inputs with additional data as a tuple, a list or a bare
+        # tuple would be unpacked by keras as (x, y))
+        inputs = self._get_inputs(idx)
+        if augment is not None:
+            inputs = self._augment(inputs, idx, *augment)
+        if meta == True and len(self.meta) > 0:
+            inputs = [inputs] + self._get_meta_inputs(idx)
+        if labels and weights is not None:
+            return (inputs, self.labels[idx], np.asarray(weights[idx], dtype=np.float32))
+        if labels:
+            return (inputs, self.labels[idx])
+        return (tuple(inputs) if isinstance(inputs, list) else inputs,)
+
+
+    def _augment(self, inputs, idx, rng, reverse_complement, max_shift):
+        # reverse complement half of the entries and shift every entry by up to max_shift positions
+        # (positions moved out of the sequence are dropped, new positions are all-zero); both are
+        # done by a single gather along the positions, followed by a permutation of the columns
+        n, length = inputs.shape[:2]
+        lengths = self.lengths[idx][:, np.newaxis] if self.variable_length else np.full((n, 1), length)
+        flip = rng.random(n) < 0.5 if reverse_complement else np.zeros(n, dtype=bool)
+        shift = rng.integers(-max_shift, max_shift+1, n)
+        source = np.arange(length) - shift[:, np.newaxis]
+        valid = (source >= 0) & (source < lengths)
+        source = np.where(flip[:, np.newaxis], lengths - 1 - source, source)
+        augmented = np.take_along_axis(inputs, np.clip(source, 0, length-1)[:, :, np.newaxis], axis=1)
+        if reverse_complement:
+            augmented[flip] = augmented[flip][:, :, self._reverse_complement_columns()]
+        augmented[~valid] = 0
+        return augmented
+
+
+    def _reverse_complement_columns(self):
+        # column permutation of the one-hot matrices that complements the sequence characters
+        # and mirrors brackets of structures (which swap when a structure is read backwards)
+        complement = lambda alphabet: [_complement_index(alphabet, x) for x in alphabet]
+        if not self.is_rna:
+            return np.array(complement(self.one_hot_encoder.alphabet))
+        alph1 = self.alpha_coder.alph1
+        mirror = [alph1.index(_MIRROR.get(x, x)) if _MIRROR.get(x, x) in alph1 else i for i, x in enumerate(alph1)]
+        return (np.array(complement(self.alpha_coder.alph0))[:, np.newaxis] * len(alph1) + mirror).reshape(-1)
+
+
+    def _get_additional_data(self, idx):
+        return self.additional[idx]
+
+
+    def _get_meta_inputs(self, idx):
+        # additional network inputs: the dense features and the codes of embedded features,
+        # the codes of all features are shifted into a single range of embedding indices
+        inputs = []
+        if self.additional.shape[1] > 0:
+            inputs.append(self._get_additional_data(idx))
+        if self.codes.shape[1] > 0:
+            sizes = self._embedding_sizes()
+            inputs.append(self.codes[idx] + np.cumsum([0] + sizes[:-1], dtype=np.int32))
+        return inputs
+
+
+    def _set_additional(self, additional, widths):
+        # the 'data' entries of the meta dictionary are views of the columns of the matrix
+        self.additional = additional
+        start = 0
+        for x, width in zip(self._dense_meta(), widths):
+            if True == self.meta[x]["is_categorical"]:
+                self.meta[x]["data"] = additional[:, start:(start+width)]
             else:
-                for i in range(0, len(idx), batch_size):
-                    # yield additional data
-                    if meta==True and len(self.meta) > 0:
-                        yield [np.array([self.data[x] for x in idx[i:(i+batch_size)]]),
-                               self._get_additional_data(idx, i, batch_size)]
-                    else:
-                        # don't yield additional data
-                        yield np.array([self.data[x] for x in idx[i:(i+batch_size)]])
-                            
+                self.meta[x]["data"] = additional[:, start]
+            start += width
+
+
+    def _set_codes(self, codes):
+        self.codes = codes
+        for column, x in enumerate(x for x in range(len(self.meta)) if x not in self._dense_meta()):
+            self.meta[x]["data"] = codes[:, column]
 
 
-    def _get_additional_data(self, idx, i, batch_size):
-        result = []
-        for x in idx[i:(i+batch_size)]:
-            additional = np.empty((0,), dtype=np.float32)
-            for idx_add in range(len(self.meta)):
-                additional = np.append(additional, self.meta[idx_add]['data'][x])
-            result.append(additional)
-        return np.array(result)
+    def _dense_meta(self):
+        return [x for x in range(len(self.meta)) if not self.meta[x].get("embedding", False)]
+
+
+    def _additional_widths(self):
+        return [self.meta[x]["data"].shape[1] if self.meta[x]["is_categorical"] else 1
+                for x in self._dense_meta()]
+
+
+    def _embedding_sizes(self):
+        return [self.meta[x]["n_codes"] for x in range(len(self.meta)) if x not in self._dense_meta()]
+
+
+    def _meta_header(self, x):
+        header = {"is_categorical": self.meta[x]["is_categorical"],
+                  "embedding": self.meta[x].get("embedding", False)}
+        if header["embedding"]:
+            header["n_codes"] = self.meta[x]["n_codes"]
+        else:
+            header["width"] = self.meta[x]["data"].shape[1] if self.meta[x]["is_categorical"] else 1
+        return header
+
+
+    def _get_inputs(self, idx):
+        # one-hot encoded sequences for the given indices, compact storage is expanded here
+        if self.storage == "one_hot":
+            return self.data[idx]
+        if self.variable_length:
+            return self._get_padded_inputs(idx)
+        tokens = self.tokens[idx]
+        if self.storage == "packed":
+            tokens = _unpack_2bit(tokens, self.length)
+        if True == self.is_rna_pwm:
+            return self._join_seq_pwm(tokens, self.profiles[idx])
+        return np.take(self.one_hot_encoder.lookup_one_hot, tokens, axis=0)
+
+
+    def _entry_bytes(self, idx):
+        # the entries as rows of bytes, the parts of fixed size (labels, additional data) first;
+        # sequences of variable length are padded with zero bytes which don't change the hash
+        # values of _hash_rows, i.e. the hash of an entry doesn't depend on the other entries
+        parts = [self.labels[idx], self.additional[idx], self.codes[idx]]
+        if self.variable_length:
+            lengths = self.lengths[idx]
+            positions = np.arange(lengths.max() if len(lengths) > 0 else 0)
+            mask = positions < lengths[:, np.newaxis]
+            flat = np.where(mask, self.offsets[idx][:, np.newaxis] + positions, 0)
+            parts.append(lengths)
+            for name in self._storage_names()[:-1]:
+                stored = getattr(self, name)
+                values = stored[flat] if len(stored) > 0 else np.zeros(flat.shape + stored.shape[1:], stored.dtype)
+                values[~mask] = 0
+                parts.append(values)
+        else:
+            parts += [getattr(self, name)[idx] for name in self._storage_names()]
+        parts = [np.ascontiguousarray(x).reshape(len(idx), -1 if len(idx) > 0 else 0).view(np.uint8) for x in parts]
+        return np.concatenate(parts, axis=1)
+
+
+    def _equal_entries(self, idx, other):
+        rows = self._entry_bytes(np.concatenate([idx, other]))
+        return np.array_equal(rows[:len(idx)], rows[len(idx):])
+
+
+    def _get_padded_inputs(self, idx):
+        # sequences of variable length are gathered from the flat arrays and padded
+        # with all-zero positions to the length of the longest sequence
+        lengths = self.lengths[idx]
+        positions = np.arange(lengths.max() if len(lengths) > 0 else 0)
+        mask = positions < lengths[:, np.newaxis]
+        flat = np.where(mask, self.offsets[idx][:, np.newaxis] + positions, 0)
+        tokens = self.tokens[flat] if len(self.tokens) > 0 else np.zeros(flat.shape, dtype=np.uint8)
+        if True == self.is_rna_pwm:
+            inputs = self._join_seq_pwm(tokens, self.profiles[flat])
+        else:
+            inputs = np.take(self.one_hot_encoder.lookup_one_hot, tokens, axis=0)
+        inputs[~mask] = 0
+        return inputs
+
+
+    def _get_tensors(self, tf):
+        # the arrays a tf.data pipeline gathers its batches from,
+        # sequences of variable length become ragged tensors
+        stored = [tf.convert_to_tensor(np.asarray(getattr(self, name))) for name in self._storage_names()]
+        if self.variable_length:
+            stored = [tf.RaggedTensor.from_row_splits(x, self.offsets, validate=False) for x in stored[:-1]]
+            stored.append(tf.convert_to_tensor(np.asarray(self.lengths)))
+        return {"stored": stored, "labels": tf.convert_to_tensor(np.asarray(self.labels, dtype=np.float32)),
+                "lengths": stored[-1] if self.variable_length else None,
+                "additional": tf.convert_to_tensor(np.asarray(self.additional)),
+                "codes": tf.convert_to_tensor(np.asarray(self.codes))}
+
+
+    def _get_tf_batch(self, tf, tensors, idx, labels, augment=None):
+        # graph version of _get_batch
+        inputs = self._get_tf_inputs(tf, tensors["stored"], idx)
+        if augment is not None:
+            inputs = self._augment_tf(tf, tensors, inputs, idx, *augment)
+        if len(self.meta) > 0:
+            inputs = (inputs,)
+            if self.additional.shape[1] > 0:
+                inputs += (tf.gather(tensors["additional"], idx),)
+            if self.codes.shape[1] > 0:
+                shift = np.cumsum([0] + self._embedding_sizes()[:-1], dtype=np.int32)
+                inputs += (tf.gather(tensors["codes"], idx) + shift,)
+        if labels and tensors.get("weights") is not None:
+            return inputs, tf.gather(tensors["labels"], idx), tf.gather(tensors["weights"], idx)
+        if labels:
+            return inputs, tf.gather(tensors["labels"], idx)
+        # a bare tuple of inputs would be unpacked by keras as (x, y)
+        return (inputs,)
+
+
+    def _augment_tf(self, tf, tensors, inputs, idx, reverse_complement, max_shift):
+        # graph version of _augment
+        n, length = tf.shape(inputs)[0], tf.shape(inputs)[1]
+        if self.variable_length:
+            lengths = tf.cast(tf.gather(tensors["lengths"], idx), tf.int32)[:, tf.newaxis]
+        else:
+            lengths = tf.fill([n, 1], length)
+        flip = tf.random.uniform([n]) < (0.5 if reverse_complement else 0.0)
+        shift = tf.random.uniform([n, 1], -max_shift, max_shift+1, dtype=tf.int32)
+        source = tf.range(length)[tf.newaxis, :] - shift
+        valid = (source >= 0) & (source < lengths)
+        source = tf.where(flip[:, tf.newaxis], lengths - 1 - source, source)
+        augmented = tf.gather(inputs, tf.clip_by_value(source, 0, length-1), batch_dims=1)
+        if reverse_complement:
+            complemented = tf.gather(augmented, self._reverse_complement_columns(), axis=2)
+            augmented = tf.where(flip[:, tf.newaxis, tf.newaxis], complemented, augmented)
+        return augmented * tf.cast(valid, augmented.dtype)[:, :, tf.newaxis]
+
+
+    def _get_tf_inputs(self, tf, stored, idx):
+        # graph version of _get_inputs, padded positions of sequences of variable length
+        # get the index -1 which is encoded as all-zero row by tf.one_hot
+        if self.storage == "one_hot":
+            return tf.cast(tf.gather(stored[0], idx), tf.float32)
+        tokens = tf.cast(tf.gather(stored[0], idx), tf.int32)
+        if self.variable_length:
+            tokens = tokens.to_tensor(default_value=-1)
+        if self.storage == "packed":
+            tokens = tf.bitwise.bitwise_and(tf.bitwise.right_shift(tokens[:, :, tf.newaxis], [0, 2, 4, 6]), 3)
+            tokens = tf.reshape(tokens, [tf.shape(tokens)[0], -1])[:, :self.length]
+        if True == self.is_rna_pwm:
+            profiles = tf.gather(stored[1], idx)
+            if self.variable_length:
+                profiles = profiles.to_tensor()
+            sequences = tf.one_hot(tokens, len(self.alpha_coder.alph0))
+            joined = sequences[:, :, :, tf.newaxis] * tf.cast(profiles, tf.float32)[:, :, tf.newaxis, :]
+            return tf.reshape(joined, [tf.shape(tokens)[0], tf.shape(tokens)[1], len(self.one_hot_encoder.alphabet)])
+        return tf.one_hot(tokens, len(self.one_hot_encoder.alphabet))
 
 
     def _get_data(self, group):
         idx = self._get_idx(group)
-        return np.array([self.data[x] for x in idx]), np.array([self.labels[x] for x in idx])
+        return self._get_inputs(idx), self.labels[idx]
 
 
     def _get_idx(self, group):
         if group == "all":
-            return np.array(list(range(len(self.data))))
+            # views (see subset()) only use some of the entries of the arrays
+            if self.indices is not None:
+                return self.indices
+            return np.arange(len(self.data))
         return self.splits[group]
 
 
     def _shape(self):
-        return self.data[0].shape
+        if self.storage == "one_hot":
+            return self.data.shape[1:]
+        if self.variable_length:
+            return (None, len(self.one_hot_encoder.alphabet))
+        return (self.length, len(self.one_hot_encoder.alphabet))
+
+
+    def _get_sample_weights(self):
+        # weights of deduplicated entries for training: multiplicity times class weight (keras
+        # can't combine class weights with sample weights of a generator or dataset)
+        if self.counts is None:
+            return None
+        class_weights = self._get_class_weights()
+        class_weights = np.array([class_weights[x] for x in range(len(class_weights))])
+        return (self.counts * class_weights[np.argmax(self.labels, axis=1)]).astype(np.float32)
 
 
     def _get_class_weights(self):
-        counts = sum(self.labels)
-        counts = float(len(self.labels)) / counts
+        labels = self.labels[self._get_idx("all")]
+        if self.counts is not None:
+            labels = labels * self.counts[self._get_idx("all")][:, np.newaxis]
+        counts = labels.sum(axis=0)
+        counts = float(len(labels)) / counts
         counts = counts / counts.min()
         return {i: val for i, val in enumerate(counts)}
 
 
     def _get_sequences(self, class_id, group, select = None):
         idx = self._get_idx(group)
-        labels = np.array([self.labels[x] for x in idx])
-        idx = idx[np.nonzero(labels[:, class_id])[0]]
-        sequences = []
-        if select is None:
-            select = range(len(idx))
+        idx = idx[np.nonzero(self.labels[idx, class_id])[0]]
+        if select is not None:
+            idx = idx[np.asarray(select, dtype=np.intp)]
         if True == self.is_rna_pwm:
-            for x in select:
-                sequences.append(self.data[idx[x]])
+            sequences = list(self._get_inputs(idx))
         else:
-            for x in select:
-                sequences.append(self.one_hot_encoder.decode(self.data[idx[x]]))
+            sequences = self.one_hot_encoder.decode_batch(self._get_inputs(idx))
+        if self.variable_length:
+            # remove the padding
+            return [x[:length] for x, length in zip(sequences, self.lengths[idx])]
         return sequences
 
 
+class _One_Hot_View:
+    # list-like read-only access to the one-hot matrices of a Data object
+    # that keeps its sequences in a compact storage format
+
+    def __init__(self, data):
+        self.data = data
+
+
+    def __len__(self):
+        if self.data.variable_length:
+            return len(self.data.lengths)
+        return len(self.data.tokens)
+
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError("index {} is out of bounds.".format(key))
+            return self.data._get_inputs(np.array([key % len(self)]))[0]
+        if isinstance(key, slice):
+            return self.data._get_inputs(np.arange(*key.indices(len(self))))
+        return self.data._get_inputs(np.asarray(key))
+
+
+    def __iter__(self):
+        for x in range(len(self)):
+            yield self[x]
+
+
+    @property
+    def shape(self):
+        return (len(self),) + self.data._shape()
+
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32 if self.data.is_rna_pwm else np.uint8)
+
+
+_UPPER = np.frombuffer(bytes(range(256)).upper(), dtype=np.uint8)
+
+
+# complementary characters (in order of preference) and mirrored structure characters
+_COMPLEMENT = {"A": "TU", "C": "G", "G": "C", "T": "A", "U": "A", "N": "N"}
+_MIRROR = {"(": ")", ")": "(", "[": "]", "]": "[", "{": "}", "}": "{", "<": ">", ">": "<"}
+
+
+def _complement_index(alphabet, character):
+    for candidate in _COMPLEMENT.get(character, ""):
+        if candidate in alphabet:
+            return alphabet.index(candidate)
+    raise ValueError("Reverse complement not possible, '{}' has no complement in alphabet '{}'.".format(
+        character, alphabet))
+
+
+def _cache_key(class_files, alphabet, structure_pwm, storage, seed, variable_length):
+    # hash of everything that determines the encoded data, files are identified
+    # by their absolute path, size and modification time
+    files = class_files if isinstance(class_files, list) else [class_files]
+    key = {"files": [[os.path.abspath(f), os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in files],
+           "multilabel": not isinstance(class_files, list), "alphabet": alphabet,
+           "structure_pwm": structure_pwm, "storage": storage, "seed": seed,
+           "variable_length": variable_length, "version": _MMAP_VERSION}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _evict_cache(cache, cache_size):
+    # remove the least recently used entries until the cache fits into cache_size bytes
+    entries = []
+    for name in os.listdir(cache):
+        header = os.path.join(cache, name, "header.json")
+        if ".tmp" in name or not os.path.exists(header):
+            continue
+        folder = os.path.join(cache, name)
+        size = sum(os.path.getsize(os.path.join(folder, x)) for x in os.listdir(folder))
+        entries.append((os.path.getmtime(header), size, folder))
+    total = sum(size for _, size, _ in entries)
+    for _, size, folder in sorted(entries):
+        if total <= cache_size:
+            break
+        shutil.rmtree(folder, ignore_errors=True)
+        total -= size
+
+
+def _to_upper_array(sequences):
+    # map a list of byte strings of the same length to an array of uppercase byte values
+    length = len(sequences[0])
+    for sequence in sequences:
+        if len(sequence) != length:
+            raise RuntimeError('All sequences must have the same length.')
+    return _UPPER[np.frombuffer(b"".join(sequences), dtype=np.uint8)].reshape(len(sequences), length)
+
+
+def _to_upper_flat(sequences):
+    # map a list of byte strings to a flat array of uppercase byte values and the entry bounds
+    bounds = np.zeros(len(sequences)+1, dtype=np.int64)
+    np.cumsum([len(sequence) for sequence in sequences], out=bounds[1:])
+    return _UPPER[np.frombuffer(b"".join(sequences), dtype=np.uint8)], bounds
+
+
+def _pack_2bit(indices):
+    # pack 4 alphabet indices (0-3) into a single byte
+    padded = np.zeros((indices.shape[0], -(-indices.shape[1]//4) * 4), dtype=np.uint8)
+    padded[:, :indices.shape[1]] = indices
+    padded = padded.reshape(indices.shape[0], -1, 4)
+    return padded[:,:,0] | (padded[:,:,1] << 2) | (padded[:,:,2] << 4) | (padded[:,:,3] << 6)
+
+
+def _unpack_2bit(packed, length):
+    shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+    unpacked = (packed[:,:,np.newaxis] >> shifts) & 3
+    return unpacked.reshape(packed.shape[0], -1)[:, :length]
+
+
+def _record_ranges(file_name, size):
+    # split a plain fasta file into byte ranges of about the given size, every range starts at a header
+    bounds = [0]
+    file_size = os.path.getsize(file_name)
+    with open(file_name, "rb") as handle:
+        while bounds[-1] + size < file_size:
+            handle.seek(bounds[-1] + size - 1)
+            offset, found = handle.tell(), -1
+            while found == -1:
+                block = handle.read(1 << 16)
+                if len(block) < 2:
+                    break
+                found = block.find(b"\n>")
+                if found == -1:
+                    handle.seek(-1, 1)
+                    offset = handle.tell()
+            if found == -1:
+                break
+            bounds.append(offset + found + 1)
+    bounds.append(file_size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _encode_range(data, file_name, start, end, file_id):
+    # runs in a worker process
+    with open(file_name, "rb") as handle:
+        handle.seek(start)
+        raw = BytesIO(handle.read(end - start))
+    records = io.parse_fasta_bytes(raw, b"_" if data.is_rna else b"", offsets=True)
+    return _encode_records(data, ((start+offset, header, block) for offset, header, block in records), file_id)
+
+
+def _encode_records(data, records, file_id):
+    # runs in a worker process
+    blocks, headers = [], []
+    for chunk in _chunks(records, data.chunk_size):
+        encoded, length, chunk_headers = data._encode_chunk(chunk, file_id)
+        if blocks and length != blocks[0][1]:
+            raise RuntimeError('All sequences must have the same length.')
+        blocks.append((encoded, length))
+        headers.extend(chunk_headers)
+    if len(blocks) == 0:
+        return None
+    encoded = [np.concatenate(x) if len(blocks) > 1 else x[0] for x in zip(*[x[0] for x in blocks])]
+    return [_share(x) for x in encoded], blocks[0][1], headers
+
+
+def _share(array):
+    if shared_memory is None or array.nbytes == 0:
+        return array
+    shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    shm.close()
+    return (shm.name, array.shape, array.dtype.str)
+
+
+def _attach_shared(shared, length, headers):
+    # returns the shared arrays and the shared memory blocks that must be released afterwards
+    arrays, blocks = [], []
+    for x in shared:
+        if isinstance(x, np.ndarray):
+            arrays.append(x)
+            continue
+        blocks.append(shared_memory.SharedMemory(name=x[0]))
+        arrays.append(np.ndarray(x[1], dtype=np.dtype(x[2]), buffer=blocks[-1].buf))
+    return arrays, length, headers, blocks
+
+
+def _release_shared(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _mix64(x):
+    # the finalizer of splitmix64 (wraps around modulo 2**64)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_rows(rows, seed):
+    # 64 bit hash values of the rows of a uint8 matrix: the sum of the mixed 64 bit words, salted
+    # with their position; zero words are skipped, i.e. trailing zero bytes don't change the hash
+    words = np.zeros((len(rows), -(-rows.shape[1] // 8) * 8), dtype=np.uint8)
+    words[:, :rows.shape[1]] = rows
+    words = words.view(np.uint64)
+    salt = _mix64(np.arange(words.shape[1], dtype=np.uint64) + np.uint64(seed << 32) + np.uint64(1))
+    with np.errstate(over="ignore"):
+        return np.where(words != 0, _mix64(words ^ salt), np.uint64(0)).sum(axis=1, dtype=np.uint64)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+class _Array_Buffer:
+    # a growable contiguous array that is filled block-wise along the first axis;
+    # in memory the capacity is doubled when needed so that appending runs in amortized
+    # constant time, with a file path the blocks are appended to a .npy file instead
+    # (with a fixed size header that is updated once the final shape is known)
+
+    def __init__(self, dtype, path=None):
+        self.dtype = np.dtype(dtype)
+        self.path = path
+        self.array = None
+        self.handle = None
+        self.shape = None
+        self.size = 0
+
+
+    def __len__(self):
+        return self.size
+
+
+    def append(self, block):
+        if self.shape is None:
+            self.shape = block.shape[1:]
+            if self.path is None:
+                self.array = np.empty((max(1024, len(block)),) + self.shape, dtype=self.dtype)
+            else:
+                self.handle = open(self.path, "wb")
+                self.handle.write(_npy_header(self.dtype, (0,) + self.shape))
+        elif block.shape[1:] != self.shape:
+            raise RuntimeError('All sequences must have the same length.')
+        if self.handle is not None:
+            self.handle.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+            self.size += len(block)
+            return
+        if self.size + len(block) > len(self.array):
+            capacity = max(2 * len(self.array), self.size + len(block))
+            grown = np.empty((capacity,) + self.shape, dtype=self.dtype)
+            grown[:self.size] = self.array[:self.size]
+            self.array = grown
+        self.array[self.size:(self.size+len(block))] = block
+        self.size += len(block)
+
+
+    def finalize(self, allow_empty=False):
+        if self.shape is None:
+            if not allow_empty:
+                raise RuntimeError('No sequences found.')
+            self.append(np.empty((0,), dtype=self.dtype))
+        if self.handle is not None:
+            self.handle.seek(0)
+            self.handle.write(_npy_header(self.dtype, (self.size,) + self.shape))
+            self.handle.close()
+            return np.load(self.path, mmap_mode='r')
+        self.array.resize((self.size,) + self.shape, refcheck=False)
+        return self.array
+
+
+def _npy_header(dtype, shape):
+    # a version 1.0 .npy header padded to 128 bytes, i.e. its size doesn't depend on the shape
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+        np.lib.format.dtype_to_descr(dtype), tuple(shape))
+    header = header.ljust(128 - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
@@ -0,0 +1,131 @@
+import numpy as np
+from keras.utils import Sequence
+
+
+class Data_Sequence(Sequence):
+    """
+    The Data_Sequence class provides indexed access to the batches of a subset of a Data object.
+
+    It is a keras Sequence, i.e. it can be passed to the fit/predict functions of a keras model
+    together with the 'workers' and 'max_queue_size' arguments: the batches are then assembled by
+    multiple threads in the background while the network is trained on the previous batches.
+    The Model class uses Data_Sequence objects internally (see the 'workers' and 'max_queue_size'
+    parameters of Model), but they can be used for custom training loops as well.
+
+    If shuffle is True the entries are shuffled at the beginning and after every epoch (keras calls
+    on_epoch_end()), using a random number generator initialized with the seed, i.e. the batches of
+    all epochs are reproducible. For sequences of variable length (see Data) the entries of every
+    batch have a similar length.
+
+    Batches can be augmented on the fly (usually only for training), without storing augmented
+    copies of the data: if reverse_complement is True every entry is reversed and complemented
+    with a probability of 0.5 (A <-> T/U, C <-> G; for sequence-structure data brackets of the
+    structure are mirrored, e.g. '(' <-> ')') and if max_shift > 0 every entry is shifted by a
+    random number of positions in [-max_shift, max_shift] (positions shifted out of the sequence
+    are dropped and the free positions are all-zero). The augmentation of a batch only depends on
+    the seed, the epoch and the batch index, i.e. not on the number of workers.
+    """
+
+    def __init__(self, data, group, batch_size, shuffle=True, labels=True, select=None, seed=None, meta=True, reverse_complement=False, max_shift=0, sample_weights=None):
+        """ Initialize the batches of a subset of a Data object.
+
+        Parameters
+        ----------
+        data : pysster.Data
+            A Data object.
+
+        group : str
+            The subset of the Data object that should be used ('train', 'val', 'test' or 'all').
+
+        batch_size : int
+            Number of entries per batch (the last batch may be smaller).
+
+        shuffle : bool
+            Shuffle the entries after every epoch (True) or keep their order (False)?
+
+        labels : bool
+            Should batches be tuples (inputs, labels) (True) or inputs only (False)?
+
+        select : numpy.ndarray
+            Indices of the entries of the group that should be used (default: all entries).
+
+        seed : int
+            Seed for the random number generator used for shuffling.
+
+        meta : bool
+            Should the inputs include the additional data (see Data.load_additional_data)?
+
+        reverse_complement : bool
+            Randomly reverse complement entries (see above)?
+
+        max_shift : int
+            Maximum number of positions entries are randomly shifted by (see above).
+
+        sample_weights : numpy.ndarray
+            One weight per row of the Data object, added to the batches (default: the counts of deduplicated data).
+        """
+        super().__init__()
+        self.data = data
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.labels = labels
+        self.meta = meta
+        self.sample_weights = data.counts if sample_weights is None else sample_weights
+        # work on a copy, the split indices must not be reordered (and may be read-only)
+        self.idx = np.array(data._get_idx(group))
+        if select is not None:
+            self.idx = self.idx[select]
+        self.random = np.random.RandomState(seed)
+        self.augment = None
+        if reverse_complement or max_shift > 0:
+            self.augment = (self.random.randint(2**31), reverse_complement, max_shift)
+        if reverse_complement:
+            # fail early for alphabets without complementary characters
+            data._reverse_complement_columns()
+        self.epoch = -1
+        self.batches = None
+        self.on_epoch_end()
+
+
+    def __len__(self):
+        """ Get the number of batches.
+
+        Returns
+        -------
+        n : int
+            The number of batches per epoch.
+        """
+        return len(self.batches)
+
+
+    def __getitem__(self, index):
+        """ Get a batch.
+
+        Parameters
+        ----------
+        index : int
+            The index of the batch (0 <= index < len(self)).
+
+        Returns
+        -------
+        batch : tuple
+            The inputs (a numpy.ndarray or a list with additional data) and labels (if labels is True) of the batch (and sample weights for deduplicated data, see Data.deduplicate()).
+        """
+        if not -len(self) <= index < len(self):
+            raise IndexError("index {} is out of bounds.".format(index))
+        augment = None
+        if self.augment is not None:
+            rng = np.random.default_rng([self.augment[0], self.epoch, index % len(self)])
+            augment = (rng,) + self.augment[1:]
+        return self.data._get_batch(self.batches[index], self.labels, self.meta, augment, self.sample_weights)
+
+
+    def on_epoch_end(self):
+        """ Shuffle the entries (if shuffle is True), called by keras after every epoch.
+        """
+        self.epoch += 1
+        if self.shuffle:
+            self.random.shuffle(self.idx)
+            self.batches = self.data._get_batches(self.idx, self.batch_size, self.random)
+        elif self.batches is None:
+            self.batches = self.data._get_batches(self.idx, self.batch_size)
@@ -0,0 +1,182 @@
+import os
+import mmap
+import numpy as np
+
+
+import pysster.utils as io
+
+
+# complement of the IUPAC nucleotide codes (soft-masked lowercase characters stay lowercase)
+_COMPLEMENT = bytes.maketrans(b"ACGTURYKMBVDHacgturykmbvdh", b"TGCAAYRMKVBHDtgcaayrmkvbhd")
+
+
+class Genome:
+    """
+    The Genome class provides random access to the sequences of a (large) reference genome.
+
+    The reference must be a plain (uncompressed) fasta file in which all lines of a sequence
+    have the same length (except the last one), like the files used by samtools faidx.
+    The file is memory-mapped and an index of the sequences (name, length, byte offset, bases
+    and bytes per line) is built on the first use and written to a .fai file next to the fasta
+    file (the format of samtools faidx, i.e. existing .fai files are used as they are).
+    An interval can therefore be sliced out of the file at a constant cost (independent of its
+    position and of the size of the genome), without reading the genome into memory.
+
+    Intervals use 0-based half-open coordinates (like BED files), sequences of the minus strand
+    are reverse complemented. Genome objects are passed to Data.from_intervals() to create
+    a Data object directly from a set of intervals, e.g. provided by a BED file.
+    """
+
+    def __init__(self, fasta_file, index_file=None):
+        """ Open a reference genome.
+
+        Parameters
+        ----------
+        fasta_file : str
+            A plain fasta file.
+
+        index_file : str
+            The index file (default: fasta_file + ".fai"), built if missing or older than the fasta file.
+        """
+        self.fasta_file = fasta_file
+        self.index_file = index_file if index_file is not None else fasta_file + ".fai"
+        with open(fasta_file, "rb") as handle:
+            if handle.read(2) == b"\x1f\x8b":
+                raise ValueError("Genome files must not be compressed.")
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if os.path.isfile(self.index_file) and os.path.getmtime(self.index_file) >= os.path.getmtime(fasta_file):
+            self.index = _read_index(self.index_file)
+        else:
+            self.index = self._build_index()
+            try:
+                _write_index(self.index_file, self.index)
+            except OSError:
+                pass
+
+
+    def __del__(self):
+        self.close()
+
+
+    def close(self):
+        """ Close the memory-mapped fasta file.
+        """
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+    @property
+    def lengths(self):
+        """ A dict mapping sequence names to sequence lengths.
+        """
+        return {name: entry[0] for name, entry in self.index.items()}
+
+
+    def fetch(self, name, start, end, strand="+"):
+        """ Get the sequence of an interval.
+
+        Parameters
+        ----------
+        name : str
+            The name of the sequence (the first word of the fasta header).
+
+        start : int
+            Start of the interval (0-based, included).
+
+        end : int
+            End of the interval (0-based, excluded).
+
+        strand : str
+            '+' for the forward strand, '-' for the reverse complement.
+
+        Returns
+        -------
+        sequence : str
+            The sequence of the interval (with the capitalization of the fasta file).
+        """
+        return self._fetch(name, start, end, strand).decode()
+
+
+    def _fetch(self, name, start, end, strand):
+        try:
+            length, offset, line_bases, line_width = self.index[name]
+        except KeyError:
+            raise ValueError("Sequence '{}' not found in the genome.".format(name)) from None
+        if not 0 <= start <= end <= length:
+            raise ValueError("Interval {}:{}-{} exceeds the sequence (length {}).".format(name, start, end, length))
+        # byte positions of the first and (after) the last base, newlines in between are removed
+        first = offset + start // line_bases * line_width + start % line_bases
+        last = offset + end // line_bases * line_width + end % line_bases
+        sequence = self._mmap[first:last]
+        if line_width != line_bases:
+            sequence = sequence.translate(None, b"\r\n")
+        if strand == "-":
+            return sequence[::-1].translate(_COMPLEMENT)
+        if strand not in ["+", "."]:
+            raise ValueError("Strand '{}' not supported.".format(strand))
+        return sequence
+
+
+    def _build_index(self):
+        # scan the entries (header positions) and check that the lines of each sequence have
+        # the same length using the positions of the newline characters (one sequence at a time)
+        index = {}
+        header = self._mmap.find(b">")
+        while header != -1:
+            start = self._mmap.find(b"\n", header) + 1 or len(self._mmap)
+            name = (self._mmap[header+1:start].split() or [b""])[0].decode()
+            if name in index:
+                raise ValueError("Sequence '{}' occurs more than once in the genome.".format(name))
+            end = self._mmap.find(b"\n>", start - 1)
+            header = -1 if end == -1 else end + 1
+            block = np.frombuffer(self._mmap[start:len(self._mmap) if end == -1 else end], dtype=np.uint8)
+            length, line_bases, line_width = _line_layout(name, block)
+            index[name] = (length, start, line_bases, line_width)
+        if len(index) == 0:
+            raise ValueError("No sequences found in {}.".format(self.fasta_file))
+        return index
+
+
+def _line_layout(name, block):
+    # length, bases per line and bytes per line of a sequence (trailing whitespace is ignored)
+    visible = np.flatnonzero(block > ord(" "))
+    block = block[:visible[-1] + 1 if len(visible) > 0 else 0]
+    newlines = np.flatnonzero(block == ord("\n"))
+    if len(newlines) == 0:
+        return len(block), max(len(block), 1), len(block) + 1
+    line_width = int(newlines[0]) + 1
+    line_bases = line_width - 1 - int(newlines[0] > 0 and block[newlines[0] - 1] == ord("\r"))
+    last_line = len(block) - line_width * len(newlines)
+    if not np.array_equal(newlines, np.arange(1, len(newlines) + 1) * line_width - 1) or not 0 < last_line <= line_bases:
+        raise ValueError("Lines of sequence '{}' have different lengths.".format(name))
+    return len(newlines) * line_bases + last_line, line_bases, line_width
+
+
+def _read_index(file_name):
+    index = {}
+    with open(file_name, "rt") as handle:
+        for line in handle:
+            fields = line.split("\t")
+            index[fields[0]] = tuple(int(x) for x in fields[1:5])
+    return index
+
+
+def _write_index(file_name, index):
+    with open(file_name, "wt") as handle:
+        for name, entry in index.items():
+            handle.write("\t".join([name] + [str(x) for x in entry]) + "\n")
+
+
+def _parse_intervals(intervals):
+    # intervals are given as a BED file (optionally gzipped) or as tuples (name, start, end[, strand])
+    if not isinstance(intervals, str):
+        for interval in intervals:
+            yield (interval[0], int(interval[1]), int(interval[2]), interval[3] if len(interval) > 3 else "+")
+        return
+    with io.get_handle(intervals, "rt") as handle:
+        for line in handle:
+            if line.startswith(("#", "track", "browser")) or not line.strip():
+                continue
+            fields = line.rstrip("\r\n").split("\t")
+            yield (fields[0], int(fields[1]), int(fields[2]), fields[5] if len(fields) > 5 else "+")
@@ -10,8 +10,8 @@ from keras import backend as K
 from keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
 from keras.models import Sequential, load_model
 from keras.models import Model as KModel
-from keras.layers import Dropout, Conv1D, MaxPooling1D, Flatten, Dense
-from keras.layers import Input, LSTM, GRU, Bidirectional, concatenate
+from keras.layers import Dropout, Conv1D, MaxPooling1D, Flatten, Dense, GlobalMaxPooling1D
+from keras.layers import Input, LSTM, GRU, Bidirectional, Embedding, concatenate
 from keras.constraints import max_norm
 from keras.optimizers import Adam
 from keras.initializers import RandomUniform, Constant
@@ -21,6 +21,7 @@ from collections import OrderedDict
 
 import pysster.utils as utils
 from pysster.Motif import Motif
+from pysster.Data_Sequence import Data_Sequence
 
 
 class Model:
@@ -59,6 +60,13 @@ class Model:
     #| patience_stopping | 15      | number of epochs without validation loss improvement before stopping training |
     #| epochs            | 500     | maximum number of training epochs |
     #| kernel_constraint | 3       | max-norm weight constraint |
+    #| embedding_dim     | 8       | output dimensions of the embedding of categorical additional data (see Data.load_additional_data) |
+    #| workers           | 1       | number of threads assembling batches in the background during training and prediction |
+    #| max_queue_size    | 10      | maximum number of batches assembled in advance |
+    #| augment_rc        | False   | randomly reverse complement training sequences (see Data_Sequence) |
+    #| augment_shift     | 0       | randomly shift training sequences by up to this number of positions |
+    #| tf_data           | False   | feed the network from a tf.data pipeline (see Data.to_dataset, tensorflow >= 2.6) instead of background workers |
+    #| global_pooling    | False   | global max pooling instead of flattening the output of the convolutional block (always used for sequences of variable length) |
 
     Not all parameters are equally important when doing a hyperparameter grid search. The ones
     with a strong influence are usually conv_num (range 1-3), kernel_num (range 50-300), 
@@ -70,6 +78,11 @@ class Model:
     this number further to 138. If you use too many convolutional/pooling stacks you will get an
     error, because your sequence length will be <= 0.
 
+    For sequences of variable length (see Data) the output of the convolutional block is reduced
+    by a global max pooling layer (the maximum of each kernel over all positions), such that the
+    same network can be applied to batches of any length. Sequences must still be long enough
+    for all convolutional/pooling stacks.
+
     For advanced users we offer the option to add recurrent layers (RNN) between the convolutional
     and the dense block. Two kinds of layers are possible: Long Short Term Memory (LSTM) or Gated
     Recurrent Units (GRU). They can be tuned using the following hyperparameters provided through
@@ -117,13 +130,9 @@ class Model:
                 self.params["activation"] = "sigmoid"
                 self.params["loss"] = "binary_crossentropy"
             if len(data.meta) > 0:
-                length = 0
-                for x in data.meta:
-                    if not data.meta[x]["is_categorical"]:
-                        length += 1
-                    else:
-                        length += len(data.meta[x]["data"][0])
-                self.params["additional_input_length"] = length
+                self.params["additional_input_length"] = data.additional.shape[1]
+                self.params["embedding_input_length"] = data.codes.shape[1]
+                self.params["embedding_input_dim"] = int(sum(data._embedding_sizes()))
         if seed != None:
             self.params['seed'] = seed
         self.temp_file = "{}/{}.hdf5".format(
@@ -159,20 +168,36 @@ class Model:
         """
         np.random.seed(self.params["seed"])
         random.seed(self.params["seed"])
-        n_train = len(data._get_idx('train'))
-        n_train = n_train//self.params['batch_size'] + (n_train%self.params['batch_size'] != 0)
-        n_val = len(data._get_idx('val'))
-        n_val = n_val//self.params['batch_size'] + (n_val%self.params['batch_size'] != 0)
-        self.model.fit_generator(generator = data._data_generator('train',self.params['batch_size'],
-                                                                  True, seed=self.params["seed"]),
-                                 steps_per_epoch = n_train,
-                                 epochs = self.params['epochs'],
-                                 callbacks = self.callbacks,
-                                 verbose = verbose,
-                                 validation_data = data._data_generator('val',self.params['batch_size'],
-                                                                        True, seed=self.params["seed"]),
-                                 validation_steps = n_val,
-                                 class_weight = data._get_class_weights())
+        # deduplicated data (see Data.deduplicate()) are weighted by their multiplicities,
+        # their class weights are part of the sample weights; the validation data get the
+        # same weights on both backends, such that the val_loss doesn't depend on the backend
+        weights = data._get_sample_weights()
+        class_weight = data._get_class_weights() if weights is None else None
+        if self.params['tf_data']:
+            train = data.to_dataset('train', self.params['batch_size'], True, seed=self.params["seed"],
+                                    reverse_complement=self.params['augment_rc'],
+                                    max_shift=self.params['augment_shift'], sample_weights=weights)
+            self.model.fit(train,
+                           epochs = self.params['epochs'],
+                           callbacks = self.callbacks,
+                           verbose = verbose,
+                           validation_data = data.to_dataset('val', self.params['batch_size'], False,
+                                                             sample_weights=weights),
+                           class_weight = class_weight)
+        else:
+            train = Data_Sequence(data, 'train', self.params['batch_size'], True, seed=self.params["seed"],
+                                  reverse_complement=self.params['augment_rc'],
+                                  max_shift=self.params['augment_shift'], sample_weights=weights)
+            val = Data_Sequence(data, 'val', self.params['batch_size'], False, sample_weights=weights)
+            self.model.fit(train,
+                           epochs = self.params['epochs'],
+                           callbacks = self.callbacks,
+                           verbose = verbose,
+                           validation_data = val,
+                           class_weight = class_weight,
+                           workers = self.params['workers'],
+                           max_queue_size = self.params['max_queue_size'],
+                           shuffle = False)
         self.model = load_model(self.temp_file)
         remove(self.temp_file)
 
@@ -197,10 +222,12 @@ class Model:
         predictions : numpy.ndarray
             An array containing predicted probabilities.
         """
-        data_gen = data._data_generator(group, self.params['batch_size'], False, False)
-        idx = data._get_idx(group)
-        n = max(len(idx)//self.params['batch_size'] + (len(idx)%self.params['batch_size'] != 0), 1)
-        return self.model.predict_generator(data_gen, n)
+        if self.params['tf_data']:
+            return self.model.predict(data.to_dataset(group, self.params['batch_size'], False, labels=False))
+        batches = Data_Sequence(data, group, self.params['batch_size'], False, False)
+        return self.model.predict(batches,
+                                  workers = self.params['workers'],
+                                  max_queue_size = self.params['max_queue_size'])
 
 
     def get_max_activations(self, data, group):
@@ -242,7 +269,7 @@ class Model:
             tmp = tmp_model.predict_on_batch(next(data_gen))
             activations.append(tmp.max(axis=1))
         return {'activations': np.vstack(activations), 
-                'labels': np.array([data.labels[x] for x in idx]),
+                'labels': data.labels[idx],
                 'group': group}
 
 
@@ -311,6 +338,7 @@ class Model:
         results: (pysster.Motif, float) or ((pysster.Motif, pysster.Motif), float)
             A Motif object (or a tuple of Motifs for sequence/structure motifs) and the importance score.
         """
+        self._check_fixed_length()
         if not self.model.layers[2].name.startswith("conv1d") and \
            not self.model.layers[0].name.startswith("dropout"):
             raise RuntimeError("First layer is not a convolutional layer. Visualization not possible.")
@@ -396,6 +424,7 @@ class Model:
         results: [pysster.Motif] or [(pysster.Motif, pysster.Motif)]
             A list of Motif objects (or a list of tuples of Motifs for sequence/structure cases).
         """
+        self._check_fixed_length()
         if folder[-1] != "/":
             folder += "/"
         # create plots for each kernel
@@ -508,6 +537,7 @@ class Model:
         nodes : [int]
             List of integers indicating which nodes of the layer should be optimized (default: all).
         """
+        self._check_fixed_length()
         if len(self.inputs) > 1:
             raise RuntimeError("Optimization not possible for a model with additional input.")
         if nodes == None:
@@ -533,7 +563,10 @@ class Model:
                           'epochs': 500, 'activation': "softmax", 'loss': "categorical_crossentropy",
                           'rnn_type': None, 'rnn_num': 1, 'rnn_units': 32, 'rnn_bidirectional': True,
                           'rnn_dropout_input': 0.2, 'rnn_dropout_recurrent': 0.0,
-                          'seed': None, 'additional_input_length': 0}
+                          'seed': None, 'additional_input_length': 0, 'embedding_input_length': 0,
+                          'embedding_input_dim': 0, 'embedding_dim': 8, 'global_pooling': False,
+                          'workers': 1, 'max_queue_size': 10, 'tf_data': False,
+                          'augment_rc': False, 'augment_shift': 0}
         for key in default_params:
             if not key in self.params:
                 self.params[key] = default_params[key]
@@ -591,6 +624,8 @@ class Model:
             for x in range(self.params["rnn_num"]-1):
                 self._add_rnn_layer(rnn, return_sequences=True)
             self._add_rnn_layer(rnn, return_sequences=False)
+        elif self.params["global_pooling"] or self.params["input_shape"][0] is None:
+            self.cnn = GlobalMaxPooling1D()(self.cnn)
         else:
             self.cnn = Flatten()(self.cnn)
         
@@ -600,6 +635,12 @@ class Model:
             if x == 0 and self.params["additional_input_length"] > 0:
                 self.additional_input = Input(shape=(self.params["additional_input_length"],))
                 self.cnn = concatenate([self.cnn, self.additional_input])
+            # categorical additional input given as integer codes is embedded first
+            if x == 0 and self.params["embedding_input_length"] > 0:
+                self.embedding_input = Input(shape=(self.params["embedding_input_length"],), dtype="int32")
+                embedded = Embedding(input_dim = self.params["embedding_input_dim"],
+                                     output_dim = self.params["embedding_dim"])(self.embedding_input)
+                self.cnn = concatenate([self.cnn, Flatten()(embedded)])
             self.cnn = Dense(units = self.params["neuron_num"],
                              kernel_initializer = RandomUniform(),
                              kernel_constraint = max_norm(self.params["kernel_constraint"]),
@@ -610,10 +651,11 @@ class Model:
         self.cnn = Dense(units = self.params["class_num"],
                          kernel_initializer = RandomUniform(),
                          activation = self.params['activation'])(self.cnn)
+        self.inputs = [self.main_input]
         if self.params["dense_num"] > 0 and self.params["additional_input_length"] > 0:
-            self.inputs = [self.main_input, self.additional_input]
-        else:
-            self.inputs = [self.main_input]
+            self.inputs.append(self.additional_input)
+        if self.params["dense_num"] > 0 and self.params["embedding_input_length"] > 0:
+            self.inputs.append(self.embedding_input)
         self.model = KModel(inputs=self.inputs, outputs=[self.cnn])
         self.model.compile(loss = self.params['loss'],
                            optimizer = Adam(lr = self.params["learning_rate"]))
@@ -629,21 +671,23 @@ class Model:
     def _plot_motif(self, data, subseqs):
         # original structure input was a PWM
         if isinstance(subseqs[0], np.ndarray):
-            rnas, structs = [], []
-            for pwm in subseqs:
-                idx = np.argmax(~np.isclose(pwm, 0), axis=1)
-                rnas.append(''.join(data.alpha_coder.alph0[x] for x in idx//len(data.alpha_coder.alph1)))
-                structs.append(np.zeros((len(rnas[-1]), len(data.alpha_coder.alph1)), dtype=np.float32))
-                for i, val in enumerate(idx):
-                    val = val - val%len(data.alpha_coder.alph1)
-                    structs[-1][i] = pwm[i,val:(val+len(data.alpha_coder.alph1))]
+            n_struct = len(data.alpha_coder.alph1)
+            pwms = np.array(subseqs)
+            idx = np.argmax(~np.isclose(pwms, 0), axis=2)
+            base = idx - idx % n_struct
+            rnas = [data.alpha_coder.decode_indices(x)[0] for x in idx]
+            structs = np.take_along_axis(pwms, base[:, :, np.newaxis] + np.arange(n_struct), axis=2)
             structs = np.sum(structs, 0) / len(structs)
             logo_rna = Motif(data.alpha_coder.alph0, sequences = rnas)
             logo_struct = Motif(data.alpha_coder.alph1, pwm = structs)
             return (logo_rna, logo_struct)
         # original structure input was a string
         if data.is_rna:
-            rnas, structs = zip(*(data.alpha_coder.decode(seq) for seq in subseqs))
+            indices = data.one_hot_encoder.encode_indices(["".join(subseqs)])[0]
+            rna, struct = data.alpha_coder.decode_indices(indices)
+            bounds = np.cumsum([0] + [len(seq) for seq in subseqs])
+            rnas = [rna[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            structs = [struct[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
             logo_rna = Motif(data.alpha_coder.alph0, sequences = rnas)
             logo_struct = Motif(data.alpha_coder.alph1, sequences = structs)
             return (logo_rna, logo_struct)
@@ -658,7 +702,14 @@ class Model:
         return subseqs
 
 
+    def _check_fixed_length(self):
+        # the kernel/input visualizations map activations to positions of sequences of a fixed length
+        if self.params["input_shape"][0] is None:
+            raise RuntimeError("Visualization is not supported for sequences of variable length.")
+
+
     def _get_activations_idx_kernel(self, data, idx, group, kernel):
+        self._check_fixed_length()
         # support models from pysster v1.0
         if self.model.layers[0].name.startswith("dropout"):
             layer_idx = 1
@@ -698,6 +749,7 @@ class Model:
 
 
     def _get_optimized_input(self, model, data, layer_name, node_index, boundary, lr, steps, colors_sequence, colors_structure):
+        self._check_fixed_length()
         for attempt in range(5):
             input_data = np.random.uniform(-boundary, +boundary,
                                            (1, self.params["input_shape"][0], self.params["input_shape"][1]))
@@ -8,6 +8,12 @@ class One_Hot_Encoder:
     where each row represents a position in the string and each column
     represents a character from the alphabet. Each row has exactly one 1 at the
     matching alphabet character and consists of 0s otherwise.
+
+    Encoding and decoding map the characters (code points) of the strings through
+    lookup tables, so that many sequences of the same length can be processed in one
+    vectorized step (see encode_batch and decode_batch). The indices of the characters
+    are uint8 values (uint16 for alphabets with 255 or more symbols), the largest value
+    marks characters that are not part of the alphabet.
     """
 
     def __init__(self, alphabet):
@@ -21,6 +27,19 @@ class One_Hot_Encoder:
         self.alphabet = alphabet
         self.table = {symbol: i for i, symbol in enumerate(alphabet)}
         self.table_rev = {v: k for k, v in self.table.items()}
+        # alphabet index -> code point
+        self.lookup_rev = np.array([ord(x) for x in alphabet], dtype=np.uint32)
+        # code point -> alphabet index (self.invalid for characters that are not part of the
+        # alphabet), covers at least all byte values and the last entry is always self.invalid
+        self.dtype = np.dtype(np.uint8 if len(alphabet) < 255 else np.uint16)
+        self.invalid = np.iinfo(self.dtype).max
+        self.lookup = np.full(max(256, int(self.lookup_rev.max(initial=0)) + 2), self.invalid, dtype=self.dtype)
+        self.lookup[self.lookup_rev] = np.arange(len(alphabet))
+        # ASCII alphabets can use the (faster) bytes of the strings instead of the code points
+        self.ascii = bool((self.lookup_rev < 128).all())
+        # alphabet index -> one-hot row (indices that are not part of the alphabet map to 0s)
+        self.lookup_one_hot = np.zeros((max(256, len(alphabet)), len(alphabet)), dtype=np.uint8)
+        self.lookup_one_hot[np.arange(len(alphabet)), np.arange(len(alphabet))] = 1
 
     def encode(self, sequence):
         """ Encode a sequence into a one-hot integer matrix.
@@ -37,9 +56,7 @@ class One_Hot_Encoder:
         one_hot: numpy.ndarray
             A numpy array with shape (len(sequence), len(alphabet)).
         """
-        one_hot = np.zeros((len(sequence), len(self.table)), np.uint8)
-        one_hot[np.arange(len(sequence)), [self.table[x] for x in sequence]] = 1
-        return one_hot
+        return self.encode_batch([sequence])[0]
 
     def decode(self, one_hot):
         """ Decode a one-hot integer matrix into the original sequence.
@@ -54,4 +71,82 @@ class One_Hot_Encoder:
         sequence: str
             The sequence that is represented by the one-hot matrix.
         """
-        return ''.join(self.table_rev[x] for x in np.argmax(one_hot, axis=1))
+        return self._decode_codes(self.lookup_rev[np.argmax(one_hot, axis=1)])
+
+    def encode_batch(self, sequences):
+        """ Encode a list of sequences into a single one-hot integer array.
+
+        All sequences must have the same length and should only contain characters from
+        the alphabet provided to __init__.
+
+        Parameters
+        ----------
+        sequences : [str]
+            The sequences that should be encoded.
+
+        Returns
+        -------
+        one_hot: numpy.ndarray
+            A numpy array with shape (len(sequences), length of sequences, len(alphabet)).
+        """
+        return np.take(self.lookup_one_hot, self.encode_indices(sequences), axis=0)
+
+    def decode_batch(self, one_hot):
+        """ Decode a one-hot integer array into the original sequences.
+
+        Parameters
+        ----------
+        one_hot : numpy.ndarray
+            An array of shape (number of sequences, length of sequences, len(alphabet)),
+            e.g. as created by the encode_batch function.
+
+        Returns
+        -------
+        sequences: [str]
+            The sequences that are represented by the one-hot array.
+        """
+        raw = self._decode_codes(self.lookup_rev[np.argmax(one_hot, axis=2)])
+        length = one_hot.shape[1]
+        return [raw[i:(i+length)] for i in range(0, len(raw), length)] if length > 0 \
+               else [""] * one_hot.shape[0]
+
+    def encode_indices(self, sequences):
+        """ Encode a list of sequences into an array of alphabet indices.
+
+        This is the compact equivalent of encode_batch: the one-hot array is given by
+        comparing each index against range(len(alphabet)).
+
+        Parameters
+        ----------
+        sequences : [str]
+            The sequences that should be encoded (all of the same length).
+
+        Returns
+        -------
+        indices: numpy.ndarray
+            A uint8 (uint16 for alphabets with 255 or more symbols) array with shape
+            (len(sequences), length of sequences).
+        """
+        if len(sequences) == 0:
+            return np.zeros((0, 0), dtype=self.dtype)
+        length = len(sequences[0])
+        for sequence in sequences:
+            if len(sequence) != length:
+                raise RuntimeError('All sequences must have the same length.')
+        if not isinstance(sequences[0], str):
+            raw = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+        elif self.ascii:
+            raw = np.frombuffer("".join(sequences).encode(), dtype=np.uint8)
+        else:
+            raw = np.frombuffer("".join(sequences).encode("utf-32-le"), dtype=np.uint32)
+        idx = self.lookup[np.minimum(raw, len(self.lookup) - 1)]
+        if len(raw) != len(sequences) * length or (idx == self.invalid).any():
+            raise ValueError("Sequences contain characters that are not part of the alphabet '{}'.".format(
+                self.alphabet
+            ))
+        return idx.reshape(len(sequences), length)
+
+    def _decode_codes(self, codes):
+        if self.ascii:
+            return codes.astype(np.uint8).tobytes().decode()
+        return codes.astype("<u4").tobytes().decode("utf-32-le")
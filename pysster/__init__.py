@@ -1,5 +1,7 @@
 from .Model import *
 from .Data import *
+from .Data_Sequence import *
+from .Genome import *
 from .Grid_Search import *
 from .utils import *
 from .Alphabet_Encoder import *
@@ -2,11 +2,17 @@ import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import gzip
+import io
 import os
+import json
+import re
 import pickle
+import struct
+import zlib
 import keras.models
-from itertools import groupby, repeat
+from itertools import repeat, islice
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import check_output, call
 from os.path import dirname
 from sklearn.preprocessing import label_binarize, scale
@@ -16,7 +22,7 @@ import sklearn.metrics
 import forgi.graph.bulge_graph as cgb
 import numpy as np
 from shutil import which
-from collections import Counter
+from collections import Counter, deque
 from os import remove
 from PIL import Image
 from tempfile import gettempdir
@@ -70,50 +76,364 @@ def load_model(file_path):
     return model
 
 
-def save_data(data, file_path):
+def save_data(data, file_path, compress=True, n_threads=None):
     """ Save a pysster.Data object.
 
-    The object will be pickled to disk.
+    The object is written in a binary format: the arrays of the object are stored as raw blocks
+    (aligned to 64 bytes) and everything else is pickled separately. If compress is True the
+    arrays are compressed in blocks of 4 MB by multiple threads (zlib level 6). Compared to the
+    gzipped pickles of earlier versions saving is many times faster, loading takes about as long
+    and files are up to 20% larger (for storage 'one_hot', the compact storages compress about
+    as well as before). Uncompressed files are an order of magnitude larger but are saved and
+    loaded almost at disk speed. Files written by earlier versions (gzipped pickles) can still
+    be loaded by load_data().
+    For large data sets also have a look at Data.save_mmap(), which saves the data in a
+    format that can be opened without loading everything into memory.
 
     Parameters
     ----------
     file_path : str
         A file name.
-    """
-    with gzip.open(file_path, "wb") as handle:
-        pickle.dump(data, handle, pickle.HIGHEST_PROTOCOL)
 
+    compress : bool
+        Compress the arrays (default: True)?
 
-def load_data(file_path):
+    n_threads : int
+        Number of threads used for the compression (default: number of CPUs).
+    """
+    if pickle.HIGHEST_PROTOCOL < 5:
+        # python < 3.8, arrays can't be pickled out-of-band
+        with gzip.open(file_path, "wb") as handle:
+            pickle.dump(data, handle, pickle.HIGHEST_PROTOCOL)
+        return
+    buffers = []
+    meta = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+    raw = [memoryview(meta)] + [buffer.raw() for buffer in buffers]
+    trailer = {"version": _DATA_VERSION, "compress": compress, "buffers": []}
+    n_threads = n_threads or os.cpu_count()
+    with open(file_path, "wb") as handle, ThreadPoolExecutor(n_threads) as pool:
+        handle.write(_DATA_MAGIC + bytes(8))
+        for buffer in raw:
+            trailer["buffers"].append(_write_buffer(handle, buffer, compress, pool, 4*n_threads))
+        position = handle.tell()
+        handle.write(json.dumps(trailer).encode())
+        handle.seek(len(_DATA_MAGIC))
+        handle.write(struct.pack("<Q", position))
+
+
+def load_data(file_path, n_threads=None):
     """ Load a pysster.Data object.
 
     Parameters
     ----------
     file_path : str
-        A file containing a pickled pysster.Data object.
+        A file created by save_data().
+
+    n_threads : int
+        Number of threads used for the decompression (default: number of CPUs).
     
     Returns
     -------
     data : pysster.Data
         The Data object loaded from file.
     """
-    with gzip.open(file_path, "rb") as handle:
-        return pickle.load(handle)
-
-
-def get_handle(file_name, mode):
+    with open(file_path, "rb") as handle:
+        magic = handle.read(len(_DATA_MAGIC))
+        if magic[:2] == b"\x1f\x8b":
+            # gzipped pickle written by earlier versions
+            handle.seek(0)
+            with gzip.open(handle, "rb") as gz_handle:
+                return pickle.load(gz_handle)
+        if magic != _DATA_MAGIC:
+            raise RuntimeError("Unsupported file format.")
+        handle.seek(struct.unpack("<Q", handle.read(8))[0])
+        trailer = json.loads(handle.read().decode())
+        if trailer["version"] > _DATA_VERSION:
+            raise RuntimeError("Unsupported file format version.")
+        with ThreadPoolExecutor(n_threads or os.cpu_count()) as pool:
+            buffers = [_read_buffer(handle, entry, pool) for entry in trailer["buffers"]]
+    return pickle.loads(buffers[0], buffers=buffers[1:])
+
+
+# binary format of save_data(): magic bytes, the position of a JSON trailer (uint64), the
+# pickled object without its arrays and the (compressed) arrays, followed by the trailer
+_DATA_MAGIC = b"PYSSTER\x00"
+_DATA_VERSION = 1
+_DATA_ALIGNMENT = 64
+_DATA_BLOCK_SIZE = 1 << 22
+_DATA_LEVEL = 6
+
+
+def _write_buffer(handle, buffer, compress, pool, window):
+    buffer = buffer.cast("B")
+    handle.write(bytes(-handle.tell() % _DATA_ALIGNMENT))
+    entry = {"offset": handle.tell(), "size": buffer.nbytes}
+    if not compress:
+        handle.write(buffer)
+        return entry
+    entry["blocks"] = []
+    blocks = (buffer[x:(x+_DATA_BLOCK_SIZE)] for x in range(0, buffer.nbytes, _DATA_BLOCK_SIZE))
+    # compress only a few blocks per thread at a time to bound the memory usage
+    while True:
+        compressed = list(pool.map(lambda block: zlib.compress(block, _DATA_LEVEL), islice(blocks, window)))
+        if not compressed:
+            return entry
+        for block in compressed:
+            handle.write(block)
+            entry["blocks"].append(len(block))
+
+
+def _read_buffer(handle, entry, pool):
+    out = np.empty(entry["size"], dtype=np.uint8)
+    handle.seek(entry["offset"])
+    if "blocks" not in entry:
+        handle.readinto(memoryview(out))
+        return out
+    compressed = memoryview(handle.read(sum(entry["blocks"])))
+    starts = np.cumsum([0] + entry["blocks"])
+    def decompress(i):
+        block = zlib.decompress(compressed[starts[i]:starts[i+1]])
+        out[(i*_DATA_BLOCK_SIZE):(i*_DATA_BLOCK_SIZE+len(block))] = np.frombuffer(block, dtype=np.uint8)
+    list(pool.map(decompress, range(len(entry["blocks"]))))
+    return out
+
+
+def get_handle(file_name, mode, n_threads=None):
+    # BGZF files (blocked gzip, e.g. created by bgzip) are decompressed by a thread pool
+    # when reading, all other gzipped files are read (and all files are written) as before
     if file_name[-2:] == "gz":
+        if mode[0] == "r" and _is_bgzf(file_name):
+            handle = io.BufferedReader(_BGZF_Reader(file_name, n_threads or os.cpu_count()), 1 << 16)
+            return io.TextIOWrapper(handle) if "t" in mode else handle
         return gzip.open(file_name, mode)
     return open(file_name, mode)
 
 
+def _is_bgzf(file_name):
+    # a gzip member with an extra field that contains the "BC" subfield of the block size
+    with open(file_name, "rb") as handle:
+        header = handle.read(18)
+    return (len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and
+            header[12:16] == b"BC\x02\x00")
+
+
+# number of BGZF blocks (at most 64 KB each) that are decompressed by a single task
+_BGZF_BLOCKS_PER_TASK = 64
+
+
+class _BGZF_Reader(io.RawIOBase):
+    # the compressed blocks are located using the block sizes of their headers (no index
+    # file is needed) and decompressed in order by a thread pool (zlib releases the GIL),
+    # a few tasks per thread are kept in flight ahead of the reader
+
+    def __init__(self, file_name, n_threads):
+        self.handle = open(file_name, "rb")
+        self.pool = ThreadPoolExecutor(n_threads)
+        self.pending = deque()
+        self.window = 4 * n_threads
+        self.block = memoryview(b"")
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.block) == 0:
+            self._submit()
+            if not self.pending:
+                return 0
+            self.block = memoryview(self.pending.popleft().result())
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            for future in self.pending:
+                future.cancel()
+            self.pool.shutdown()
+            self.handle.close()
+        super().close()
+
+    def _submit(self):
+        while not self.eof and len(self.pending) < self.window:
+            blocks = list(islice(iter(self._read_block, None), _BGZF_BLOCKS_PER_TASK))
+            self.eof = len(blocks) < _BGZF_BLOCKS_PER_TASK
+            if blocks:
+                self.pending.append(self.pool.submit(_inflate_blocks, blocks))
+
+    def _read_block(self):
+        header = self.handle.read(12)
+        if len(header) == 0:
+            return None
+        if len(header) < 12 or header[:4] != b"\x1f\x8b\x08\x04":
+            raise OSError("Not a valid BGZF block (the file may be truncated).")
+        extra = self.handle.read(struct.unpack("<H", header[10:12])[0])
+        block_size, x = None, 0
+        while x + 4 <= len(extra):
+            length = struct.unpack("<H", extra[x+2:x+4])[0]
+            if extra[x:x+2] == b"BC" and length == 2:
+                block_size = struct.unpack("<H", extra[x+4:x+6])[0] + 1
+            x += 4 + length
+        if block_size is None:
+            raise OSError("Not a valid BGZF block (the block size is missing).")
+        return self.handle.read(block_size - 12 - len(extra))
+
+
+def _inflate_blocks(blocks):
+    # block: deflate data followed by the CRC32 and the size of the uncompressed data
+    out = []
+    for block in blocks:
+        data = zlib.decompress(block[:-8], -15)
+        crc, size = struct.unpack("<II", block[-8:])
+        if len(data) != size or zlib.crc32(data) != crc:
+            raise OSError("CRC check failed for a BGZF block.")
+        out.append(data)
+    return b"".join(out)
+
+
 def parse_fasta(handle, joiner = ""):
-    delimiter = lambda line: line.startswith('>')
-    for is_header, block in groupby(handle, delimiter):
-        if is_header:
-            header = next(block)[1:].rstrip()
+    # str version of parse_fasta_bytes(): the blocks are stripped of trailing whitespace and
+    # decoded as a whole (see _text_blocks), i.e. the lines of an entry are joined by a single
+    # replace (the offsets of the records refer to the stripped blocks and are not used)
+    pending = None
+    for _, record in _fasta_records(_text_blocks(handle, 1 << 22), "\n"):
+        header, newline, block = record.partition("\n")
+        if pending is None:
+            pending = header
+        if newline:
+            yield (pending, block.replace("\n", joiner))
+            pending = None
+
+
+_WHITESPACE = (b" ", b"\t", b"\r", b"\x0b", b"\x0c")
+_IS_WHITESPACE = np.zeros(256, dtype=bool)
+_IS_WHITESPACE[[x[0] for x in _WHITESPACE]] = True
+_TRAILING_WHITESPACE = re.compile(rb"[ \t\r\x0b\x0c]+$", re.MULTILINE)
+
+
+def parse_fasta_bytes(handle, joiner = b"", as_array = False, block_size = 1 << 22, offsets = False):
+    """ Parse a fasta file block-wise on the byte level.
+
+    The file is read in large binary blocks that are split into entries using bytes.split,
+    i.e. long entries are joined without creating per-line objects (unless they contain whitespace).
+    Lines of an entry are joined by the joiner (e.g. b"_" for sequence/structure entries).
+    For consecutive header lines only the first header is kept.
+
+    Parameters
+    ----------
+    handle : file object
+        A file handle opened in binary mode (text handles work, too, but are slower).
+
+    joiner : bytes
+        Separator that is put between the lines of an entry. (default: b"")
+
+    as_array : bool
+        Yield the entries as numpy uint8 arrays (e.g. for lookup table encoding) instead of bytes.
+
+    block_size : int
+        Number of bytes that are read at once.
+
+    offsets : bool
+        Yield (offset, header, entry) tuples, offset being the position of the entry in the (uncompressed) file.
+
+    Returns
+    -------
+    entries : generator
+        A generator yielding (header, entry) tuples, the header is a bytes object.
+    """
+    pending = None
+    for offset, record in _fasta_records(_read_blocks(handle, block_size)):
+        end = record.find(b"\n")
+        if pending is None:
+            pending = record[:end].rstrip() if end != -1 else record.rstrip()
+            pending_offset = offset
+        if end == -1:
+            # header without any lines, the next header belongs to the same entry
+            continue
+        if len(record) - end > 1024 and not any(x in record for x in _WHITESPACE):
+            # long entries without trailing whitespace, no need to split the lines
+            block = record[(end+1):].replace(b"\n", joiner)
+        else:
+            block = joiner.join([line.rstrip() for line in record[(end+1):].split(b"\n")])
+        if as_array:
+            block = np.frombuffer(block, dtype=np.uint8)
+        yield (pending_offset, pending, block) if offsets else (pending, block)
+        pending = None
+
+
+def _read_blocks(handle, block_size):
+    # the content of a file as blocks of bytes (text handles are encoded)
+    while True:
+        block = handle.read(block_size)
+        if len(block) == 0:
+            return
+        yield block.encode() if isinstance(block, str) else block
+
+
+def _text_blocks(handle, block_size):
+    # the content of a file as decoded blocks of complete lines without trailing whitespace,
+    # the incomplete last line of a block is carried over to the next block (the last line of
+    # the file is completed by a newline, which is then removed like the final newline of a file)
+    carry = []
+    for block in _read_blocks(handle, block_size):
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            carry.append(block)
+            continue
+        carry.append(block[:end])
+        yield _strip_lines(b"".join(carry))
+        carry = [block[end:]]
+    carry = b"".join(carry)
+    if len(carry) > 0:
+        yield _strip_lines(carry + b"\n")
+
+
+def _strip_lines(block):
+    # remove trailing whitespace from the (complete) lines of a block, the characters in front
+    # of the newlines are looked up at once and the (slow) regular expression is only used if needed
+    if b"\r" in block:
+        block = block.replace(b"\r\n", b"\n")
+    values = np.frombuffer(block, dtype=np.uint8)
+    ends = np.flatnonzero(values == ord("\n")) - 1
+    if _IS_WHITESPACE[values[ends[ends >= 0]]].any():
+        block = _TRAILING_WHITESPACE.sub(b"", block)
+    return block.decode()
+
+
+def _fasta_records(blocks, newline = b"\n"):
+    # yield the offset and the raw content (bytes or str, like the blocks and the newline) of
+    # every fasta entry without the leading '>' and the final newline (all lines from a header
+    # line up to the next header line); entries spanning several blocks are assembled from pieces
+    # to avoid quadratic copying, anything before the first header is ignored. A trailing newline
+    # is carried over to the next block, such that entry boundaries ("\n>") are never split
+    # between two blocks.
+    separator = newline + (b">" if isinstance(newline, bytes) else ">")
+    pieces, start, is_record, carry = [], 0, False, newline
+    position = -1 # offset of the current block, the initial newline is virtual
+    for block in blocks:
+        if len(block) == 0:
+            continue
+        block, carry = carry + block, newline[:0]
+        if block[-1:] == newline:
+            block, carry = block[:-1], newline
+        records = block.split(separator)
+        if len(records) > 1:
+            pieces.append(records[0])
+            if is_record:
+                yield start, newline[:0].join(pieces)
+            is_record = True
+            offset = position + len(records[0]) + 1
+            for i in range(1, len(records)-1):
+                yield offset, records[i]
+                offset += len(records[i]) + 2
+            start, pieces = offset, [records[-1]]
         else:
-            yield(header, joiner.join(line.rstrip() for line in block))
+            pieces.append(block)
+        position += len(block)
+    if is_record:
+        yield start, newline[:0].join(pieces)
 
 
 
@@ -142,7 +462,7 @@ def annotate_structures(input_file, output_file):
     output_file : str
         A fasta file with secondary structure annotations.
     """
-    handle_in = get_handle(input_file, "rt")
+    handle_in = get_handle(input_file, "rb")
     handle_out = get_handle(output_file, "wt")
     for header, entry in parse_fasta(handle_in, "_"):
         entry = entry.split("_")
@@ -201,7 +521,7 @@ def predict_structures(input_file, output_file, num_processes=None, annotate=Fal
         if which("RNAfold") == None:
             raise RuntimeError("Error: Neither RNAlib python bindings nor RNAfold executable found.")
         predictor = _predict_binary
-    handle = get_handle(input_file, "rt")
+    handle = get_handle(input_file, "rb")
     if num_processes == None:
         num_processes = max(1, int(os.cpu_count()/2))
     with Pool(num_processes) as pool:
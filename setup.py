@@ -9,7 +9,7 @@ setup(
     author_email = 'budach@molgen.mpg.de',
     license = 'MIT',
     install_requires =  [
-        'numpy>=1.14.0',
+        'numpy>=1.17.0',
         'matplotlib',
         'seaborn',
         'scikit-learn',
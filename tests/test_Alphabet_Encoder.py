@@ -1,7 +1,9 @@
 import unittest
+import numpy as np
 
 
 from pysster.Alphabet_Encoder import Alphabet_Encoder
+from pysster.One_Hot_Encoder import One_Hot_Encoder
 
 
 class Test_Alphabet_Encoder(unittest.TestCase):
@@ -32,4 +34,27 @@ class Test_Alphabet_Encoder(unittest.TestCase):
 
     def test_alphabet_encoder_decode(self):
         self.assertTrue(self.dot.decode(self.decoded_dot) == self.ref_dot)
-        self.assertTrue(self.ann.decode(self.decoded_ann) == self.ref_ann)
\ No newline at end of file
+        self.assertTrue(self.ann.decode(self.decoded_ann) == self.ref_ann)
+
+
+    def test_alphabet_encoder_indices(self):
+        for coder, ref in [(self.dot, self.ref_dot), (self.ann, self.ref_ann)]:
+            indices = coder.encode_indices(ref)
+            self.assertTrue(indices.dtype == np.uint8)
+            expected = One_Hot_Encoder(coder.alphabet).encode_indices([coder.encode(ref)])[0]
+            self.assertTrue(np.array_equal(indices, expected))
+            self.assertTrue(coder.decode_indices(indices) == ref)
+            raw = np.frombuffer((ref[0]*2).encode(), dtype=np.uint8).reshape(2, -1)
+            raw_struct = np.frombuffer((ref[1]*2).encode(), dtype=np.uint8).reshape(2, -1)
+            self.assertTrue(np.array_equal(coder.encode_indices((raw, raw_struct)), np.array([indices, indices])))
+        with self.assertRaises(ValueError):
+            self.dot.encode_indices(('ACGN', '(..)'))
+        with self.assertRaises(RuntimeError):
+            self.dot.encode_indices(('ACG', '(..)'))
+        protein = Alphabet_Encoder('ACDEFGHIKLMNPQRSTVWY', 'HEC.')
+        ref = ('WYACDE', 'HEC..H')
+        self.assertTrue(protein.decode_indices(protein.encode_indices(ref)) == ref)
+        large = Alphabet_Encoder('ACDEFGHIKLMNPQRSTVWY', '().[]{}<>,|*AB')
+        indices = large.encode_indices(('WY', 'AB'))
+        self.assertTrue(indices.dtype == np.uint16 and list(indices) == [264, 279])
+        self.assertTrue(large.decode_indices(indices) == ('WY', 'AB'))
\ No newline at end of file
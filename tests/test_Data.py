@@ -1,16 +1,43 @@
 import unittest
+import gzip
+import importlib
+import json
+import os
+import pickle
 import numpy as np
-from os.path import dirname
+from os.path import dirname, basename
+from tempfile import mkdtemp
+from shutil import rmtree, copyfileobj
 
 
 from pysster.Data import Data
 from pysster.Model import Model
+from pysster.Data_Sequence import Data_Sequence
+from pysster import utils
 
 
 def isclose(a, b, rel_tol=1e-09, abs_tol=0.0):
     return abs(a-b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
 
 
+def encode_pwm_loop(file_name, alph0, alph1):
+    # the former per-position implementation of the structure PWM encoding
+    encoded = []
+    with open(file_name, "rt") as handle:
+        for header, block in utils.parse_fasta(handle, "_"):
+            lines = block.split("_")
+            sequence = lines[0]
+            pwm = np.zeros((len(sequence), len(alph1)), dtype=np.float32)
+            for x in range(1, pwm.shape[1]+1):
+                pwm[:, x-1] = list(map(float, lines[x].split()))
+            joined = np.zeros((len(sequence), len(alph0)*len(alph1)), np.float32)
+            for i, symbol in enumerate(sequence):
+                pos = alph0.find(symbol) * len(alph1)
+                joined[i, pos:(pos+len(alph1))] = pwm[i,:]
+            encoded.append(joined)
+    return np.array(encoded)
+
+
 class Test_Data(unittest.TestCase):
 
 
@@ -43,6 +70,62 @@ class Test_Data(unittest.TestCase):
             self.assertTrue((self.data_dna.labels[x] == [0,1]).all())
 
 
+    def test_data_contiguous_storage(self):
+        self.assertTrue(isinstance(self.data_dna.data, np.ndarray))
+        self.assertTrue(self.data_dna.data.shape == (100, 32, 4))
+        self.assertTrue(self.data_dna.labels.shape == (100, 2))
+        self.assertTrue(self.data_pwm.data.dtype == np.float32)
+        gen = self.data_dna._data_generator("train", 32, False)
+        x, y = next(gen)
+        idx = self.data_dna.splits["train"][:32]
+        self.assertTrue(np.array_equal(x, np.array([self.data_dna.data[i] for i in idx])))
+        self.assertTrue(np.array_equal(y, np.array([self.data_dna.labels[i] for i in idx])))
+
+
+    def test_data_compact_storage(self):
+        folder = dirname(__file__)
+        dna_files = [folder + "/data/dna_pos.fasta", folder + "/data/dna_neg.fasta"]
+        for storage in ["index", "packed"]:
+            data = Data(dna_files, "ACGT", storage=storage)
+            self.assertTrue(data.storage == storage)
+            self.assertTrue(data.tokens.dtype == np.uint8)
+            self.assertTrue(data.tokens.shape == [(100, 32), (100, 8)][storage == "packed"])
+            self.assertTrue(data._shape() == (32, 4))
+            self.assertTrue(len(data.data) == 100)
+            self.assertTrue(data.data.shape == (100, 32, 4))
+            self.assertTrue(np.array_equal(data.data[0], self.data_dna.data[0]))
+            self.assertTrue(np.array_equal(data.data[:], self.data_dna.data))
+            self.assertTrue(np.array_equal(data.get_labels("all"), self.data_dna.get_labels("all")))
+            data.splits = self.data_dna.splits
+            x1, y1 = next(data._data_generator("train", 16, False))
+            x2, y2 = next(self.data_dna._data_generator("train", 16, False))
+            self.assertTrue(np.array_equal(x1, x2))
+            self.assertTrue(np.array_equal(y1, y2))
+            self.assertTrue(data._get_sequences(1, "all") == self.data_dna._get_sequences(1, "all"))
+        data = Data(folder + "/data/rna.fasta", ("ACGU", "()."), storage="index")
+        self.assertTrue(data.tokens.shape == (20, 40))
+        self.assertTrue(np.array_equal(data.data[:], self.data_rna_dot.data))
+        with self.assertRaises(ValueError):
+            Data(folder + "/data/rna.fasta", ("ACGU", "()."), storage="packed")
+        rna_pwm = [folder + '/data/rna_pwm1.fasta', folder + '/data/rna_pwm2.fasta']
+        out = mkdtemp()
+        for storage, dtype in [("index", np.float32), ("packed", np.float16)]:
+            data = Data(rna_pwm, ('ACGU', '().'), structure_pwm=True, storage=storage)
+            self.assertTrue(data.profiles.dtype == dtype)
+            self.assertTrue(data.profiles.shape == (32, 10, 3))
+            self.assertTrue(data.data.shape == self.data_pwm.data.shape)
+            self.assertTrue(data.data.dtype == np.float32)
+            self.assertTrue(np.allclose(data.data[:], self.data_pwm.data, atol=1e-3))
+            self.assertTrue(np.array_equal(data.data[:] > 0, self.data_pwm.data > 0))
+            if storage == "index":
+                self.assertTrue(np.array_equal(data.data[:], self.data_pwm.data))
+            data.save_mmap(out)
+            self.assertTrue(np.array_equal(Data.open_mmap(out).data[:], data.data[:]))
+            parallel = Data(rna_pwm, ('ACGU', '().'), structure_pwm=True, storage=storage, n_jobs=2)
+            self.assertTrue(np.array_equal(parallel.data[:], data.data[:]))
+        rmtree(out)
+
+
     def test_data_init_rna(self):
         self.assertFalse(self.data_rna_dot.is_rna_pwm)
         self.assertTrue(len(self.data_rna_dot.data) == 20)
@@ -188,13 +271,13 @@ class Test_Data(unittest.TestCase):
         self.assertTrue(len(self.data_pwm.meta) == 2)
         self.assertTrue(self.data_pwm.meta[0]['is_categorical'] == False)
         self.assertTrue(self.data_pwm.meta[1]['is_categorical'] == True)
-        self.assertTrue(self.data_pwm.meta[0]['data'] == [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,16,15,14,13,12,11,10,9,8,7,6,5,4,3,2,1])
+        self.assertTrue(np.array_equal(self.data_pwm.meta[0]['data'], [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,16,15,14,13,12,11,10,9,8,7,6,5,4,3,2,1]))
         self.assertTrue(len(self.data_pwm.meta[1]['data']) == 32)
         for x in self.data_pwm.meta[1]['data']:
             self.assertTrue(sum(x) == 1)
         self.assertTrue((self.data_pwm.meta[1]['data'][0] == self.data_pwm.meta[1]['data'][31]).all())
         self.assertTrue((self.data_pwm.meta[1]['data'][13] == self.data_pwm.meta[1]['data'][18]).all())
-        addi = self.data_pwm._get_additional_data([0,1,15,16], 0, 4)
+        addi = self.data_pwm._get_additional_data([0,1,15,16])
         self.assertTrue(len(addi) == 4)
         self.assertTrue(np.allclose(addi[0], [1,*self.data_pwm.meta[1]['data'][0]]))
         self.assertTrue(np.allclose(addi[1], [2,*self.data_pwm.meta[1]['data'][1]]))
@@ -203,4 +286,539 @@ class Test_Data(unittest.TestCase):
         mod = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2, "epochs":2}, self.data_pwm)
         mod.train(self.data_pwm, verbose=True)
         predictions = mod.predict(self.data_pwm, "all")
-        self.assertTrue(predictions.shape == (32,2))
\ No newline at end of file
+        self.assertTrue(predictions.shape == (32,2))
+
+
+    def test_data_additional_matrix(self):
+        additional = self.data_pwm.additional
+        n_categories = self.data_pwm.meta[1]['data'].shape[1]
+        self.assertTrue(additional.dtype == np.float32)
+        self.assertTrue(additional.shape == (32, 1 + n_categories))
+        self.assertTrue(np.shares_memory(self.data_pwm.meta[0]['data'], additional))
+        self.assertTrue(np.shares_memory(self.data_pwm.meta[1]['data'], additional))
+        self.assertTrue(np.array_equal(additional[:, 0], self.data_pwm.meta[0]['data']))
+        idx = self.data_pwm.splits["train"][:8]
+        (x, addi), y = next(self.data_pwm._data_generator("train", 8, False))
+        self.assertTrue(np.array_equal(addi, additional[idx]))
+        self.assertTrue(np.array_equal(x, self.data_pwm.data[idx]))
+        self.assertTrue(self.data_dna.additional.shape == (100, 0))
+        folder = mkdtemp()
+        self.data_pwm.save_mmap(folder)
+        data = Data.open_mmap(folder)
+        self.assertTrue(isinstance(data.additional, np.memmap))
+        self.assertTrue(np.array_equal(data.additional, additional))
+        for x in range(2):
+            self.assertTrue(np.array_equal(data.meta[x]['data'], self.data_pwm.meta[x]['data']))
+        rmtree(folder)
+
+
+    def test_data_embedding(self):
+        folder = dirname(__file__)
+        rna_pwm = [folder + '/data/rna_pwm1.fasta', folder + '/data/rna_pwm2.fasta']
+        rna_pwm_add = [folder + '/data/rna_pwm1_add.txt', folder + '/data/rna_pwm2_add.txt']
+        data = Data(rna_pwm, ('ACGU', '().'), structure_pwm=True)
+        data.load_additional_data(rna_pwm_add, is_categorical=False)
+        data.load_additional_data(rna_pwm_add, is_categorical=True, embedding=True)
+        data.load_additional_data(rna_pwm_add, is_categorical=True, buckets=4)
+        self.assertTrue(data.additional.shape == (32, 1))
+        self.assertTrue(data.codes.shape == (32, 2))
+        self.assertTrue(data.codes.dtype == np.int32)
+        self.assertTrue(data._embedding_sizes() == [16, 4])
+        self.assertTrue(np.shares_memory(data.meta[1]['data'], data.codes))
+        categories = data.meta[0]['data'].astype(int).astype(str)
+        self.assertTrue(np.array_equal(data.meta[1]['data'], np.unique(categories, return_inverse=True)[1]))
+        self.assertTrue(data.meta[2]['data'].max() < 4)
+        (x, addi, codes), y = next(data._data_generator("all", 32, False))
+        self.assertTrue(np.array_equal(codes[:, 0], data.codes[:, 0]))
+        self.assertTrue(np.array_equal(codes[:, 1], data.codes[:, 1] + 16))
+        with self.assertRaises(ValueError):
+            data.load_additional_data(rna_pwm_add, is_categorical=False, embedding=True)
+        out = mkdtemp()
+        data.save_mmap(out)
+        reopened = Data.open_mmap(out)
+        self.assertTrue(np.array_equal(reopened.codes, data.codes))
+        self.assertTrue(reopened._embedding_sizes() == [16, 4])
+        self.assertTrue(np.array_equal(reopened.meta[0]['data'], data.meta[0]['data']))
+        rmtree(out)
+        mod = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2, "epochs":1}, data)
+        self.assertTrue(len(mod.inputs) == 3)
+        self.assertTrue(mod.params["embedding_input_dim"] == 20)
+        mod.train(data, verbose=False)
+
+
+    def test_data_cache(self):
+        folder = dirname(__file__)
+        dna = [folder + '/data/dna_pos.fasta', folder + '/data/dna_neg.fasta']
+        cache = mkdtemp()
+        data = Data(dna, 'ACGT', cache=cache, seed=3)
+        self.assertTrue(len(os.listdir(cache)) == 1)
+        cached = Data(dna, 'ACGT', cache=cache, seed=3)
+        self.assertTrue(isinstance(cached.data, np.memmap))
+        self.assertTrue(np.array_equal(cached.data, data.data))
+        self.assertTrue(np.array_equal(cached.labels, data.labels))
+        self.assertTrue(len(cached.splits["train"]) == len(data.splits["train"]))
+        self.assertTrue(len(os.listdir(cache)) == 1)
+        Data(dna, 'ACGT', storage="index", cache=cache, seed=3)
+        Data(dna[:1], 'ACGT', cache=cache, seed=3)
+        self.assertTrue(len(os.listdir(cache)) == 3)
+        # the least recently used entries are evicted first
+        packed = mkdtemp()
+        Data(dna, 'ACGT', storage="packed", cache=packed, seed=3)
+        entry = os.path.join(packed, os.listdir(packed)[0])
+        size = sum(os.path.getsize(os.path.join(entry, x)) for x in os.listdir(entry))
+        Data(dna, 'ACGT', storage="packed", cache=cache, seed=3, cache_size=size)
+        self.assertTrue(os.listdir(cache) == os.listdir(packed))
+        Data(dna, 'ACGT', cache=cache, seed=3, cache_size=0)
+        self.assertTrue(len(os.listdir(cache)) == 0)
+        with self.assertRaises(ValueError):
+            Data(dna, 'ACGT', cache=cache, folder=cache)
+        rmtree(cache)
+        rmtree(packed)
+
+
+    def test_data_save_open_mmap(self):
+        folder = mkdtemp()
+        data_packed = Data([dirname(__file__) + "/data/dna_pos.fasta"], "ACGT", storage="packed")
+        for obj in [self.data_dna, self.data_rna_dot, self.data_pwm, data_packed]:
+            obj.save_mmap(folder)
+            data = Data.open_mmap(folder)
+            self.assertTrue(data.storage == obj.storage)
+            stored = data.data if obj.storage == "one_hot" else data.tokens
+            self.assertTrue(isinstance(stored, np.memmap))
+            self.assertTrue(np.array_equal(data.data[:], obj.data[:]))
+            self.assertTrue(np.array_equal(data.labels, obj.labels))
+            for group in ["train", "val", "test"]:
+                self.assertTrue(np.array_equal(data.splits[group], obj.splits[group]))
+            self.assertTrue(data.is_rna == obj.is_rna)
+            self.assertTrue(data.is_rna_pwm == obj.is_rna_pwm)
+            self.assertTrue(data.multilabel == obj.multilabel)
+            self.assertTrue(data.one_hot_encoder.alphabet == obj.one_hot_encoder.alphabet)
+            self.assertTrue(data._shape() == obj._shape())
+            self.assertTrue(data.get_summary() == obj.get_summary())
+            self.assertTrue(len(data.meta) == len(obj.meta))
+            x1, y1 = next(data._data_generator("train", 8, True, seed=3))
+            x2, y2 = next(obj._data_generator("train", 8, True, seed=3))
+            if len(obj.meta) > 0:
+                for a, b in zip(x1, x2):
+                    self.assertTrue(np.allclose(a, b))
+            else:
+                self.assertTrue(np.array_equal(x1, x2))
+            self.assertTrue(np.array_equal(y1, y2))
+        # folders of other layout versions are rejected
+        with open(folder + "/header.json", "rt") as handle:
+            header = json.load(handle)
+        header["version"] = 2
+        with open(folder + "/header.json", "wt") as handle:
+            json.dump(header, handle)
+        with self.assertRaises(RuntimeError):
+            Data.open_mmap(folder)
+        rmtree(folder)
+
+
+    def test_data_streaming(self):
+        folder = dirname(__file__)
+        dna_files = [folder + "/data/dna_pos.fasta", folder + "/data/dna_neg.fasta"]
+        out = mkdtemp()
+        for chunk_size in [1, 7, 1000]:
+            data = Data(dna_files, "ACGT", storage="index", folder=out, chunk_size=chunk_size)
+            self.assertTrue(isinstance(data.tokens, np.memmap))
+            self.assertTrue(isinstance(data.labels, np.memmap))
+            self.assertTrue(np.array_equal(data.data[:], self.data_dna.data))
+            self.assertTrue(np.array_equal(data.labels, self.data_dna.labels))
+            self.assertTrue(len(data.splits["train"]) == 70)
+            self.assertTrue(len(data.splits["val"]) == 15)
+            self.assertTrue(len(data.splits["test"]) == 15)
+            self.assertTrue(sorted(np.concatenate([data.splits["train"], data.splits["val"],
+                                                   data.splits["test"]])) == list(range(100)))
+            reopened = Data.open_mmap(out)
+            self.assertTrue(np.array_equal(reopened.data[:], self.data_dna.data))
+            self.assertTrue(reopened.get_summary() == data.get_summary())
+        data = Data(folder + "/data/rna.fasta", ("ACGU", "()."), folder=out, chunk_size=3)
+        self.assertTrue(np.array_equal(data.data, self.data_rna_dot.data))
+        self.assertTrue(np.array_equal(data.labels, self.data_rna_dot.labels))
+        rmtree(out)
+
+
+    def test_data_parallel(self):
+        folder = dirname(__file__)
+        module = importlib.import_module("pysster.Data")
+        shard_size = module._SHARD_SIZE
+        module._SHARD_SIZE = 300
+        out = mkdtemp()
+        try:
+            dna_files = [folder + "/data/dna_pos.fasta", folder + "/data/dna_neg.fasta"]
+            gz_files = []
+            for file_name in dna_files:
+                gz_files.append(out + "/" + basename(file_name) + ".gz")
+                with open(file_name, "rb") as handle_in, gzip.open(gz_files[-1], "wb") as handle_out:
+                    copyfileobj(handle_in, handle_out)
+            for files in [dna_files, gz_files]:
+                data = Data(files, "ACGT", n_jobs=2, chunk_size=7)
+                self.assertTrue(np.array_equal(data.data, self.data_dna.data))
+                self.assertTrue(np.array_equal(data.labels, self.data_dna.labels))
+            data = Data(dna_files, "ACGT", storage="packed", n_jobs=2)
+            self.assertTrue(np.array_equal(data.data[:], self.data_dna.data))
+            data = Data(folder + "/data/rna.fasta", ("ACGU", "()."), n_jobs=2)
+            self.assertTrue(np.array_equal(data.data, self.data_rna_dot.data))
+            self.assertTrue(np.array_equal(data.labels, self.data_rna_dot.labels))
+            rna_pwm = [folder + '/data/rna_pwm1.fasta', folder + '/data/rna_pwm2.fasta']
+            data = Data(rna_pwm, ('ACGU', '().'), structure_pwm=True, n_jobs=2)
+            self.assertTrue(np.allclose(data.data, self.data_pwm.data))
+            self.assertTrue(np.array_equal(data.labels, self.data_pwm.labels))
+            # the shared memory of queued results is released if a worker fails
+            with open(folder + "/data/rna.fasta", "rt") as handle:
+                records = handle.read()
+            with open(out + "/broken.fasta", "wt") as handle:
+                handle.write(">0\nACGU\n((.\n" + records * 5)
+            shm = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+            with self.assertRaises(RuntimeError):
+                Data(out + "/broken.fasta", ("ACGU", "()."), n_jobs=2)
+            if os.path.isdir("/dev/shm"):
+                self.assertTrue(set(os.listdir("/dev/shm")) <= shm)
+        finally:
+            module._SHARD_SIZE = shard_size
+            rmtree(out)
+
+
+    def test_data_variable_length(self):
+        folder = dirname(__file__)
+        out = mkdtemp()
+        rng = np.random.RandomState(42)
+        files = [out + "/short.fasta", out + "/long.fasta"]
+        for file_name, length, symbols in zip(files, [20, 35], ["ACGTNnacx", "ACGT"]):
+            with open(file_name, "wt") as handle:
+                for i in range(60):
+                    handle.write(">{}\n{}\n".format(i, "".join(rng.choice(list(symbols), length + i % 3))))
+        with self.assertRaises(ValueError):
+            Data(files, "ACGT", variable_length=True)
+        data = Data(files, "ACGT", storage="index", variable_length=True, seed=5, chunk_size=7)
+        self.assertTrue(len(data.data) == 120)
+        self.assertTrue(data.data.shape == (120, None, 4))
+        self.assertTrue(np.array_equal(data.lengths, [20 + i % 3 for i in range(60)] + [35 + i % 3 for i in range(60)]))
+        self.assertTrue(len(data.tokens) == data.offsets[-1] == data.lengths.sum())
+        self.assertTrue(data.data[0].shape == (20, 4) and data.data[61].shape == (36, 4))
+        # replaced characters don't depend on the other files
+        fixed = Data([files[0]], "ACGT", storage="index", variable_length=True, seed=5)
+        self.assertTrue(np.array_equal(fixed.tokens, data.tokens[:len(fixed.tokens)]))
+        # padded batches
+        padded = data.data[[0, 1, 2]]
+        self.assertTrue(padded.shape == (3, 22, 4))
+        self.assertTrue(np.array_equal(padded[0, :20], data.data[0]) and padded[0, 20:].sum() == 0)
+        self.assertTrue(data._get_sequences(0, "all")[1] == data.one_hot_encoder.decode(data.data[1]))
+        # batches contain sequences of similar length and are padded to the longest one
+        padding = 0
+        gen = data._data_generator("all", 10, True, seed=1)
+        for _ in range(12):
+            x, y = next(gen)
+            lengths = x.sum(axis=(1, 2))
+            self.assertTrue(x.shape[0] == 10 and x.shape[1] == lengths.max())
+            padding += (x.shape[1] - lengths).sum()
+        self.assertTrue(padding < 2 * len(data.lengths))
+        for other in [Data(files, "ACGT", storage="index", variable_length=True, seed=5, n_jobs=2),
+                      Data(files, "ACGT", storage="index", variable_length=True, seed=5, folder=out + "/mmap")]:
+            self.assertTrue(np.array_equal(other.tokens, data.tokens))
+            self.assertTrue(np.array_equal(other.offsets, data.offsets))
+        data.save_mmap(out + "/saved")
+        reopened = Data.open_mmap(out + "/saved")
+        self.assertTrue(np.array_equal(reopened.data[:], data.data[:]))
+        # structures and structure PWMs
+        for files, alphabet, pwm in [(folder + "/data/rna.fasta", ("ACGU", "()."), False),
+                                     ([folder + '/data/rna_pwm1.fasta', folder + '/data/rna_pwm2.fasta'], ("ACGU", "()."), True)]:
+            fixed = Data(files, alphabet, structure_pwm=pwm, storage="index", seed=5)
+            ragged = Data(files, alphabet, structure_pwm=pwm, storage="index", seed=5, variable_length=True)
+            self.assertTrue(np.allclose(ragged.data[:], fixed.data[:]))
+        mod = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2, "epochs":1}, data)
+        self.assertTrue(any(layer.name.startswith("global_max_pooling1d") for layer in mod.model.layers))
+        mod.train(data, verbose=False)
+        activations = mod.get_max_activations(data, "test")
+        with self.assertRaises(RuntimeError):
+            mod.visualize_kernel(activations, data, 0, out)
+        with self.assertRaises(RuntimeError):
+            mod.visualize_all_kernels(activations, data, out)
+        with self.assertRaises(RuntimeError):
+            mod.visualize_optimized_inputs(data, "dense_1", out + "/optimized.png")
+        rmtree(out)
+
+
+    def test_data_to_dataset(self):
+        folder = dirname(__file__)
+        rna_pwm = [folder + '/data/rna_pwm1.fasta', folder + '/data/rna_pwm2.fasta']
+        rna_pwm_add = [folder + '/data/rna_pwm1_add.txt', folder + '/data/rna_pwm2_add.txt']
+        cases = [Data(folder + "/data/rna.fasta", ("ACGU", "().")),
+                 Data([folder + "/data/dna_pos.fasta", folder + "/data/dna_neg.fasta"], "ACGT", storage="packed"),
+                 Data(rna_pwm, ("ACGU", "()."), structure_pwm=True, storage="index", variable_length=True)]
+        cases[2].load_additional_data(rna_pwm_add, is_categorical=False)
+        cases[2].load_additional_data(rna_pwm_add, is_categorical=True, embedding=True)
+        for data in cases:
+            batches = list(data.to_dataset("test", 3, shuffle=False))
+            gen = data._data_generator("test", 3, False)
+            for inputs, labels in batches:
+                ref_inputs, ref_labels = next(gen)
+                if not isinstance(ref_inputs, list):
+                    inputs, ref_inputs = [inputs], [ref_inputs]
+                self.assertTrue(all(np.allclose(x, y, atol=1e-3) for x, y in zip(inputs, ref_inputs)))
+                self.assertTrue(np.array_equal(labels, ref_labels))
+            shuffled = [labels.numpy() for _, labels in data.to_dataset("train", 4, seed=1)]
+            self.assertTrue(sum(len(x) for x in shuffled) == len(data.splits["train"]))
+        for data in cases[1:]:
+            # data without and with additional data (numerical and embedding codes)
+            model = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2, "epochs":1, "tf_data":True}, data)
+            model.train(data, verbose=False)
+            self.assertTrue(model.predict(data, "all").shape == (len(data.labels), 2))
+        # older tensorflow versions are rejected with a clear error
+        import tensorflow as tf
+        version, tf.__version__ = tf.__version__, "2.5.0"
+        try:
+            with self.assertRaises(RuntimeError):
+                cases[1].to_dataset("all", 3)
+        finally:
+            tf.__version__ = version
+
+
+    def test_data_subset(self):
+        folder = dirname(__file__)
+        data = Data(folder + "/data/rna.fasta", ("ACGU", "()."), storage="index")
+        n = len(data.labels)
+        view = data.subset(np.arange(0, n, 2))
+        self.assertTrue(view.tokens is data.tokens and view.labels is data.labels)
+        self.assertTrue(np.array_equal(view._get_idx("all"), np.arange(0, n, 2)))
+        self.assertTrue(np.array_equal(np.sort(np.concatenate(list(view.splits.values()))), np.arange(0, n, 2)))
+        self.assertTrue(len(data._get_idx("all")) == n)
+        kept = data.subset(np.arange(n) % 2 == 1, keep_splits=True)
+        for group in ["train", "val", "test"]:
+            self.assertTrue(np.array_equal(kept.splits[group], np.sort(data.splits[group][data.splits[group] % 2 == 1])))
+        nested = kept.subset([0, 0, 1])
+        self.assertTrue(np.array_equal(nested._get_idx("all"), [1, 1, 3]))
+        with self.assertRaises(ValueError):
+            data.subset([True, False])
+        # views of selected classes
+        classes = data.select_classes([2, 0])
+        selected = data.labels[:, [2, 0]].any(axis=1)
+        self.assertTrue(np.array_equal(classes._get_idx("all"), np.flatnonzero(selected)))
+        self.assertTrue(np.array_equal(classes.get_labels("all"), data.labels[selected][:, [2, 0]]))
+        self.assertTrue(np.array_equal(data.select_classes(1).get_labels("all"), data.labels[data.labels[:, 1] == 1][:, [1]]))
+        self.assertTrue(len(data.labels[0]) == 3)
+        # views can be used like other Data objects
+        self.assertTrue(len(classes.get_summary().split("\n")[0].split()) == 2)
+        batches = list(Data_Sequence(classes, "all", 4, shuffle=False))
+        self.assertTrue(sum(len(y) for _, y in batches) == selected.sum() and batches[0][1].shape[1] == 2)
+        out = mkdtemp()
+        classes.save_mmap(out)
+        reopened = Data.open_mmap(out)
+        self.assertTrue(np.array_equal(reopened._get_idx("all"), classes._get_idx("all")))
+        self.assertTrue(np.array_equal(reopened.get_labels("train"), classes.get_labels("train")))
+        rmtree(out)
+        model = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2, "epochs":1}, classes)
+        self.assertTrue(model.params["class_num"] == 2)
+        model.train(classes, verbose=False)
+
+
+    def test_data_append(self):
+        folder = dirname(__file__)
+        dna = [folder + "/data/dna_pos.fasta", folder + "/data/dna_neg.fasta"]
+        for storage in ["one_hot", "packed"]:
+            data = Data(dna[:1], "ACGT", storage=storage)
+            splits = {group: data.splits[group].copy() for group in data.splits}
+            data.append(dna[1:])
+            self.assertTrue(np.array_equal(data.data[:], self.data_dna.data[:]))
+            self.assertTrue(np.array_equal(data.labels, self.data_dna.labels))
+            for group in splits:
+                self.assertTrue(np.array_equal(data.splits[group][:len(splits[group])], splits[group]))
+            self.assertTrue([len(data.splits[x]) for x in ["train", "val", "test"]] == [70, 15, 15])
+            self.assertTrue(np.array_equal(np.sort(np.concatenate(list(data.splits.values()))), np.arange(100)))
+        data.append(dna[:1], classes=[1], n_jobs=2)
+        self.assertTrue(data.labels.shape == (140, 2) and data.labels[100:, 1].all())
+        self.assertTrue(np.array_equal(data.data[100:], data.data[:40]))
+        # the worker processes get what they need for the encoding, but not the stored entries
+        template = data._encoder_template()
+        self.assertFalse(any(hasattr(template, x) for x in ["tokens", "labels", "splits", "additional", "codes"]))
+        fresh = Data(dna[:1], "ACGT", storage="packed", seed=data._seed)
+        self.assertTrue(len(pickle.dumps(template)) == len(pickle.dumps(fresh._encoder_template())))
+        with self.assertRaises(ValueError):
+            data.append(dna[0])
+        with self.assertRaises(RuntimeError):
+            data.subset([0, 1]).append(dna[:1])
+        with self.assertRaises(RuntimeError):
+            data.append([folder + "/data/rna.fasta"])
+        multi = Data(folder + "/data/rna.fasta", ("ACGU", "()."))
+        n = len(multi.labels)
+        multi.append(folder + "/data/rna.fasta")
+        self.assertTrue(np.array_equal(multi.labels[n:], multi.labels[:n]))
+        self.assertTrue(np.array_equal(multi.data[n:], multi.data[:n]))
+
+
+    def test_data_from_records(self):
+        folder = dirname(__file__)
+        records, labels = [], []
+        for class_id, name in enumerate(["dna_pos", "dna_neg"]):
+            with open(folder + "/data/{}.fasta".format(name), "rt") as handle:
+                for _, sequence in utils.parse_fasta(handle):
+                    records.append(sequence)
+                    labels.append(class_id)
+        for storage in ["one_hot", "index", "packed"]:
+            data = Data.from_records(records, labels, "ACGT", storage=storage, chunk_size=30)
+            self.assertTrue(np.array_equal(data.data[:], self.data_dna.data[:]))
+            self.assertTrue(np.array_equal(data.labels, self.data_dna.labels))
+            self.assertTrue([len(data.splits[x]) for x in ["train", "val", "test"]] == [70, 15, 15])
+        ragged = Data.from_records(records[:3] + ["ACG"], [0, 1, 1, 0], "ACGT", storage="index", variable_length=True)
+        self.assertTrue(np.array_equal(ragged.lengths, [32, 32, 32, 3]))
+        with open(folder + "/data/rna.fasta", "rt") as handle:
+            rna = [(header, block.split("_")) for header, block in utils.parse_fasta(handle, "_")]
+        multi = Data.from_records([tuple(x) for _, x in rna], self.data_rna_dot.labels, ("ACGU", "()."))
+        self.assertTrue(multi.multilabel)
+        self.assertTrue(np.array_equal(multi.data[:], self.data_rna_dot.data[:]))
+        pwms = [encode_pwm_loop(folder + "/data/rna_pwm{}.fasta".format(x), "ACGU", "().") for x in [1, 2]]
+        records = []
+        for name in ["rna_pwm1", "rna_pwm2"]:
+            with open(folder + "/data/{}.fasta".format(name), "rt") as handle:
+                for _, block in utils.parse_fasta(handle, "_"):
+                    lines = block.split("_")
+                    records.append((lines[0], [list(map(float, x.split())) for x in lines[1:]]))
+        data = Data.from_records(records, np.argmax(self.data_pwm.labels, axis=1), ("ACGU", "()."), structure_pwm=True)
+        self.assertTrue(np.allclose(data.data[:], self.data_pwm.data[:]))
+        self.assertTrue(np.allclose(data.data[:], np.concatenate(pwms)))
+        with self.assertRaises(RuntimeError):
+            Data.from_records([(records[0][0], records[0][1][:2])], [0], ("ACGU", "()."), structure_pwm=True)
+        with self.assertRaises(ValueError):
+            Data.from_records(["ACGT", "ACGT"], [0], "ACGT")
+        # protein sequences with structures, the joined alphabet is not ASCII
+        protein = Data.from_records([("ACDEFGHIKLMNPQRSTVWY", "HEC.HEC.HEC.HEC.HEC."), ("YWVTSRQPNMLKIHGFEDCA", "....HHHHEEEECCCC....")],
+                                    [0, 1], ("ACDEFGHIKLMNPQRSTVWY", "HEC."))
+        self.assertTrue(protein.data[:].shape == (2, 20, 80))
+        self.assertTrue(protein.alpha_coder.decode(protein.one_hot_encoder.decode(protein.data[1])) ==
+                        ("YWVTSRQPNMLKIHGFEDCA", "....HHHHEEEECCCC...."))
+        # joined alphabets with 255 or more pairs (uint16 indices) with storage 'one_hot'
+        alphabet = ("ACDEFGHIKLMNPQRSTVWY", "().[]{}<>,|*AB")
+        record = ("ACDEFGHIKLMNPQRSTVWY", "().[]{}<>,|*AB()..()")
+        protein = Data.from_records([record, record], [0, 1], alphabet)
+        self.assertTrue(protein.data[:].shape == (2, 20, 280))
+        self.assertTrue(protein.alpha_coder.decode(protein.one_hot_encoder.decode(protein.data[0])) == record)
+        with self.assertRaises(ValueError):
+            Data.from_records([record], [0], alphabet, storage="index")
+
+
+    def test_data_from_arrays(self):
+        one_hot = self.data_dna.data[:]
+        labels = np.argmax(self.data_dna.labels, axis=1)
+        data = Data.from_arrays(one_hot, labels, "ACGT")
+        self.assertTrue(data.data is one_hot and data.storage == "one_hot")
+        self.assertTrue(np.array_equal(data.labels, self.data_dna.labels))
+        indices = np.argmax(one_hot, axis=2).astype(np.uint8)
+        data = Data.from_arrays(indices, self.data_dna.labels, "ACGT")
+        self.assertTrue(data.tokens is indices and data.multilabel)
+        self.assertTrue(np.array_equal(data.data[:], one_hot))
+        inputs, _ = data._get_data("train")
+        self.assertTrue(inputs.shape == (70, 32, 4))
+        pwm = Data([dirname(__file__) + '/data/rna_pwm1.fasta'], ('ACGU', '().'), structure_pwm=True, storage="index")
+        data = Data.from_arrays((pwm.tokens, pwm.profiles), np.zeros(len(pwm.tokens), dtype=int), ('ACGU', '().'), structure_pwm=True)
+        self.assertTrue(np.array_equal(data.data[:], pwm.data[:]))
+        with self.assertRaises(ValueError):
+            Data.from_arrays(one_hot[:, :, :3], labels, "ACGT")
+        with self.assertRaises(ValueError):
+            Data.from_arrays(indices + 4, labels, "ACGT")
+        with self.assertRaises(ValueError):
+            Data.from_arrays((pwm.tokens, pwm.profiles[:, :, :2]), np.zeros(len(pwm.tokens), dtype=int), ('ACGU', '().'), structure_pwm=True)
+
+
+    def test_data_deduplicate(self):
+        rng = np.random.RandomState(7)
+        unique = ["".join(rng.choice(list("ACGT"), 20)) for _ in range(30)]
+        picks = rng.randint(0, 30, 200)
+        labels = picks % 2
+        data = Data.from_records([unique[x] for x in picks], labels, "ACGT", storage="packed")
+        dedup = data.deduplicate()
+        n_unique = len(np.unique(picks))
+        self.assertTrue(len(dedup.indices) == n_unique)
+        self.assertTrue(np.array_equal(dedup.indices, np.sort(np.unique(picks, return_index=True)[1])))
+        self.assertTrue(dedup.counts.sum() == 200 and dedup.counts[dedup.indices].min() >= 1)
+        self.assertTrue(np.array_equal(dedup.data[dedup.indices][dedup.inverse], data.data[:]))
+        self.assertTrue(sum(len(dedup.splits[x]) for x in dedup.splits) == n_unique)
+        self.assertTrue(np.array_equal(dedup.scatter(np.arange(n_unique)), dedup.inverse))
+        with self.assertRaises(ValueError):
+            dedup.scatter(np.arange(n_unique + 1))
+        with self.assertRaises(RuntimeError):
+            data.scatter(np.arange(200))
+        class_weights = dedup._get_class_weights()
+        totals = [dedup.counts[dedup.indices][labels[dedup.indices] == x].sum() for x in range(2)]
+        self.assertTrue(np.isclose(class_weights[0] / class_weights[1], totals[1] / totals[0]))
+        weights = dedup._get_sample_weights()[dedup.indices]
+        self.assertTrue(np.allclose(weights, dedup.counts[dedup.indices] * [class_weights[x] for x in labels[dedup.indices]]))
+        self.assertTrue(data._get_sample_weights() is None)
+        # identical sequences with different labels are different entries
+        flipped = Data.from_records([unique[0]] * 4, [0, 1, 0, 1], "ACGT").deduplicate()
+        self.assertTrue(np.array_equal(flipped.counts[flipped.indices], [2, 2]))
+        self.assertTrue(np.array_equal(flipped.scatter(["a", "b"]), ["a", "b", "a", "b"]))
+        # the hash values don't depend on the padding of sequences of variable length
+        ragged = Data.from_records(["ACGTA", "AC", "ACGTA" + "A" * 30, "AC", "ACA"], [0] * 5, "ACGT",
+                                   storage="index", variable_length=True).deduplicate()
+        self.assertTrue(np.array_equal(ragged.indices, [0, 1, 2, 4]))
+        self.assertTrue(np.array_equal(ragged.inverse, [0, 1, 2, 1, 3]))
+        nested = dedup.subset(np.arange(5)).deduplicate()
+        self.assertTrue(np.array_equal(nested.counts[nested.indices], dedup.counts[dedup.indices[:5]]))
+        folder = mkdtemp()
+        dedup.save_mmap(folder)
+        loaded = Data.open_mmap(folder)
+        self.assertTrue(np.array_equal(loaded.counts, dedup.counts) and np.array_equal(loaded.inverse, dedup.inverse))
+        rmtree(folder)
+
+
+    def test_data_replace_invalid(self):
+        out = mkdtemp()
+        rng = np.random.RandomState(42)
+        file_name = out + "/invalid.fasta"
+        with open(file_name, "wt") as handle:
+            for i in range(200):
+                handle.write(">{}\n{}\n".format(i, "".join(rng.choice(list("ACGTNnacx"), 30))))
+        module = importlib.import_module("pysster.Data")
+        shard_size = module._SHARD_SIZE
+        module._SHARD_SIZE = 300
+        try:
+            data = Data([file_name, file_name], "ACGT", seed=5)
+            self.assertTrue((data.data.sum(axis=2) == 1).all())
+            for chunk_size, n_jobs in [(7, 1), (1000, 2), (3, 3)]:
+                other = Data([file_name, file_name], "ACGT", seed=5, chunk_size=chunk_size, n_jobs=n_jobs)
+                self.assertTrue(np.array_equal(data.data, other.data))
+            other = Data([file_name, file_name], "ACGT", seed=6)
+            self.assertFalse(np.array_equal(data.data, other.data))
+            with open(file_name, "rt") as handle:
+                sequence = handle.read().split("\n")[1].upper()
+            decoded = data.one_hot_encoder.decode(data.data[0])
+            self.assertTrue(all(x == y for x, y in zip(sequence, decoded) if x in "ACGT"))
+            # entries at different positions/files get different replacements
+            self.assertFalse(np.array_equal(data.data[:200], data.data[200:]))
+            # appended files get new file ids, also if they share the class of an earlier file
+            for n_jobs in [1, 2]:
+                other = Data([file_name], "ACGT", seed=5)
+                other.append([file_name], classes=[0], n_jobs=n_jobs)
+                self.assertTrue(np.array_equal(data.data, other.data))
+            data.save_mmap(out + "/mmap")
+            other = Data.open_mmap(out + "/mmap", mmap_mode=None)
+            other.append([file_name], classes=[0])
+            self.assertFalse(np.array_equal(other.data[400:], other.data[:200]))
+            self.assertFalse(np.array_equal(other.data[400:], other.data[200:400]))
+        finally:
+            module._SHARD_SIZE = shard_size
+            rmtree(out)
+
+
+    def test_data_pwm_bulk(self):
+        folder = dirname(__file__)
+        rna_pwm = [folder + '/data/rna_pwm1.fasta', folder + '/data/rna_pwm2.fasta']
+        ref = np.concatenate([encode_pwm_loop(x, "ACGU", "().") for x in rna_pwm])
+        self.assertTrue(np.array_equal(self.data_pwm.data, ref))
+        out = mkdtemp()
+        rng = np.random.RandomState(42)
+        file_name = out + "/pwm.fasta"
+        with open(file_name, "wt") as handle:
+            for i in range(50):
+                pwm = rng.dirichlet([1, 1, 1, 1], 25).T
+                handle.write(">{}\n{}\n".format(i, "".join(rng.choice(list("ACGU"), 25))))
+                for row in pwm:
+                    handle.write("\t".join(str(x) for x in row) + " \n")
+        data = Data(file_name, ("ACGU", "()[]"), structure_pwm=True, chunk_size=7)
+        self.assertTrue(np.array_equal(data.data, encode_pwm_loop(file_name, "ACGU", "()[]")))
+        with open(file_name, "at") as handle:
+            handle.write(">50\n{}\n0.5 0.5\n0.5\n0.0\n0.0\n".format("A"*25))
+        with self.assertRaises(RuntimeError):
+            Data(file_name, ("ACGU", "()[]"), structure_pwm=True)
+        rmtree(out)
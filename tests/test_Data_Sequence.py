@@ -0,0 +1,160 @@
+import unittest
+import numpy as np
+from os.path import dirname
+from tempfile import mkdtemp
+from shutil import rmtree
+from keras.callbacks import History
+
+
+from pysster.Data import Data
+from pysster.Data_Sequence import Data_Sequence
+from pysster.Model import Model
+
+
+class Test_Data_Sequence(unittest.TestCase):
+
+
+    def setUp(self):
+        folder = dirname(__file__)
+        self.data = Data([folder + "/data/dna_pos.fasta", folder + "/data/dna_neg.fasta"], "ACGT")
+
+
+    def test_data_sequence_batches(self):
+        idx = self.data._get_idx("train")
+        seq = Data_Sequence(self.data, "train", 7, shuffle=False)
+        self.assertTrue(len(seq) == -(-len(idx) // 7))
+        x, y = seq[1]
+        self.assertTrue(np.array_equal(x, self.data.data[idx[7:14]]))
+        self.assertTrue(np.array_equal(y, self.data.labels[idx[7:14]]))
+        self.assertTrue(np.array_equal(seq[-1][0], self.data.data[idx[((len(seq)-1)*7):]]))
+        with self.assertRaises(IndexError):
+            seq[len(seq)]
+        seq.on_epoch_end()
+        self.assertTrue(np.array_equal(seq[1][0], x))
+        inputs = Data_Sequence(self.data, "train", 7, shuffle=False, labels=False, select=[2, 0])[0]
+        self.assertTrue(len(inputs) == 1 and np.array_equal(inputs[0], self.data.data[idx[[2, 0]]]))
+
+
+    def test_data_sequence_shuffle(self):
+        idx = self.data._get_idx("all")
+        seq1 = Data_Sequence(self.data, "all", 5, seed=3)
+        seq2 = Data_Sequence(self.data, "all", 5, seed=3)
+        order = np.concatenate(seq1.batches)
+        self.assertTrue(np.array_equal(np.sort(order), idx))
+        self.assertFalse(np.array_equal(order, idx))
+        self.assertTrue(np.array_equal(seq1[0][0], seq2[0][0]))
+        seq1.on_epoch_end()
+        self.assertFalse(np.array_equal(np.concatenate(seq1.batches), order))
+        self.assertTrue(np.array_equal(np.sort(np.concatenate(seq1.batches)), idx))
+
+
+    def test_data_sequence_augment(self):
+        out = mkdtemp()
+        rng = np.random.RandomState(1)
+        with open(out + "/dna.fasta", "wt") as handle:
+            for i in range(50):
+                handle.write(">{}\n{}\n".format(i % 2, "".join(rng.choice(list("ACGT"), 30))))
+        data = Data(out + "/dna.fasta", "ACGT")
+        rmtree(out)
+        n = len(data.labels)
+        original = data.data[:]
+        reverse = original[:, ::-1, ::-1] # ACGT -> TGCA
+        seq = Data_Sequence(data, "all", n, shuffle=False, reverse_complement=True, seed=1)
+        batch = seq[0][0]
+        flipped = np.array([np.array_equal(x, y) for x, y in zip(batch, reverse)])
+        self.assertTrue(all(np.array_equal(x, y) for x, y in zip(batch[~flipped], original[~flipped])))
+        self.assertTrue(0 < flipped.sum() < n)
+        self.assertTrue(np.array_equal(Data_Sequence(data, "all", n, shuffle=False, reverse_complement=True, seed=1)[0][0], batch))
+        seq.on_epoch_end()
+        self.assertFalse(np.array_equal(seq[0][0], batch))
+        batch = Data_Sequence(data, "all", n, shuffle=False, max_shift=3, seed=1)[0][0]
+        for x, y in zip(batch, original):
+            shifted = [np.array_equal(x[max(s, 0):(len(x)+min(s, 0))], y[max(-s, 0):(len(y)-max(s, 0))]) and
+                       x.sum() == len(x) - abs(s) for s in range(-3, 4)]
+            self.assertTrue(any(shifted))
+        for x, y in zip(*[data.to_dataset("all", n, False, reverse_complement=True).as_numpy_iterator().next()[0], original]):
+            self.assertTrue(np.array_equal(x, y) or np.array_equal(x, y[::-1, ::-1]))
+        with self.assertRaises(ValueError):
+            Data_Sequence(Data(dirname(__file__) + "/data/dna_pos.fasta", "ACGTQ"), "all", 10, reverse_complement=True)
+
+
+    def test_data_sequence_augment_structure(self):
+        out = mkdtemp()
+        with open(out + "/rna.fasta", "wt") as handle:
+            handle.write(">0\nAACGU\n((.))\n>1\nGGAC\n.(.)\n>1\nCUGAGUC\n(((.)))\n")
+        data = Data(out + "/rna.fasta", ("ACGU", "()."), storage="index", variable_length=True)
+        batch = Data_Sequence(data, "all", 3, shuffle=False, reverse_complement=True, seed=0)[0]
+        expected = {("AACGU", "((.))"): ("ACGUU", "((.))"), ("GGAC", ".(.)"): ("GUCC", "(.)."),
+                    ("CUGAGUC", "(((.)))"): ("GACUCAG", "(((.)))")}
+        for x, y, length in zip(data.data[:], batch[0], data.lengths):
+            record = data.alpha_coder.decode_indices(x[:length].argmax(axis=1))
+            augmented = data.alpha_coder.decode_indices(y[:length].argmax(axis=1))
+            self.assertTrue(augmented in [record, expected[record]])
+            self.assertTrue(y[length:].sum() == 0)
+        rmtree(out)
+
+
+    def test_data_sequence_variable_length(self):
+        rng = np.random.RandomState(0)
+        lengths = rng.randint(50, 2001, 2000)
+        data = Data.from_records(["A" * x for x in lengths], np.arange(2000) % 2, "ACGT", storage="index", variable_length=True)
+        seq = Data_Sequence(data, "all", 64, seed=1)
+        batches = [{tuple(sorted(x)) for x in seq.batches}]
+        seq.on_epoch_end()
+        batches.append({tuple(sorted(x)) for x in seq.batches})
+        # batches of similar length, but with different entries in every epoch
+        self.assertTrue(len(batches[0] & batches[1]) < len(batches[0]) // 4)
+        padding = sum((data.lengths[list(x)].max() - data.lengths[list(x)]).sum() for x in batches[1])
+        self.assertTrue(padding < 0.2 * lengths.sum())
+
+
+    def test_data_sequence_model(self):
+        model = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2,
+                       "epochs":2, "workers":2, "max_queue_size":4,
+                       "augment_rc":True, "augment_shift":2}, self.data)
+        model.train(self.data, verbose=False)
+        predictions = model.predict(self.data, "all")
+        self.assertTrue(predictions.shape == (len(self.data.labels), 2))
+
+
+    def test_data_sequence_predict_meta(self):
+        folder = dirname(__file__)
+        data = Data([folder + '/data/rna_pwm1.fasta', folder + '/data/rna_pwm2.fasta'], ("ACGU", "()."), structure_pwm=True)
+        additional = [folder + '/data/rna_pwm1_add.txt', folder + '/data/rna_pwm2_add.txt']
+        data.load_additional_data(additional, is_categorical=False)
+        data.load_additional_data(additional, is_categorical=True, embedding=True)
+        batch = Data_Sequence(data, "all", 8, shuffle=False, labels=False)[0]
+        self.assertTrue(len(batch) == 1 and len(batch[0]) == 3)
+        inputs = next(data._data_generator("all", 8, False, False))
+        self.assertTrue(isinstance(inputs, list) and all(np.array_equal(x, y) for x, y in zip(inputs, batch[0])))
+        model = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2, "epochs":1, "workers":2}, data)
+        model.train(data, verbose=False)
+        self.assertTrue(model.predict(data, "all").shape == (len(data.labels), 2))
+
+
+    def test_data_sequence_deduplicated(self):
+        rng = np.random.RandomState(3)
+        unique = ["".join(rng.choice(list("ACGT"), 30)) for _ in range(40)]
+        picks = rng.randint(0, 40, 120)
+        dedup = Data.from_records([unique[x] for x in picks], picks % 2, "ACGT").deduplicate()
+        x, y, weights = Data_Sequence(dedup, "train", 5, shuffle=False)[0]
+        self.assertTrue(np.array_equal(weights, dedup.counts[dedup.splits["train"][:5]]))
+        self.assertTrue(len(Data_Sequence(dedup, "train", 5, labels=False)[0]) == 1)
+        for tf_data in [False, True]:
+            model = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2,
+                           "epochs":1, "tf_data":tf_data}, dedup)
+            model.train(dedup, verbose=False)
+            predictions = dedup.scatter(model.predict(dedup, "all"))
+            self.assertTrue(predictions.shape == (120, 2))
+        # both backends report the same validation loss for the same weights
+        weights, val_loss = None, []
+        for tf_data in [False, True]:
+            model = Model({"conv_num":1, "kernel_num":2, "kernel_len":4, "neuron_num":2,
+                           "epochs":1, "learning_rate":1e-12, "tf_data":tf_data}, dedup)
+            weights = model.model.get_weights() if weights is None else weights
+            model.model.set_weights(weights)
+            history = History()
+            model.callbacks.append(history)
+            model.train(dedup, verbose=False)
+            val_loss.append(history.history["val_loss"][0])
+        self.assertTrue(np.isclose(val_loss[0], val_loss[1], rtol=1e-3))
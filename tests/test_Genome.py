@@ -0,0 +1,88 @@
+import unittest
+import numpy as np
+from tempfile import mkdtemp
+from shutil import rmtree
+
+
+from pysster.Genome import Genome
+from pysster.Data import Data
+
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans("ACGTacgt", "TGCAtgca"))
+
+
+class Test_Genome(unittest.TestCase):
+
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        rng = np.random.RandomState(42)
+        self.sequences = {"chr1": "".join(rng.choice(list("ACGTacgtN"), 100)),
+                          "chr2": "".join(rng.choice(list("ACGT"), 63)),
+                          "chrM": "".join(rng.choice(list("ACGT"), 7))}
+        self.fasta = self.write(self.sequences, 10, "\n")
+
+
+    def tearDown(self):
+        rmtree(self.folder)
+
+
+    def write(self, sequences, width, newline, name="genome.fa"):
+        file_name = self.folder + "/" + name
+        with open(file_name, "wt", newline="") as handle:
+            for name, sequence in sequences.items():
+                handle.write(">{} description{}".format(name, newline))
+                for x in range(0, len(sequence), width):
+                    handle.write(sequence[x:x+width] + newline)
+        return file_name
+
+
+    def test_genome_fetch(self):
+        for newline in ["\n", "\r\n"]:
+            genome = Genome(self.write(self.sequences, 10, newline, "genome{}.fa".format(len(newline))))
+            self.assertTrue(genome.lengths == {name: len(x) for name, x in self.sequences.items()})
+            for name, sequence in self.sequences.items():
+                for start, end in [(0, len(sequence)), (0, 1), (3, 7), (6, 10), (9, 21), (len(sequence)-1, len(sequence))]:
+                    start, end = min(start, len(sequence)), min(end, len(sequence))
+                    self.assertTrue(genome.fetch(name, start, end) == sequence[start:end])
+                    self.assertTrue(genome.fetch(name, start, end, "-") == reverse_complement(sequence[start:end]))
+            with self.assertRaises(ValueError):
+                genome.fetch("chr3", 0, 1)
+            with self.assertRaises(ValueError):
+                genome.fetch("chr1", 50, 101)
+            genome.close()
+
+
+    def test_genome_index(self):
+        genome = Genome(self.fasta)
+        with open(self.fasta + ".fai", "rt") as handle:
+            lines = handle.read().splitlines()
+        # the samtools faidx index of the file
+        self.assertTrue(lines == ["chr1\t100\t18\t10\t11", "chr2\t63\t146\t10\t11", "chrM\t7\t234\t7\t8"])
+        genome.close()
+        genome = Genome(self.fasta)
+        self.assertTrue(genome.fetch("chr2", 5, 25) == self.sequences["chr2"][5:25])
+        genome.close()
+        with open(self.folder + "/broken.fa", "wt") as handle:
+            handle.write(">chr1\nACGT\nACG\nACGT\n")
+        with self.assertRaises(ValueError):
+            Genome(self.folder + "/broken.fa")
+
+
+    def test_genome_data(self):
+        intervals = [("chr1", 10, 30, "+"), ("chr2", 40, 60, "-"), ("chr1", 80, 100, "-"), ("chr2", 0, 20, "+")]
+        with open(self.folder + "/intervals.bed", "wt") as handle:
+            for i, (name, start, end, strand) in enumerate(intervals):
+                handle.write("{}\t{}\t{}\tpeak{}\t0\t{}\n".format(name, start, end, i, strand))
+        records = [self.sequences[name][start:end] if strand == "+" else reverse_complement(self.sequences[name][start:end])
+                   for name, start, end, strand in intervals]
+        expected = Data.from_records(records, [0, 1, 1, 0], "ACGT", seed=3)
+        for source in [intervals, self.folder + "/intervals.bed"]:
+            data = Data.from_intervals(self.fasta, source, [0, 1, 1, 0], seed=3)
+            self.assertTrue(np.array_equal(data.data[:], expected.data[:]))
+            self.assertTrue(np.array_equal(data.labels, expected.labels))
+        data = Data.from_intervals(Genome(self.fasta), [("chrM", 0, 7), ("chr2", 3, 5)], [0, 1], storage="index", variable_length=True)
+        self.assertTrue(np.array_equal(data.lengths, [7, 2]))
+        with self.assertRaises(RuntimeError):
+            Data.from_intervals(self.fasta, [("chrM", 0, 7), ("chr2", 3, 5)], [0, 1])
@@ -33,4 +33,48 @@ class Test_One_Hot_Encoder(unittest.TestCase):
 
     def test_one_hot_encoder_decode(self):
         decoded = self.one.decode(self.reference_one_hot)
-        self.assertTrue(np.array_equal(decoded, self.reference_seq))
\ No newline at end of file
+        self.assertTrue(np.array_equal(decoded, self.reference_seq))
+
+
+    def test_one_hot_encoder_encode_batch(self):
+        sequences = [self.reference_seq, "ACGTACG", "TTTTTTT"]
+        encoded = self.one.encode_batch(sequences)
+        self.assertTrue(encoded.shape == (3, 7, 4))
+        self.assertTrue(encoded.dtype == np.uint8)
+        self.assertTrue(np.array_equal(encoded[0], self.reference_one_hot))
+        for x in range(3):
+            self.assertTrue(np.array_equal(encoded[x], self.one.encode(sequences[x])))
+        with self.assertRaises(ValueError):
+            self.one.encode_batch(["GATTNCA"])
+        with self.assertRaises(RuntimeError):
+            self.one.encode_batch(["GATTACA", "GATTAC"])
+
+
+    def test_one_hot_encoder_decode_batch(self):
+        sequences = [self.reference_seq, "ACGTACG", "TTTTTTT"]
+        decoded = self.one.decode_batch(self.one.encode_batch(sequences))
+        self.assertTrue(decoded == sequences)
+
+
+    def test_one_hot_encoder_large_alphabet(self):
+        # e.g. the joined alphabet of protein sequences and structures (80 symbols, not ASCII)
+        alphabet = "".join(chr(65+x) for x in range(80))
+        one = One_Hot_Encoder(alphabet)
+        sequences = [alphabet[::-1][:40], alphabet[40:]]
+        encoded = one.encode_batch(sequences)
+        self.assertTrue(encoded.shape == (2, 40, 80))
+        self.assertTrue(np.array_equal(np.argmax(encoded[1], axis=1), np.arange(40, 80)))
+        self.assertTrue(one.decode_batch(encoded) == sequences)
+        self.assertTrue(one.decode(one.encode(alphabet)) == alphabet)
+        with self.assertRaises(ValueError):
+            one.encode_batch(["İ" * 40])
+        # alphabets with 255 or more symbols use uint16 indices
+        alphabet = "".join(chr(65+x) for x in range(280))
+        one = One_Hot_Encoder(alphabet)
+        indices = one.encode_indices([alphabet[::-1], alphabet])
+        self.assertTrue(indices.dtype == np.uint16)
+        self.assertTrue(np.array_equal(indices[1], np.arange(280)))
+        self.assertTrue(one.encode_batch([alphabet]).shape == (1, 280, 280))
+        self.assertTrue(one.decode_batch(one.encode_batch([alphabet[::-1], alphabet])) == [alphabet[::-1], alphabet])
+        with self.assertRaises(ValueError):
+            one.encode_batch(["!" * 280])
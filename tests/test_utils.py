@@ -1,5 +1,10 @@
 import unittest
+import gzip
+import pickle
+import struct
+import zlib
 import numpy as np
+from io import BytesIO, StringIO
 from tempfile import gettempdir
 from os.path import dirname, isfile
 from os import remove
@@ -12,6 +17,18 @@ from pysster.Motif import Motif
 from pysster import utils
 
 
+def write_bgzf(file_name, data, block_size=60000):
+    # blocks as written by bgzip: gzip members with a "BC" extra field and an empty last block
+    with open(file_name, "wb") as handle:
+        for x in list(range(0, len(data), block_size)) + [len(data)]:
+            block = data[x:(x+block_size)]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated = compressor.compress(block) + compressor.flush()
+            handle.write(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00")
+            handle.write(struct.pack("<H", len(deflated) + 25) + deflated)
+            handle.write(struct.pack("<II", zlib.crc32(block), len(block)))
+
+
 class Test_utils(unittest.TestCase):
 
 
@@ -45,6 +62,44 @@ class Test_utils(unittest.TestCase):
         data = utils.load_data(gettempdir()+"/data")
         self.assertTrue(isinstance(data, Data))
         remove(gettempdir()+"/data")
+        block_size, utils._DATA_BLOCK_SIZE = utils._DATA_BLOCK_SIZE, 100
+        data = Data(self.folder + "/data/rna.fasta", ("ACGU", "()."), storage="index")
+        for compress in [True, False]:
+            utils.save_data(data, gettempdir()+"/data", compress=compress, n_threads=2)
+            loaded = utils.load_data(gettempdir()+"/data")
+            self.assertTrue(np.array_equal(loaded.tokens, data.tokens))
+            self.assertTrue(np.array_equal(loaded.labels, data.labels))
+            self.assertTrue(np.array_equal(loaded.data[:], data.data[:]))
+            self.assertTrue(all(np.array_equal(loaded.splits[x], data.splits[x]) for x in data.splits))
+        utils._DATA_BLOCK_SIZE = block_size
+        # gzipped pickles written by earlier versions, i.e. with the attribute layout of
+        # earlier versions (lists of per-sequence arrays, encoders without lookup tables)
+        n = len(data.labels)
+        categories = np.eye(2)[np.arange(n) % 2]
+        old = Data.__new__(Data)
+        old.__dict__.update({"meta": {0: {"data": list(categories), "is_categorical": True},
+                                      1: {"data": np.arange(n, dtype=np.float64), "is_categorical": False}},
+                             "is_rna_pwm": False, "is_rna": True, "multilabel": True,
+                             "alpha_coder": self._old_object(data.alpha_coder, ["_encodeTable", "_decodeTable", "alphabet", "alph0", "alph1"]),
+                             "one_hot_encoder": self._old_object(data.one_hot_encoder, ["alphabet", "table", "table_rev"]),
+                             "data": list(data.data[:]), "labels": list(data.labels), "splits": data.splits})
+        with gzip.open(gettempdir()+"/data", "wb") as handle:
+            pickle.dump(old, handle, pickle.HIGHEST_PROTOCOL)
+        loaded = utils.load_data(gettempdir()+"/data")
+        self.assertTrue(np.array_equal(loaded.data[:], data.data[:]))
+        self.assertTrue(np.array_equal(loaded.labels, data.labels) and loaded.multilabel)
+        self.assertTrue(np.array_equal(loaded.additional, np.concatenate([categories, np.arange(n)[:, np.newaxis]], axis=1)))
+        self.assertTrue(loaded.get_summary() == data.get_summary())
+        inputs, labels = next(loaded._data_generator("train", 4, False))
+        self.assertTrue(inputs[0].shape == (4,) + data.data.shape[1:] and inputs[1].shape == (4, 3))
+        self.assertTrue(np.array_equal(labels, data.labels[data.splits["train"][:4]]))
+        remove(gettempdir()+"/data")
+
+
+    def _old_object(self, obj, names):
+        old = obj.__class__.__new__(obj.__class__)
+        old.__dict__.update({name: getattr(obj, name) for name in names})
+        return old
 
     
     def test_utils_annotate_structures(self):
@@ -103,3 +158,57 @@ class Test_utils(unittest.TestCase):
             comp = handle.read()
         self.assertTrue(ref == comp)
         remove(gettempdir()+"/test.meme")
+
+
+    def test_utils_parse_fasta(self):
+        text = b">a\r\nACGT\r\nAC GT \n>b\n>c\n\n>d 1,2\n((..))\n\n.(). \n>e"
+        ref = [(b"a", b"ACGT_AC GT"), (b"b", b""), (b"d 1,2", b"((..))__.().")]
+        for block_size in [1, 3, 1000]:
+            parsed = list(utils.parse_fasta_bytes(BytesIO(text), b"_", block_size = block_size))
+            self.assertTrue(parsed == ref)
+        for handle in [StringIO(text.decode()), BytesIO(text)]:
+            parsed = list(utils.parse_fasta(handle, "_"))
+            self.assertTrue(parsed == [(x.decode(), y.decode()) for x, y in ref])
+        # the str version parses decoded blocks of complete lines without trailing whitespace
+        for block_size in [1, 3, 1000]:
+            blocks = list(utils._text_blocks(BytesIO(text), block_size))
+            self.assertTrue("".join(blocks) == ">a\nACGT\nAC GT\n>b\n>c\n\n>d 1,2\n((..))\n\n.().\n>e\n")
+        with open(self.folder + "/data/rna.fasta", "rb") as handle:
+            entries = list(utils.parse_fasta_bytes(handle, b"_", as_array = True))
+        self.assertTrue(len(entries) == len(self.data.data))
+        self.assertTrue(entries[0][1].dtype == np.uint8)
+        with open(self.folder + "/data/rna.fasta", "rt") as handle:
+            lines = handle.read().split("\n")
+        self.assertTrue(entries[0][0] == lines[0][1:].rstrip().encode())
+        self.assertTrue(entries[0][1].tobytes() == "_".join(x.rstrip() for x in lines[1:3]).encode())
+
+
+    def test_utils_bgzf(self):
+        rng = np.random.RandomState(42)
+        text = b"".join(b">" + str(i).encode() + b"\n" + rng.choice(list(b"ACGT"), 150).astype(np.uint8).tobytes() + b"\n"
+                        for i in range(3000))
+        file_name = gettempdir() + "/test.fasta.gz"
+        write_bgzf(file_name, text, 1000)
+        # the blocks are valid gzip members, i.e. gzip reads the file, too
+        with gzip.open(file_name, "rb") as handle:
+            self.assertTrue(handle.read() == text)
+        for n_threads in [1, 3]:
+            with utils.get_handle(file_name, "rb", n_threads) as handle:
+                self.assertTrue(not isinstance(handle, gzip.GzipFile))
+                self.assertTrue(handle.read(10) + handle.read() == text)
+            with utils.get_handle(file_name, "rb", n_threads) as handle:
+                parsed = list(utils.parse_fasta_bytes(handle, block_size = 777))
+            self.assertTrue(len(parsed) == 3000 and parsed[-1][0] == b"2999")
+        with utils.get_handle(file_name, "rt") as handle:
+            self.assertTrue(handle.readline() == ">0\n")
+        with open(file_name, "r+b") as handle:
+            handle.seek(-30, 2)
+            handle.write(b"\x00\x00\x00\x00")
+        with self.assertRaises(OSError):
+            with utils.get_handle(file_name, "rb") as handle:
+                handle.read()
+        with gzip.open(file_name, "wb") as handle:
+            handle.write(text)
+        with utils.get_handle(file_name, "rb") as handle:
+            self.assertTrue(isinstance(handle, gzip.GzipFile) and handle.read() == text)
+        remove(file_name)